@@ -0,0 +1,65 @@
+"""Porównanie liczenia promili: compute_bac() per użytkownik vs BacState vs wsad NumPy.
+
+Uruchomienie (z katalogu repozytorium):
+    python benchmarks/bac_batch.py [liczba_użytkowników] [zdarzeń_na_użytkownika]
+"""
+import os
+import sys
+import time
+import random
+import datetime
+from datetime import timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import bot  # noqa: E402
+
+
+def generate_users(n_users: int, n_events: int, seed: int = 42) -> dict:
+    rng = random.Random(seed)
+    now = datetime.datetime.now(timezone.utc)
+    types = list(bot.SUBSTANCE_KEYS)
+    users = {}
+    for i in range(n_users):
+        data = bot.create_new_user(f"user{i}")
+        data.weight = rng.uniform(50.0, 120.0)
+        for _ in range(n_events):
+            typ = rng.choice(types)
+            ts = now - datetime.timedelta(minutes=rng.uniform(0, 12 * 60))
+            data.add_event(bot.SUBSTANCE_INDEX[typ], 1, ts.timestamp())
+        users[str(i)] = data
+    return users
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+def main():
+    n_users = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    n_events = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    users = generate_users(n_users, n_events)
+    now = time.time()
+    now_dt = datetime.datetime.fromtimestamp(now, timezone.utc)
+
+    scalar, t_scalar = timed(lambda: {uid: bot.compute_bac(d, d.weight, now_dt) for uid, d in users.items()})
+    _, t_state_build = timed(lambda: [bot.user_bac("bench", uid, d, now) for uid, d in users.items()])
+    state, t_state = timed(lambda: {uid: bot.user_bac("bench", uid, d, now) for uid, d in users.items()})
+    bot.bac_columns.pop("bench", None)
+    _, t_batch_build = timed(lambda: bot.guild_bac_values("bench", users, now))
+    batch, t_batch = timed(lambda: bot.guild_bac_values("bench", users, now))
+
+    # Zgodność z compute_bac() sprawdzają testy (tests/test_bac.py) – tu tylko informacyjnie
+    state_diff = max((abs(state[uid] - expected) for uid, expected in scalar.items()), default=0.0)
+    batch_diff = max((abs(batch.get(uid, 0.0) - expected) for uid, expected in scalar.items()), default=0.0)
+
+    print(f"users={n_users} events_per_user={n_events} numpy={bot.np is not None}")
+    print(f"max_abs_diff_state={state_diff:.2e} max_abs_diff_batch={batch_diff:.2e}")
+    print(f"compute_bac_scalar_s={t_scalar:.4f}")
+    print(f"bac_state_build_s={t_state_build:.4f} bac_state_query_s={t_state:.4f}")
+    print(f"batch_build_s={t_batch_build:.4f} batch_query_s={t_batch:.4f}")
+
+
+if __name__ == "__main__":
+    main()
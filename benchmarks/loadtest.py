@@ -0,0 +1,485 @@
+"""Test obciążeniowy bez połączenia z Discordem: prawdziwe handlery z bot.py na
+sztucznych gildiach, kanałach i wiadomościach oraz symulowanym REST-cie z
+opóźnieniem i limitami tras (429 + retry_after, jak w discord.py).
+
+Scenariusze (każdy w osobnym procesie, na świeżych danych):
+    render    – build_leaderboard_embed / build_bac_leaderboard_embed dla wszystkich gildii
+    steady    – kolejne przebiegi update_tasks bez zmian w danych
+    friday    – "piątkowy wieczór": lawina reakcji w wiadomościach statusowych
+                równolegle z przebiegami update_tasks
+    rollover  – zmiana miesiąca: roll_up_history i przebieg update_tasks
+
+Wynik to JSON (stdout albo --out), który można porównać między commitami.
+
+Uruchomienie (z katalogu repozytorium):
+    python benchmarks/loadtest.py [--guilds 20] [--users 200] [--events 20] [--scenario friday ...] [--out wynik.json]
+    python benchmarks/loadtest.py compare stary.json nowy.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import platform
+import datetime
+import tempfile
+import subprocess
+import multiprocessing
+from datetime import timezone
+
+REPO = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+os.environ.setdefault("METRICS_ENABLED", "1")
+os.environ.setdefault("STORAGE_ENGINE", "json")
+sys.path.insert(0, REPO)
+import bot  # noqa: E402
+
+# Limity Discorda (zapytania, okno w sekundach) – to, co egzekwuje serwer, a nie budżet bota
+DISCORD_LIMITS = {"messages": (5, 5.0), "reactions": (1, 0.25), "guild": (10, 10.0)}
+DISCORD_GLOBAL_PER_SECOND = 50
+
+
+# ---------------------------------------------
+# SYMULOWANY REST: opóźnienie i limity tras
+# ---------------------------------------------
+class RouteWindow:
+    __slots__ = ("limit", "period", "remaining", "reset_at")
+
+    def __init__(self, limit: int, period: float):
+        self.limit = limit
+        self.period = period
+        self.remaining = limit
+        self.reset_at = 0.0
+
+    def take(self, now: float) -> float:
+        """0 – zapytanie przechodzi, w przeciwnym razie retry_after z odpowiedzi 429."""
+        if now >= self.reset_at:
+            self.remaining = self.limit
+            self.reset_at = now + self.period
+        if self.remaining > 0:
+            self.remaining -= 1
+            return 0.0
+        return self.reset_at - now
+
+
+class FakeRest:
+    def __init__(self, rng: random.Random, latency: float, jitter: float):
+        self.rng = rng
+        self.latency = latency
+        self.jitter = jitter
+        self.windows = {}  # (trasa, id) -> RouteWindow
+        self.global_window = RouteWindow(DISCORD_GLOBAL_PER_SECOND, 1.0)
+        self.calls = {}
+        self.rate_limited = 0
+        self.retry_wait = 0.0
+
+    async def call(self, route: str, major_id: int) -> None:
+        key = (route, major_id)
+        window = self.windows.get(key)
+        if window is None:
+            window = self.windows[key] = RouteWindow(*DISCORD_LIMITS[route])
+        while True:
+            now = time.monotonic()
+            retry_after = window.take(now) or self.global_window.take(now)
+            if not retry_after:
+                break
+            # discord.py po 429 czeka retry_after i ponawia zapytanie
+            self.rate_limited += 1
+            self.retry_wait += retry_after
+            await asyncio.sleep(retry_after)
+        await asyncio.sleep(max(0.0, self.rng.gauss(self.latency, self.jitter)))
+        self.calls[route] = self.calls.get(route, 0) + 1
+
+
+# ---------------------------------------------
+# SZTUCZNE OBIEKTY DISCORDA (tylko atrybuty używane przez bot.py)
+# ---------------------------------------------
+class FakeUser:
+    def __init__(self, user_id: int, name: str):
+        self.id = user_id
+        self.name = name
+        self.bot = False
+
+
+class FakeMember(FakeUser):
+    def __init__(self, guild, user_id: int, name: str, nick: str = None):
+        super().__init__(user_id, name)
+        self.guild = guild
+        self.nick = nick
+        self.display_name = nick or name
+
+
+class FakeMessage:
+    def __init__(self, channel, message_id: int):
+        self.channel = channel
+        self.guild = channel.guild
+        self.id = message_id
+        self.embed = None
+
+    async def edit(self, content=None, embed=None):
+        await self.channel.rest.call("messages", self.channel.id)
+        self.embed = embed
+
+    async def delete(self):
+        await self.channel.rest.call("messages", self.channel.id)
+
+    async def add_reaction(self, emoji):
+        await self.channel.rest.call("reactions", self.channel.id)
+
+    async def remove_reaction(self, emoji, member):
+        await self.channel.rest.call("reactions", self.channel.id)
+
+    async def clear_reaction(self, emoji):
+        await self.channel.rest.call("reactions", self.channel.id)
+
+
+class FakeChannel:
+    def __init__(self, guild, channel_id: int, rest: FakeRest):
+        self.guild = guild
+        self.id = channel_id
+        self.rest = rest
+        self.name = f"kanał-{channel_id}"
+        self.mention = f"<#{channel_id}>"
+        self.next_message_id = channel_id * 1000
+
+    def get_partial_message(self, message_id: int) -> FakeMessage:
+        return FakeMessage(self, message_id)
+
+    async def fetch_message(self, message_id: int) -> FakeMessage:
+        await self.rest.call("messages", self.id)
+        return FakeMessage(self, message_id)
+
+    async def send(self, content=None, embed=None) -> FakeMessage:
+        await self.rest.call("messages", self.id)
+        self.next_message_id += 1
+        return FakeMessage(self, self.next_message_id)
+
+
+class FakeGuild:
+    def __init__(self, guild_id: int, name: str, rest: FakeRest):
+        self.id = guild_id
+        self.name = name
+        self.rest = rest
+        self.owner_id = None
+        self.members = []
+        self._members = {}
+        self.channel = FakeChannel(self, guild_id + 1, rest)
+        self.text_channels = [self.channel]
+
+    def add_member(self, member: FakeMember) -> None:
+        self.members.append(member)
+        self._members[member.id] = member
+
+    def get_member(self, user_id: int):
+        return self._members.get(user_id)
+
+    def get_channel(self, channel_id: int):
+        return self.channel if channel_id == self.channel.id else None
+
+    async def fetch_member(self, user_id: int):
+        await self.rest.call("guild", self.id)
+        return self._members.get(user_id)
+
+    async def query_members(self, user_ids=None, limit: int = 5):
+        return [self._members[uid] for uid in user_ids if uid in self._members]
+
+
+class FakePayload:
+    """Odpowiednik discord.RawReactionActionEvent."""
+
+    def __init__(self, guild: FakeGuild, member: FakeMember, emoji: str):
+        self.guild_id = guild.id
+        self.channel_id = guild.channel.id
+        self.message_id = bot.get_guild_settings(guild)["status_message_id"]
+        self.user_id = member.id
+        self.member = member
+        self.emoji = emoji
+
+
+# ---------------------------------------------
+# GENERATOR DANYCH: N gildii × M użytkowników × K zdarzeń
+# ---------------------------------------------
+class World:
+    def __init__(self, params: dict):
+        self.params = params
+        self.rng = random.Random(params["seed"])
+        self.rest = FakeRest(self.rng, params["rest_latency"], params["rest_latency"] / 3)
+        self.guilds = []
+        self.samples = {}  # nazwa metryki -> surowe wartości
+
+    def build(self) -> None:
+        bot.load_data()
+        now = time.time()
+        month = bot.get_current_month()
+        history = [bot.shift_month(month, -i) for i in range(1, bot.RETENTION_MONTHS + 2)]
+        types = bot.SUBSTANCE_KEYS
+        for g in range(self.params["guilds"]):
+            gid = ((g + 1) << 22) | 7
+            guild = FakeGuild(gid, f"serwer{g}", self.rest)
+            users = {}
+            for u in range(self.params["users"]):
+                uid = gid * 10_000 + u
+                nick = f"ksywa{u}" if self.rng.random() < 0.3 else None
+                guild.add_member(FakeMember(guild, uid, f"user{g}_{u}", nick))
+                data = bot.UserRecord(f"user{g}_{u}" if self.rng.random() < 0.9 else None,
+                                      self.rng.uniform(55.0, 110.0), "promile")
+                for _ in range(self.params["events"]):
+                    sub = bot.SUBSTANCE_INDEX[self.rng.choice(types)]
+                    data.add_event(sub, 1, now - self.rng.uniform(0, 12 * 3600))
+                    bot.UserRecord._counters(data.monthly, month)[sub] += 1
+                for period in history:
+                    bot.UserRecord._counters(data.monthly, period)[self.rng.randrange(len(types))] += self.rng.randrange(1, 30)
+                users[str(uid)] = data
+            channel_id = guild.channel.id
+            settings = {
+                "dedicated_channel_id": channel_id,
+                "status_message_id": channel_id * 1000 - 3,
+                "live_leaderboard_channel_id": channel_id,
+                "live_leaderboard_message_id": channel_id * 1000 - 2,
+                "bac_leaderboard_channel_id": channel_id,
+                "bac_leaderboard_message_id": channel_id * 1000 - 1,
+            }
+            bot.guild_data[str(gid)] = bot.GuildRecord(settings, users)
+            self.guilds.append(guild)
+        bot.expiry_scheduler.rebuild(bot.guild_data)
+        bot.status_messages.rebuild(bot.guild_data.settings)
+        by_id = {guild.id: guild for guild in self.guilds}
+        bot.owned_guilds = lambda: list(self.guilds)
+        bot.bot.get_guild = by_id.get
+        bot.bot._connection.user = FakeUser(1, "alko-bot")
+        observe = bot.metrics.observe
+
+        def record(name, value, labels=()):
+            self.samples.setdefault(name, []).append(value)
+            observe(name, value, labels)
+        bot.metrics.observe = record
+
+    def stats(self, name: str) -> dict:
+        values = sorted(self.samples.get(name, []))
+        if not values:
+            return {"n": 0}
+
+        def pct(q):
+            return values[min(len(values) - 1, int(q * len(values)))]
+        return {"n": len(values), "avg_ms": round(sum(values) / len(values) * 1000, 3),
+                "p50_ms": round(pct(0.5) * 1000, 3), "p95_ms": round(pct(0.95) * 1000, 3),
+                "max_ms": round(values[-1] * 1000, 3)}
+
+    def rest_stats(self) -> dict:
+        return {"calls": dict(sorted(self.rest.calls.items())), "rate_limited": self.rest.rate_limited,
+                "retry_wait_s": round(self.rest.retry_wait, 3)}
+
+
+def timed(fn) -> float:
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+# ---------------------------------------------
+# SCENARIUSZE
+# ---------------------------------------------
+async def scenario_render(world: World) -> dict:
+    result = {}
+    for label, build in (("monthly", bot.build_leaderboard_embed), ("bac", bot.build_bac_leaderboard_embed)):
+        for guild in world.guilds:
+            bot.leaderboard_rows.forget(str(guild.id))
+        cold = timed(lambda: [build(guild) for guild in world.guilds])
+        rounds = world.params["render_rounds"]
+        warm = timed(lambda: [build(guild) for _ in range(rounds) for guild in world.guilds])
+        result[label] = {"cold_ms_per_guild": round(cold / len(world.guilds) * 1000, 3),
+                         "warm_ms_per_guild": round(warm / (rounds * len(world.guilds)) * 1000, 3)}
+    return result
+
+
+async def scenario_steady(world: World) -> dict:
+    bot.persister.start()
+    await bot.update_tasks.coro()  # pierwszy przebieg wysyła wszystkie embedy
+    first = dict(world.rest.calls)
+    refresher = bot.leaderboard_refresher
+    skipped = refresher.skipped
+    passes = world.params["passes"]
+    for _ in range(passes):
+        await bot.update_tasks.coro()
+    return {"passes": passes, "pass": world.stats("fanout_pass_seconds"),
+            "first_pass_calls": first, "edits_after_first": refresher.edits - sum(first.values()),
+            "skipped": refresher.skipped - skipped, "rest": world.rest_stats()}
+
+
+async def scenario_friday(world: World) -> dict:
+    """Lawina reakcji (proces Poissona) w kilku aktywnych gildiach przy działających przebiegach leaderboardów."""
+    bot.persister.start()
+    await bot.update_tasks.coro()
+    world.samples.clear()
+    params = world.params
+    rng = world.rng
+    active = world.guilds[:max(1, int(len(world.guilds) * params["active_share"]))]
+    emojis = [emoji for emoji in bot.STATUS_REACTIONS if emoji != "❌"]
+    duration = params["burst_seconds"]
+    rate = params["clicks"] / duration
+    stop = asyncio.Event()
+
+    async def ticker():
+        while not stop.is_set():
+            await bot.update_tasks.coro()
+            try:
+                await asyncio.wait_for(stop.wait(), params["tick_seconds"])
+            except asyncio.TimeoutError:
+                pass
+
+    async def lag_probe():
+        loop = asyncio.get_running_loop()
+        while not stop.is_set():
+            start = loop.time()
+            await asyncio.sleep(0.05)
+            world.samples.setdefault("loop_lag", []).append(max(0.0, loop.time() - start - 0.05))
+
+    tick_task = asyncio.create_task(ticker())
+    lag_task = asyncio.create_task(lag_probe())
+    started = time.perf_counter()
+    clicks = 0
+    while time.perf_counter() - started < duration:
+        guild = rng.choice(active)
+        member = rng.choice(guild.members)
+        emoji = "❌" if rng.random() < 0.02 else rng.choice(emojis)
+        handler_start = time.perf_counter()
+        await bot.on_raw_reaction_add(FakePayload(guild, member, emoji))
+        world.samples.setdefault("handler", []).append(time.perf_counter() - handler_start)
+        clicks += 1
+        await asyncio.sleep(rng.expovariate(rate))
+    await asyncio.sleep(bot.reaction_ingest.batch_window * 2)
+    stop.set()
+    await asyncio.gather(tick_task, lag_task)
+    ingest = bot.reaction_ingest.stats()
+    pending_removals = len(bot.reaction_ingest._removals)
+    for task in list(bot.reaction_ingest._removals):
+        task.cancel()  # zdejmowanie reakcji trwa dłużej niż scenariusz – liczymy, ile zostało
+    await bot.persister.stop()
+    return {
+        "clicks": clicks, "clicks_per_s": round(clicks / (time.perf_counter() - started), 1),
+        "committed": ingest["committed"], "debounced": ingest["debounced"], "batches": ingest["batches"],
+        "handler": world.stats("handler"), "reaction_latency": world.stats("reaction_latency_seconds"),
+        "pass": world.stats("fanout_pass_seconds"), "loop_lag": world.stats("loop_lag"),
+        "save": world.stats("save_seconds"), "leaderboard_edits": bot.leaderboard_refresher.edits,
+        "reaction_rest_calls": ingest["rest_calls"], "reaction_rest_saved": ingest["rest_saved"],
+        "pending_removal_batches": pending_removals, "rest": world.rest_stats(),
+    }
+
+
+async def scenario_rollover(world: World) -> dict:
+    bot.persister.start()
+    await bot.update_tasks.coro()
+    world.samples.clear()
+    edits = bot.leaderboard_refresher.edits
+    next_month = bot.shift_month(bot.get_current_month(), 1)
+    bot.get_current_month = lambda: next_month
+    rolled = []
+    roll_up = timed(lambda: rolled.append(bot.roll_up_history()))
+    started = time.perf_counter()
+    await bot.update_tasks.coro()
+    first_pass = time.perf_counter() - started
+    await bot.persister.stop()
+    return {"users_rolled_up": rolled[0], "roll_up_ms": round(roll_up * 1000, 3),
+            "first_pass_ms": round(first_pass * 1000, 3),
+            "leaderboard_edits": bot.leaderboard_refresher.edits - edits, "save": world.stats("save_seconds"),
+            "rest": world.rest_stats()}
+
+
+SCENARIOS = {
+    "render": scenario_render,
+    "steady": scenario_steady,
+    "friday": scenario_friday,
+    "rollover": scenario_rollover,
+}
+
+
+def run_scenario(name: str, params: dict) -> dict:
+    os.chdir(tempfile.mkdtemp(prefix=f"loadtest-{name}-"))
+    world = World(params)
+    build = timed(world.build)
+    result = asyncio.run(SCENARIOS[name](world))
+    result["setup_s"] = round(build, 3)
+    return result
+
+
+# ---------------------------------------------
+# PORÓWNANIE WYNIKÓW
+# ---------------------------------------------
+def flatten(prefix: str, value, out: dict) -> dict:
+    if isinstance(value, dict):
+        for key, inner in value.items():
+            flatten(f"{prefix}.{key}" if prefix else key, inner, out)
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        out[prefix] = value
+    return out
+
+
+def compare(old_path: str, new_path: str) -> None:
+    with open(old_path, "r", encoding="utf-8") as f:
+        old = json.load(f)
+    with open(new_path, "r", encoding="utf-8") as f:
+        new = json.load(f)
+    print(f"{old.get('commit')} -> {new.get('commit')}")
+    before = flatten("", old["scenarios"], {})
+    after = flatten("", new["scenarios"], {})
+    for key in sorted(before.keys() & after.keys()):
+        a, b = before[key], after[key]
+        change = f"{(b - a) / a * 100:+.1f}%" if a else ""
+        print(f"{key:<55}{a:>14}{b:>14}{change:>10}")
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "compare":
+        compare(*sys.argv[2:4])
+        return
+    parser = argparse.ArgumentParser(description="Test obciążeniowy bota bez połączenia z Discordem")
+    parser.add_argument("--guilds", type=int, default=20)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--events", type=int, default=20)
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS))
+    parser.add_argument("--rest-latency", type=float, default=0.04, help="średni czas odpowiedzi REST [s]")
+    parser.add_argument("--clicks", type=int, default=3000, help="liczba reakcji w scenariuszu friday")
+    parser.add_argument("--burst-seconds", type=float, default=5.0)
+    parser.add_argument("--active-share", type=float, default=0.25, help="część gildii biorących udział w lawinie")
+    parser.add_argument("--tick-seconds", type=float, default=1.0, help="odstęp przebiegów update_tasks")
+    parser.add_argument("--passes", type=int, default=5)
+    parser.add_argument("--render-rounds", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=2024)
+    parser.add_argument("--out")
+    args = parser.parse_args()
+    params = {key: value for key, value in vars(args).items() if key not in ("scenario", "out")}
+    names = args.scenario or list(SCENARIOS)
+
+    ctx = multiprocessing.get_context("spawn")
+    results = {}
+    with ctx.Pool(1, maxtasksperchild=1) as pool:
+        for name in names:
+            results[name] = pool.apply(run_scenario, (name, params))
+            print(f"{name}: gotowe", file=sys.stderr)
+    report = {
+        "commit": git_commit(),
+        "date": datetime.datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "numpy": bot.np is not None,
+        "params": params,
+        "scenarios": results,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
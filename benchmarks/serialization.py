@@ -0,0 +1,88 @@
+"""Zapis i odczyt pliku danych dla każdego dostępnego serializatora.
+
+Dla porównania mierzony jest też dawny format (json.dump z indent=2). Dane mają
+realistyczny kształt: gildie z użytkownikami, zdarzeniami z ostatniej doby
+i licznikami z ostatniego roku. Zapis obejmuje rekord -> dict -> bajty -> plik,
+odczyt: plik -> bajty -> dict -> rekord.
+
+Uruchomienie (z katalogu repozytorium):
+    python benchmarks/serialization.py [liczba_gildii] [użytkowników_na_gildię]
+"""
+import os
+import sys
+import json
+import time
+import random
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import bot  # noqa: E402
+
+
+def generate(n_guilds: int, n_users: int, seed: int = 11) -> dict:
+    rng = random.Random(seed)
+    now = time.time()
+    month = bot.get_current_month()
+    months = [bot.shift_month(month, -i) for i in range(12)]
+    data = {}
+    for g in range(n_guilds):
+        users = {}
+        for u in range(n_users):
+            user = bot.create_new_user(f"użytkownik{u}")
+            user.weight = rng.uniform(50.0, 120.0)
+            for _ in range(rng.randrange(0, 12)):
+                user.add_event(rng.randrange(len(bot.SUBSTANCE_KEYS)), 1, now - rng.uniform(0, 24 * 3600))
+            for period in months:
+                counters = user._counters(user.monthly, period)
+                for sub in rng.sample(range(len(bot.SUBSTANCE_KEYS)), 3):
+                    counters[sub] += rng.randrange(1, 40)
+            users[str(100_000_000_000_000_000 + u)] = user
+        data[str(900_000_000_000_000_000 + g)] = bot.GuildRecord({"leaderboard_channel_id": g}, users)
+    return data
+
+
+def legacy_write(path: str, data: dict) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2, default=bot.record_to_json)
+
+
+def legacy_read(path: str) -> dict:
+    with open(path, "r", encoding="utf-8") as f:
+        return bot.records_from_json(json.load(f))
+
+
+def timed(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def main():
+    n_guilds = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    n_users = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    data = generate(n_guilds, n_users)
+    workdir = tempfile.mkdtemp(prefix="serialization-")
+    expected = {gid: guild.to_dict() for gid, guild in data.items()}
+
+    rows = []
+    path = os.path.join(workdir, "legacy.json")
+    save = timed(lambda: legacy_write(path, data))
+    load = timed(lambda: legacy_read(path))
+    rows.append(("json (indent=2)", os.path.getsize(path), save, load))
+    for name in bot.SERIALIZERS:
+        bot.SERIALIZER = name
+        path = os.path.join(workdir, f"{name}.data")
+        save = timed(lambda: bot.atomic_write(path, bot.encode_payload(data)))
+        loaded = {}
+        load = timed(lambda: loaded.update(bot.records_from_json(bot.read_payload(path))))
+        assert {gid: guild.to_dict() for gid, guild in loaded.items()} == expected, name
+        rows.append((name, os.path.getsize(path), save, load))
+
+    print(f"gildie: {n_guilds}, użytkownicy: {n_guilds * n_users} ({workdir})")
+    print(f"{'serializator':<18}{'rozmiar [KiB]':>15}{'zapis [ms]':>12}{'odczyt [ms]':>13}")
+    for name, size, save, load in rows:
+        print(f"{name:<18}{size / 1024:>15.0f}{save * 1000:>12.1f}{load * 1000:>13.1f}")
+
+
+if __name__ == "__main__":
+    main()
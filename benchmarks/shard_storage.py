@@ -0,0 +1,68 @@
+"""Kilka procesów-shardów zapisujących jedną bazę SQLite (WAL) jednocześnie.
+
+Każdy proces dostaje SHARD_IDS=<i>, zapisuje zdarzenia tylko swoich gildii,
+a na końcu proces główny wczytuje bazę i sprawdza, że nic nie zginęło.
+
+Uruchomienie (z katalogu repozytorium):
+    python benchmarks/shard_storage.py [liczba_shardów] [gildii_na_shard] [zdarzeń_na_gildię]
+"""
+import os
+import sys
+import time
+import tempfile
+import multiprocessing
+
+REPO = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+def guild_ids(shard_id: int, shard_count: int, n_guilds: int) -> list:
+    # Snowflake, którego (id >> 22) % shard_count == shard_id
+    return [str(((i * shard_count + shard_id) << 22) | 1) for i in range(1, n_guilds + 1)]
+
+
+def run_shard(workdir: str, shard_id: int, shard_count: int, n_guilds: int, n_events: int) -> float:
+    os.chdir(workdir)
+    os.environ.update({"STORAGE_ENGINE": "sqlite", "SHARD_COUNT": str(shard_count), "SHARD_IDS": str(shard_id)})
+    sys.path.insert(0, REPO)
+    import bot
+
+    bot.load_data()
+    month = bot.get_current_month()
+    start = time.perf_counter()
+    for n in range(n_events):
+        for gid in guild_ids(shard_id, shard_count, n_guilds):
+            bot.commit_mutation({"op": "consume", "g": gid, "u": "1", "typ": "piwo", "dose": 1,
+                                 "ts": time.time(), "month": month, "nick": "user"})
+        bot.save_data()  # każda runda to osobna transakcja konkurująca z innymi procesami
+    bot.get_storage().close()
+    return time.perf_counter() - start
+
+
+def main():
+    shard_count = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    n_guilds = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    n_events = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+    workdir = tempfile.mkdtemp(prefix="shards-")
+    ctx = multiprocessing.get_context("spawn")
+    with ctx.Pool(shard_count) as pool:
+        timings = pool.starmap(run_shard, [(workdir, i, shard_count, n_guilds, n_events) for i in range(shard_count)])
+
+    sys.path.insert(0, REPO)
+    import bot
+
+    storage = bot.SqliteStorage(os.path.join(workdir, bot.DB_FILE))
+    data = storage.load()
+    storage.close()
+    for shard_id in range(shard_count):
+        for gid in guild_ids(shard_id, shard_count, n_guilds):
+            month_counts = data[gid].users["1"].month_counts(bot.get_current_month())
+            got = month_counts[bot.SUBSTANCE_INDEX["piwo"]]
+            assert got == n_events, f"gildia {gid}: {got} != {n_events}"
+    print(f"shardy: {shard_count}, gildie: {shard_count * n_guilds}, rundy zapisu: {n_events}")
+    for shard_id, elapsed in enumerate(timings):
+        print(f"  shard {shard_id}: {elapsed:.2f}s")
+    print(f"OK – wszystkie zdarzenia zapisane ({workdir})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""Czasy zdarzeń jako tekst ISO (stary format) vs sekundy epoki (obecny format).
+
+Porównuje liczenie promili, usuwanie wygasłych zdarzeń oraz zapis/odczyt JSON
+dla tych samych danych w obu reprezentacjach.
+
+Uruchomienie (z katalogu repozytorium):
+    python benchmarks/timestamps.py [liczba_użytkowników] [zdarzeń_na_użytkownika]
+"""
+import os
+import sys
+import json
+import time
+import random
+import datetime
+from datetime import timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import bot  # noqa: E402
+
+
+# --- stara reprezentacja: {"consumptions": {typ: [{"dose", "timestamp": ISO}]}} ---
+def legacy_compute_bac(data: dict, weight: float, now: datetime.datetime) -> float:
+    total_bac = 0.0
+    for typ in bot.VALID_TYPES:
+        if typ == "blunt":
+            continue
+        for event in data.get("consumptions", {}).get(typ, []):
+            try:
+                event_time = datetime.datetime.fromisoformat(event["timestamp"])
+            except Exception:
+                continue
+            hours_elapsed = (now - event_time).total_seconds() / 3600.0
+            base_bac = (event["dose"] * bot.SUBSTANCES[typ]["ethanol_grams"]) / (weight * 1000 * 0.68) * 1000
+            total_bac += max(0.0, base_bac - 0.15 * hours_elapsed)
+    return total_bac
+
+
+def legacy_prune(data: dict, weight: float, now: datetime.datetime) -> None:
+    kept = {}
+    for typ, events in data.get("consumptions", {}).items():
+        new_events = []
+        for event in events:
+            try:
+                event_time = datetime.datetime.fromisoformat(event["timestamp"])
+            except Exception:
+                continue
+            hours_elapsed = (now - event_time).total_seconds() / 3600.0
+            if typ == "blunt":
+                if hours_elapsed < bot.SUBSTANCES[typ]["duration_hours"]:
+                    new_events.append(event)
+                continue
+            base_bac = (event.get("dose", 0) * bot.SUBSTANCES[typ]["ethanol_grams"]) / (weight * 1000 * 0.68) * 1000
+            if base_bac - 0.15 * hours_elapsed > 0:
+                new_events.append(event)
+        if new_events:
+            kept[typ] = new_events
+    data["consumptions"] = kept
+
+
+# --- obecna reprezentacja: UserRecord z sekundami epoki ---
+def prune(data: bot.UserRecord, weight: float, now: float) -> None:
+    """Pełny przegląd zdarzeń użytkownika (bot zdejmuje je z kopca ExpiryScheduler)."""
+    def active(sub, dose, epoch):
+        hours_elapsed = (now - epoch) / 3600.0
+        if sub == bot.BLUNT_INDEX:
+            return hours_elapsed < bot.SUBSTANCES["blunt"]["duration_hours"]
+        return bot.base_bac_of(sub, dose, weight) - bot.ELIMINATION_RATE * hours_elapsed > 0
+
+    data.keep_events(active)
+
+
+def generate(n_users: int, n_events: int, seed: int = 7) -> dict:
+    rng = random.Random(seed)
+    now = time.time()
+    users = {}
+    for i in range(n_users):
+        data = bot.create_new_user(f"user{i}")
+        data.weight = rng.uniform(50.0, 120.0)
+        for _ in range(n_events):
+            data.add_event(rng.randrange(len(bot.SUBSTANCE_KEYS)), 1, now - rng.uniform(0, 24 * 3600))
+        users[str(i)] = data
+    return users
+
+
+def format_timestamp(epoch: float) -> str:
+    return datetime.datetime.fromtimestamp(epoch, timezone.utc).isoformat()
+
+
+def to_legacy(data: bot.UserRecord) -> dict:
+    raw = data.to_dict()
+    for events in raw["consumptions"].values():
+        for event in events:
+            event["timestamp"] = format_timestamp(event["timestamp"])
+    return raw
+
+
+def timed(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def main():
+    n_users = int(sys.argv[1]) if len(sys.argv) > 1 else 2_000
+    n_events = int(sys.argv[2]) if len(sys.argv) > 2 else 30
+    users = generate(n_users, n_events)
+    legacy = {uid: to_legacy(data) for uid, data in users.items()}
+    now_dt = datetime.datetime.now(timezone.utc)
+    now = now_dt.timestamp()
+
+    for uid, data in users.items():
+        expected = legacy_compute_bac(legacy[uid], data.weight, now_dt)
+        assert abs(bot.compute_bac(data, data.weight, now_dt) - expected) < 1e-6, uid
+
+    legacy_blob = json.dumps({"users": legacy})
+    epoch_blob = json.dumps({"users": {uid: data.to_dict() for uid, data in users.items()}})
+    results = [
+        ("compute_bac",
+         timed(lambda: [legacy_compute_bac(legacy[uid], d.weight, now_dt) for uid, d in users.items()]),
+         timed(lambda: [bot.compute_bac(d, d.weight, now_dt) for d in users.values()])),
+        ("prune",
+         timed(lambda: [legacy_prune(json.loads(json.dumps(legacy[uid])), d.weight, now_dt)
+                        for uid, d in users.items()]),
+         timed(lambda: [prune(d.copy(), d.weight, now) for d in users.values()])),
+        ("load (JSON -> model)",
+         timed(lambda: [bot.UserRecord.from_dict(raw) for raw in json.loads(legacy_blob)["users"].values()]),
+         timed(lambda: [bot.UserRecord.from_dict(raw) for raw in json.loads(epoch_blob)["users"].values()])),
+        ("save (model -> JSON)",
+         timed(lambda: json.dumps({"users": {uid: to_legacy(d) for uid, d in users.items()}})),
+         timed(lambda: json.dumps({"users": {uid: d.to_dict() for uid, d in users.items()}}))),
+    ]
+    print(f"użytkownicy: {n_users}, zdarzeń na użytkownika: {n_events}")
+    print(f"rozmiar JSON: ISO {len(legacy_blob) / 1024:.0f} KiB, epoka {len(epoch_blob) / 1024:.0f} KiB")
+    print(f"{'operacja':<22}{'ISO [ms]':>12}{'epoka [ms]':>12}{'x':>8}")
+    for name, old, new in results:
+        print(f"{name:<22}{old * 1000:>12.1f}{new * 1000:>12.1f}{old / new:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
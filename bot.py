@@ -1,12 +1,57 @@
 import os
+import sys
 from dotenv import load_dotenv
 import json
+import copy
+import math
+import hashlib
+import time
+import asyncio
 import logging
+import sqlite3
+import bisect
+from array import array
+import heapq
+import itertools
+import functools
+import weakref
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 import datetime
 from datetime import timezone, timedelta
 import discord
 from discord.ext import commands, tasks
 
+try:
+    import numpy as np
+except ImportError:  # numpy jest opcjonalne – bez niego liczymy per użytkownik
+    np = None
+
+try:
+    from sortedcontainers import SortedList
+except ImportError:  # sortedcontainers jest opcjonalne – zastępuje je lista + bisect
+    SortedList = None
+
+try:
+    from aiohttp import web
+except ImportError:  # aiohttp jest opcjonalne – bez niego nie ma endpointu /metrics
+    web = None
+
+try:
+    import orjson
+except ImportError:  # orjson jest opcjonalne – szybszy (de)serializator JSON
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:  # msgspec jest opcjonalne – szybki JSON i MessagePack
+    msgspec = None
+
+try:
+    import msgpack
+except ImportError:  # msgpack jest opcjonalne – binarny format zapisu
+    msgpack = None
+
 # ---------------------------------------------
 # KONFIGURACJA LOGOWANIA I STAŁE
 # ---------------------------------------------
@@ -17,8 +62,55 @@ logging.basicConfig(
 
 BOT_PREFIX = "-"
 DATA_FILE = "data.json"
+DB_FILE = "data.db"
+GUILDS_DIR = os.getenv("GUILDS_DIR", "guilds")  # silnik "sharded": indeks + plik na gildię
+STORAGE_ENGINE = os.getenv("STORAGE_ENGINE", "json")  # "json", "sqlite" albo "sharded"
+SERIALIZER = os.getenv("SERIALIZER", "json")  # "json", "orjson", "msgspec" albo "msgpack"
+EXPORT_FILE = "data.export.json"  # czytelny zrzut stanu (python bot.py export)
+GUILD_CACHE_SIZE = int(os.getenv("GUILD_CACHE_SIZE", "256"))  # ile gildii trzymać w pamięci (sqlite/sharded)
+SAVE_INTERVAL_SECONDS = float(os.getenv("SAVE_INTERVAL_SECONDS", "5"))  # maks. opóźnienie zapisu
+SAVE_BYTE_BUDGET = int(os.getenv("SAVE_BYTE_BUDGET", "65536"))  # wymusza zapis po tylu bajtach zmian
+MUTATION_BYTES = 128  # szacunkowy rozmiar pojedynczej zmiany
+JOURNAL_FILE = "data.journal"
+JOURNAL_ENABLED = os.getenv("JOURNAL_ENABLED", "1") == "1"
+JOURNAL_COMPACT_BYTES = int(os.getenv("JOURNAL_COMPACT_BYTES", str(1024 * 1024)))  # próg kompakcji
+META_KEY = "_meta"  # wpis globalny (nie-gildia) w guild_data
+SCHEMA_VERSION = 2  # wersja układu danych, zapisywana w guild_data[META_KEY]["schema"]
+LEADERBOARD_TICK_SECONDS = float(os.getenv("LEADERBOARD_TICK_SECONDS", "15"))  # jak często sprawdzać leaderboardy
+LEADERBOARD_MIN_INTERVAL = float(os.getenv("LEADERBOARD_MIN_INTERVAL", "60"))  # najrzadziej co tyle sekund na leaderboard
+RETENTION_MONTHS = int(os.getenv("RETENTION_MONTHS", "12"))  # miesiące trzymane w pełnej rozdzielczości
+ARCHIVE_FILE = "archive.jsonl"  # wygasłe surowe zdarzenia spożycia
+FANOUT_CONCURRENCY = int(os.getenv("FANOUT_CONCURRENCY", "8"))  # ile gildii obsługiwać naraz
+GUILD_TASK_TIMEOUT = float(os.getenv("GUILD_TASK_TIMEOUT", "30"))  # limit czasu pracy dla jednej gildii
+REST_GLOBAL_PER_SECOND = float(os.getenv("REST_GLOBAL_PER_SECOND", "45"))  # poniżej globalnego limitu Discorda (50/s)
+MEMBER_MISS_TTL = float(os.getenv("MEMBER_MISS_TTL", "600"))  # jak długo pamiętać, że użytkownika nie ma na serwerze
+LIVE_LEADERBOARD_ROWS = min(int(os.getenv("LIVE_LEADERBOARD_ROWS", "20")), 25)  # wierszy na stronę embedu
+TEXT_PAGE_ROWS = int(os.getenv("TEXT_PAGE_ROWS", "20"))  # wierszy na stronę tekstowych leaderboardów
+MESSAGE_CACHE_SIZE = int(os.getenv("MESSAGE_CACHE_SIZE", "0"))  # reakcje idą przez zdarzenia raw, cache nie jest potrzebny
+REACTION_BATCH_SECONDS = float(os.getenv("REACTION_BATCH_SECONDS", "0.25"))  # okno zbierania partii reakcji
+REACTION_DEBOUNCE_SECONDS = float(os.getenv("REACTION_DEBOUNCE_SECONDS", "1.5"))  # ponowny klik w tym czasie = podwójny
+REACTION_CLEAR_THRESHOLD = int(os.getenv("REACTION_CLEAR_THRESHOLD", "4"))  # od tylu reakcji jednej emotki – clear_reaction
+COMPUTE_OFFLOAD_USERS = int(os.getenv("COMPUTE_OFFLOAD_USERS", "500"))  # od tylu użytkowników rankingi liczone w puli wątków
+COMPUTE_WORKERS = int(os.getenv("COMPUTE_WORKERS", "2"))  # wątki puli obliczeń
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "1024"))  # gotowe odpowiedzi komend; 0 = wyłączone
+RESPONSE_CACHE_MAX_AGE = float(os.getenv("RESPONSE_CACHE_MAX_AGE", "300"))  # górna granica życia wpisu (nazwy członków)
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"  # histogramy czasów na gorących ścieżkach
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))  # >0: lokalny endpoint HTTP /metrics (format Prometheusa)
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+LOOP_LAG_INTERVAL = 1.0  # co ile sekund mierzyć opóźnienie pętli zdarzeń
 NBSP = "\u00A0"  # non-breaking space separator
 
+# Shardowanie: SHARD_COUNT shardów całego bota, SHARD_IDS – shardy obsługiwane przez ten proces
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "0")) or None
+SHARD_IDS = [int(i) for i in os.getenv("SHARD_IDS", "").split(",") if i.strip()] or None
+SQLITE_BUSY_TIMEOUT = float(os.getenv("SQLITE_BUSY_TIMEOUT", "30"))  # ile czekać na blokadę zapisu innego procesu
+if SHARD_IDS:
+    # Procesy dzielą bazę, ale każdy ma własny dziennik, archiwum i wpis meta
+    PROCESS_TAG = "shard" + "-".join(map(str, SHARD_IDS))
+    JOURNAL_FILE = f"data.{PROCESS_TAG}.journal"
+    ARCHIVE_FILE = f"archive.{PROCESS_TAG}.jsonl"
+    META_KEY = f"_meta.{PROCESS_TAG}"
+
 # ---------------------------------------------
 # INTENTS i PARTIALS (dla poprawnej obsługi reakcji)
 # ---------------------------------------------
@@ -27,13 +119,219 @@ intents.message_content = True
 intents.reactions = True
 intents.members = True
 
-bot = commands.Bot(
+bot = (commands.AutoShardedBot if SHARD_COUNT else commands.Bot)(
     command_prefix=BOT_PREFIX,
     intents=intents,
     help_command=None,
-    partials=["MESSAGE", "REACTION", "USER"]
+    partials=["MESSAGE", "REACTION", "USER"],
+    max_messages=MESSAGE_CACHE_SIZE or None,
+    **({"shard_count": SHARD_COUNT, "shard_ids": SHARD_IDS} if SHARD_COUNT else {})
 )
 
+
+def owns_guild(guild_id) -> bool:
+    """Czy gildia należy do shardów tego procesu (wzór Discorda: (id >> 22) % SHARD_COUNT)."""
+    if SHARD_COUNT is None or SHARD_IDS is None:
+        return True
+    return (int(guild_id) >> 22) % SHARD_COUNT in SHARD_IDS
+
+
+def owned_guilds() -> list:
+    return [guild for guild in bot.guilds if owns_guild(guild.id)]
+
+
+# ---------------------------------------------
+# METRYKI: histogramy i liczniki (komenda -metrics, opcjonalnie HTTP /metrics)
+# ---------------------------------------------
+SECONDS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+BAC_BUCKETS = (1e-6, 5e-6, 2.5e-5, 1e-4, 5e-4, 0.0025, 0.01, 0.05, 0.25, 1.0)
+BYTES_BUCKETS = tuple(256 * 4 ** i for i in range(10))  # 256 B … 64 MiB
+
+
+class Histogram:
+    """Kubełki jak w Prometheusie (liczba wartości ≤ granica), suma i liczba obserwacji."""
+
+    __slots__ = ("bounds", "counts", "count", "sum", "max")
+
+    def __init__(self, bounds: tuple):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # ostatni kubełek: +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q: float) -> float:
+        """Przybliżenie: górna granica kubełka, w którym wypada kwantyl."""
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(self.bounds, self.counts):
+            seen += n
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+def _labels_text(labels: tuple) -> str:
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}" if labels else ""
+
+
+class Metrics:
+    """Rejestr histogramów. Wyłączony (METRICS_ENABLED=0) nic nie zbiera, a funkcje
+       opakowane przez timed() zostają niezmienione – bez narzutu na gorących ścieżkach.
+       Liczniki prowadzone już przez inne moduły (REST, cache, kolejki) są czytane
+       dopiero przy odczycie metryk (collect_counters)."""
+
+    def __init__(self, enabled: bool = METRICS_ENABLED):
+        self.enabled = enabled
+        self.families = {}  # nazwa -> (opis, granice kubełków)
+        self.histograms = {}  # (nazwa, etykiety) -> Histogram
+        self._lag_task = None
+        self._runner = None
+
+    def histogram(self, name: str, description: str, bounds: tuple = SECONDS_BUCKETS) -> None:
+        self.families[name] = (description, bounds)
+
+    def observe(self, name: str, value: float, labels: tuple = ()) -> None:
+        if not self.enabled:
+            return
+        hist = self.histograms.get((name, labels))
+        if hist is None:
+            hist = self.histograms[(name, labels)] = Histogram(self.families[name][1])
+        hist.observe(value)
+
+    def timed(self, name: str, labels: tuple = ()):
+        """Dekorator mierzący czas wywołania funkcji synchronicznej."""
+        def wrap(fn):
+            if not self.enabled:
+                return fn
+
+            @functools.wraps(fn)
+            def timed_fn(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    self.observe(name, time.perf_counter() - start, labels)
+            return timed_fn
+        return wrap
+
+    def render(self) -> str:
+        """Format tekstowy Prometheusa (text/plain; version=0.0.4)."""
+        lines = []
+        for name, (description, _) in self.families.items():
+            series = [(labels, hist) for (hist_name, labels), hist in self.histograms.items() if hist_name == name]
+            if not series:
+                continue
+            lines += [f"# HELP {name} {description}", f"# TYPE {name} histogram"]
+            for labels, hist in series:
+                cumulative = 0
+                for bound, n in zip((*hist.bounds, "+Inf"), hist.counts):
+                    cumulative += n
+                    lines.append(f"{name}_bucket{_labels_text(labels + (('le', bound),))} {cumulative}")
+                lines.append(f"{name}_sum{_labels_text(labels)} {hist.sum}")
+                lines.append(f"{name}_count{_labels_text(labels)} {hist.count}")
+        typed = set()
+        for name, labels, value in collect_counters():
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} {'counter' if name.endswith('_total') else 'gauge'}")
+            lines.append(f"{name}{_labels_text(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> list:
+        """Wiersze dla komendy -metrics: liczba, średnia, p50/p95 i maksimum każdej serii."""
+        rows = []
+        for (name, labels), hist in sorted(self.histograms.items()):
+            if name.endswith("_bytes"):
+                scale, unit = 1 / 1024, "KiB"
+            else:
+                scale, unit = 1000, "ms"
+            label = ",".join(str(value) for _, value in labels)
+            rows.append(f"{name}{f'[{label}]' if label else ''}: n={hist.count} "
+                        f"avg={hist.sum / hist.count * scale:.3g} p50={hist.quantile(0.5) * scale:.3g} "
+                        f"p95={hist.quantile(0.95) * scale:.3g} max={hist.max * scale:.3g} {unit}")
+        rows += [f"{name}{_labels_text(labels)}: {value}" for name, labels, value in collect_counters()]
+        return rows
+
+    async def start(self) -> None:
+        """Pomiar opóźnienia pętli zdarzeń i (przy METRICS_PORT) serwer HTTP – raz na proces."""
+        if not self.enabled:
+            return
+        if self._lag_task is None:
+            self._lag_task = asyncio.get_running_loop().create_task(self._watch_loop_lag())
+        if METRICS_PORT and self._runner is None:
+            if web is None:
+                logging.warning("METRICS_PORT ustawiony, ale brak pakietu aiohttp – endpoint /metrics wyłączony")
+                return
+            app = web.Application()
+            app.router.add_get("/metrics", self._handle)
+            self._runner = web.AppRunner(app)
+            await self._runner.setup()
+            try:
+                await web.TCPSite(self._runner, METRICS_HOST, METRICS_PORT).start()
+            except OSError as e:
+                # Zajęty port nie może zatrzymać startu bota – metryki zostają dostępne przez -metrics
+                logging.warning(f"Nie można uruchomić endpointu /metrics na {METRICS_HOST}:{METRICS_PORT}: {e}")
+                await self._runner.cleanup()
+                self._runner = None
+                return
+            logging.info(f"Metryki dostępne pod http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+
+    async def _handle(self, request):
+        return web.Response(body=self.render().encode("utf-8"),
+                            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+    async def _watch_loop_lag(self) -> None:
+        """O ile później, niż zaplanowano, budzi się asyncio.sleep()."""
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(LOOP_LAG_INTERVAL)
+            self.observe("event_loop_lag_seconds", max(0.0, loop.time() - start - LOOP_LAG_INTERVAL))
+
+
+metrics = Metrics()
+metrics.histogram("reaction_latency_seconds", "Kliknięcie reakcji -> zmiana stanu (z oknem partii)")
+metrics.histogram("save_seconds", "Czas zapisu: dziennik, snapshot w tle, zapis synchroniczny")
+metrics.histogram("load_seconds", "Czas wczytania: indeks/cały stan przy starcie, gildia przy pierwszym dostępie")
+metrics.histogram("storage_write_bytes", "Rozmiar zapisu na dysk (plik snapshotu, partia dziennika)", BYTES_BUCKETS)
+metrics.histogram("storage_read_bytes", "Rozmiar wczytanego pliku danych", BYTES_BUCKETS)
+metrics.histogram("bac_seconds", "Czas liczenia promili", BAC_BUCKETS)
+metrics.histogram("fanout_pass_seconds", "Czas przebiegu zadania po wszystkich gildiach")
+metrics.histogram("event_loop_lag_seconds", "Opóźnienie pętli zdarzeń")
+metrics.histogram("compute_seconds", "Czas rankingu liczonego w puli obliczeń (z oczekiwaniem w kolejce)")
+
+
+def collect_counters() -> list:
+    """[(nazwa, etykiety, wartość)] z liczników, które moduły i tak prowadzą."""
+    rows = [("rest_calls_total", (("route", route),), count) for route, count in sorted(rest_budget.calls.items())]
+    rows.append(("rest_wait_seconds_total", (), round(rest_budget.waited, 3)))
+    cache = guild_data.stats()
+    rows += [("guild_cache_known", (), cache["known"]), ("guild_cache_resident", (), cache["resident"]),
+             ("guild_cache_loads_total", (), cache["loads"]), ("guild_cache_evictions_total", (), cache["evictions"])]
+    rows += [("reaction_queue_depth", (), len(reaction_ingest.queue)),
+             ("reaction_debounced_total", (), reaction_ingest.debounced),
+             ("save_pending_bytes", (), persister.pending_bytes),
+             ("dirty_guilds", (), len(dirty_rows))]
+    for command in sorted(set(response_cache.hits) | set(response_cache.misses)):
+        rows += [("response_cache_hits_total", (("command", command),), response_cache.hits.get(command, 0)),
+                 ("response_cache_misses_total", (("command", command),), response_cache.misses.get(command, 0))]
+    rows.append(("response_cache_entries", (), len(response_cache.entries)))
+    compute = compute_tier.stats()
+    rows += [(f"compute_{name}_total", (), compute[name]) for name in ("inline", "offloaded", "superseded")]
+    rows.append(("compute_pending", (), compute["pending"]))
+    expiry = expiry_scheduler.stats()
+    rows += [("expiry_heap_size", (), expiry["heap_size"]),
+             ("expiry_pruned_total", (), expiry["pruned_total"])]
+    return rows
+
 # ---------------------------------------------
 # DEFINICJA UŻYWEK – EDYCJA W JEDNYM MIEJSCU
 # ---------------------------------------------
@@ -49,68 +347,1251 @@ SUBSTANCES = {
 VALID_TYPES = set(SUBSTANCES.keys())
 EMOJI_TO_TYPE = {data["emoji"]: typ for typ, data in SUBSTANCES.items()}
 TYPE_TO_EMOJI = {typ: data["emoji"] for typ, data in SUBSTANCES.items()}
+SUBSTANCE_KEYS = tuple(SUBSTANCES)  # pozycja w SUBSTANCES = indeks używki w modelu
+SUBSTANCE_INDEX = {typ: i for i, typ in enumerate(SUBSTANCE_KEYS)}
+SUBSTANCE_GRAMS = tuple(SUBSTANCES[typ]["ethanol_grams"] for typ in SUBSTANCE_KEYS)
+BLUNT_INDEX = SUBSTANCE_INDEX["blunt"]
 
 # ---------------------------------------------
-# GLOBALNE DANE: Struktura bazy
+# ZNACZNIKI CZASU: ISO 8601 -> sekundy epoki
+# ---------------------------------------------
+def parse_timestamp(value) -> float:
+    """Sekundy epoki (zapis od wersji z epoką) albo ISO 8601 (starsze pliki) -> sekundy
+       epoki; None gdy wartość jest nieczytelna."""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    try:
+        return datetime.datetime.fromisoformat(value).timestamp()
+    except Exception:
+        return None
+
+
+def dict_or_empty(value) -> dict:
+    return value if isinstance(value, dict) else {}
+
+
+def as_number(value):
+    """Liczba z wczytanego rekordu albo None (tekst, bool, nan) – takie wpisy są pomijane."""
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or value != value:
+        return None
+    return value
+
+
+def format_dose(dose: float):
+    return int(dose) if float(dose).is_integer() else dose
+
+
+# ---------------------------------------------
+# MODEL W PAMIĘCI: zwarte rekordy użytkowników i gildii
+# ---------------------------------------------
+class UserRecord:
+    """Użytkownik gildii. Zdarzenia spożycia to trzy równoległe kolumny
+       (epoka, dawka, indeks używki), liczniki miesięczne/roczne to tablice
+       o długości len(SUBSTANCES). to_dict()/from_dict() zachowują schemat JSON."""
+
+    __slots__ = ("original_nick", "weight", "display_mode", "ev_time", "ev_dose", "ev_sub",
+                 "monthly", "yearly", "extra")
+
+    def __init__(self, nick: str = None, weight: float = 80.0, display_mode: str = "promile"):
+        self.original_nick = nick
+        self.weight = weight
+        self.display_mode = display_mode
+        self.ev_time = array("d")
+        self.ev_dose = array("d")
+        self.ev_sub = array("B")
+        self.monthly = {}  # "YYYY-MM" -> array("q") liczników
+        self.yearly = {}  # "YYYY" -> array("q") liczników
+        self.extra = None  # pola/używki spoza modelu – zachowywane przy zapisie
+
+    # --- zdarzenia ---
+    def add_event(self, sub: int, dose: float, epoch: float) -> None:
+        self.ev_time.append(epoch)
+        self.ev_dose.append(dose)
+        self.ev_sub.append(sub)
+
+    def events(self):
+        """(indeks używki, dawka, epoka) w kolejności dodania."""
+        return zip(self.ev_sub, self.ev_dose, self.ev_time)
+
+    def remove_event(self, sub: int, epoch: float) -> bool:
+        for i, (s, t) in enumerate(zip(self.ev_sub, self.ev_time)):
+            if s == sub and t == epoch:
+                del self.ev_sub[i]
+                del self.ev_dose[i]
+                del self.ev_time[i]
+                return True
+        return False
+
+    def keep_events(self, keep) -> None:
+        """Zostawia tylko zdarzenia, dla których keep(sub, dose, epoch) jest prawdą."""
+        rows = [row for row in self.events() if keep(*row)]
+        self.ev_sub = array("B", (row[0] for row in rows))
+        self.ev_dose = array("d", (row[1] for row in rows))
+        self.ev_time = array("d", (row[2] for row in rows))
+
+    # --- liczniki ---
+    @staticmethod
+    def _counters(table: dict, key: str) -> array:
+        counters = table.get(key)
+        if counters is None:
+            counters = table[sys.intern(key)] = array("q", bytes(8 * len(SUBSTANCE_KEYS)))
+        return counters
+
+    def bump_month(self, month: str, sub: int, count: int = 1) -> None:
+        self._counters(self.monthly, month)[sub] += count
+
+    def add_year(self, year: str, counters) -> None:
+        target = self._counters(self.yearly, year)
+        for i, count in enumerate(counters):
+            target[i] += count
+
+    def month_counts(self, month: str) -> array:
+        return self.monthly.get(month)
+
+    # --- serializacja ---
+    @classmethod
+    def from_dict(cls, raw: dict) -> "UserRecord":
+        user = cls(raw.get("original_nick"), raw.get("weight", 80.0), raw.get("display_mode", "promile"))
+        extra = {}
+        skipped = 0  # uszkodzone zdarzenia i liczniki – pomijane zamiast przerywać wczytywanie całego pliku
+        for typ, events in dict_or_empty(raw.get("consumptions")).items():
+            sub = SUBSTANCE_INDEX.get(typ)
+            if sub is None:
+                extra.setdefault("consumptions", {})[typ] = events
+                continue
+            if not isinstance(events, list):
+                skipped += 1
+                continue
+            for event in events:
+                dose = as_number(event.get("dose", 0)) if isinstance(event, dict) else None
+                epoch = parse_timestamp(event.get("timestamp")) if dose is not None else None
+                if epoch is None:
+                    skipped += 1
+                    continue
+                user.add_event(sub, dose, epoch)
+        for field, table in (("monthly_usage", user.monthly), ("yearly_usage", user.yearly)):
+            for period, counters in dict_or_empty(raw.get(field)).items():
+                if not isinstance(counters, dict):
+                    skipped += 1
+                    continue
+                for typ, count in counters.items():
+                    sub = SUBSTANCE_INDEX.get(typ)
+                    if sub is None:
+                        extra.setdefault(field, {}).setdefault(period, {})[typ] = count
+                    elif not isinstance(as_number(count), int):
+                        skipped += 1
+                    elif count:
+                        cls._counters(table, period)[sub] += count
+        if skipped:
+            logging.warning(f"Pominięto {skipped} uszkodzonych wpisów użytkownika {user.original_nick!r}")
+        for key, value in raw.items():
+            if key not in ("original_nick", "weight", "display_mode", "consumptions",
+                           "monthly_usage", "yearly_usage"):
+                extra[key] = value
+        user.extra = extra or None
+        return user
+
+    @staticmethod
+    def _counters_to_dict(table: dict) -> dict:
+        return {period: {SUBSTANCE_KEYS[i]: count for i, count in enumerate(counters) if count}
+                for period, counters in table.items()}
+
+    def to_dict(self) -> dict:
+        consumptions = {typ: [] for typ in SUBSTANCE_KEYS}
+        for sub, dose, epoch in self.events():
+            consumptions[SUBSTANCE_KEYS[sub]].append({"dose": format_dose(dose), "timestamp": epoch})
+        result = {
+            "original_nick": self.original_nick,
+            "consumptions": consumptions,
+            "monthly_usage": self._counters_to_dict(self.monthly),
+            "weight": self.weight,
+            "display_mode": self.display_mode,
+        }
+        if self.yearly:
+            result["yearly_usage"] = self._counters_to_dict(self.yearly)
+        for key, value in (self.extra or {}).items():
+            if isinstance(value, dict) and isinstance(result.get(key), dict):
+                for period, inner in value.items():
+                    if isinstance(inner, dict):
+                        result[key].setdefault(period, {}).update(inner)
+                    else:
+                        result[key][period] = inner
+            else:
+                result[key] = value
+        return result
+
+    def copy(self) -> "UserRecord":
+        other = UserRecord(self.original_nick, self.weight, self.display_mode)
+        other.ev_time = array("d", self.ev_time)
+        other.ev_dose = array("d", self.ev_dose)
+        other.ev_sub = array("B", self.ev_sub)
+        other.monthly = {k: array("q", v) for k, v in self.monthly.items()}
+        other.yearly = {k: array("q", v) for k, v in self.yearly.items()}
+        other.extra = copy.deepcopy(self.extra)
+        return other
+
+
+class GuildRecord:
+    __slots__ = ("settings", "users")
+
+    def __init__(self, settings: dict = None, users: dict = None):
+        self.settings = {} if settings is None else settings
+        self.users = {} if users is None else users  # user_id -> UserRecord
+
+    @classmethod
+    def from_dict(cls, raw: dict) -> "GuildRecord":
+        return cls(dict(dict_or_empty(raw.get("settings"))),
+                   {uid: UserRecord.from_dict(user) for uid, user in dict_or_empty(raw.get("users")).items()
+                    if isinstance(user, dict)})
+
+    def to_dict(self) -> dict:
+        return {"settings": self.settings, "users": {uid: user.to_dict() for uid, user in self.users.items()}}
+
+
+def records_from_json(raw: dict) -> dict:
+    """Zamienia wczytany JSON na model w pamięci; wpisy nie-gildie zostają bez zmian."""
+    return {key: GuildRecord.from_dict(value) if is_guild_record(value) else value for key, value in raw.items()}
+
+
+def record_to_json(obj):
+    """`default` dla json.dump – serializuje rekordy modelu."""
+    if isinstance(obj, (GuildRecord, UserRecord)):
+        return obj.to_dict()
+    raise TypeError(f"Nie można zserializować {type(obj).__name__}")
+
+
+# ---------------------------------------------
+# ŚLEDZENIE ZMIAN: które gildie/użytkownicy wymagają zapisu
 # ---------------------------------------------
-guild_data = {}
+# Format: {guild_id: {user_id | None}} – None oznacza zmianę ustawień gildii
+dirty_rows = {}
+guild_versions = {}  # guild_id -> licznik zmian (do wykrywania nieaktualnych widoków)
+deleted_keys = set()  # wpisy usunięte celowo – tylko one mogą zniknąć z magazynu
+
+
+def mark_dirty(guild_id, user_id=None):
+    gid = str(guild_id)
+    dirty_rows.setdefault(gid, set()).add(None if user_id is None else str(user_id))
+    guild_versions[gid] = guild_versions.get(gid, 0) + 1
+
+
+def mark_deleted(key) -> None:
+    """Wpis usunięty z pamięci ma zostać usunięty także z magazynu. Brak gildii
+       w pamięci (np. wyrzuconej przez LRU) nigdy nie oznacza usunięcia."""
+    deleted_keys.add(str(key))
+    mark_dirty(key)
+
+
+def is_guild_record(value) -> bool:
+    if isinstance(value, GuildRecord):
+        return True
+    return isinstance(value, dict) and ("settings" in value or "users" in value)
+
+
+# ---------------------------------------------
+# GLOBALNE DANE: gildie w pamięci ładowane leniwie z magazynu
+# ---------------------------------------------
+class GuildCache(dict):
+    """{guild_id: GuildRecord} dla gildii w pamięci oraz wpisy globalne (np. "_meta").
+       `settings` to mały indeks ustawień wszystkich znanych gildii. Z silnikiem
+       leniwym użytkownicy gildii są wczytywani przy pierwszym dostępie, a czyste
+       gildie ponad `capacity` wracają na dysk (LRU). Iteracja obejmuje tylko
+       gildie w pamięci, `in` – wszystkie znane."""
+
+    def __init__(self, entries: dict = None, settings: dict = None, loader=None, capacity: int = GUILD_CACHE_SIZE):
+        super().__init__()
+        self.settings = {} if settings is None else settings  # guild_id -> ustawienia
+        self.loader = loader  # guild_id -> {user_id: UserRecord}; None = wszystko w pamięci
+        self.capacity = capacity
+        self.recent = OrderedDict()  # kolejność użycia gildii w pamięci (LRU)
+        self.loads = 0
+        self.evictions = 0
+        for key, value in (entries or {}).items():
+            self[key] = value
+
+    def __setitem__(self, key, value) -> None:
+        super().__setitem__(key, value)
+        deleted_keys.discard(key)
+        if isinstance(value, GuildRecord):
+            self.settings[key] = value.settings
+            self.recent[key] = None
+
+    def __contains__(self, key) -> bool:
+        return super().__contains__(key) or key in self.settings
+
+    def __missing__(self, key):
+        if self.loader is None or key not in self.settings:
+            raise KeyError(key)
+        start = time.perf_counter()
+        record = GuildRecord(self.settings[key], self.loader(key))
+        metrics.observe("load_seconds", time.perf_counter() - start, (("scope", "guild"),))
+        self[key] = record
+        self.loads += 1
+        if validate_guild(key, record) and persister.running:
+            persister.notify(MUTATION_BYTES)  # bez pętli zapisu poprawki czekają na najbliższy snapshot
+        on_guild_loaded(key, record)
+        return record
+
+    def touch(self, key) -> None:
+        if key in self.recent:
+            self.recent.move_to_end(key)
+
+    def evict_idle(self) -> int:
+        """Usuwa z pamięci najdawniej używane czyste gildie ponad limit."""
+        excess = len(self.recent) - self.capacity
+        if self.loader is None or excess <= 0:
+            return 0
+        evicted = 0
+        for key in list(self.recent):
+            if evicted >= excess:
+                break
+            if key in dirty_rows or key in persister.saving:
+                continue  # niezapisane zmiany albo zapis w toku – gildia zostaje do udanego snapshotu
+            del self.recent[key]
+            super().pop(key, None)
+            on_guild_evicted(key)
+            evicted += 1
+        self.evictions += evicted
+        return evicted
+
+    def stats(self) -> dict:
+        return {"known": len(self.settings), "resident": len(self.recent),
+                "loads": self.loads, "evictions": self.evictions}
+
+
+guild_data = GuildCache()
+
+
+# ---------------------------------------------
+# SERIALIZACJA: kompaktowy JSON (stdlib, orjson, msgspec) albo MessagePack
+# ---------------------------------------------
+def _stdlib_dumps(obj) -> bytes:
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=record_to_json).encode("utf-8")
+
+
+SERIALIZERS = {"json": _stdlib_dumps}
+if orjson is not None:
+    SERIALIZERS["orjson"] = lambda obj: orjson.dumps(obj, default=record_to_json)
+if msgspec is not None:
+    SERIALIZERS["msgspec"] = msgspec.json.Encoder(enc_hook=record_to_json).encode
+if msgpack is not None:
+    SERIALIZERS["msgpack"] = lambda obj: msgpack.packb(obj, default=record_to_json, use_bin_type=True)
+elif msgspec is not None:
+    SERIALIZERS["msgpack"] = msgspec.msgpack.Encoder(enc_hook=record_to_json).encode
+
+if orjson is not None:
+    _json_loads = orjson.loads
+elif msgspec is not None:
+    _json_loads = msgspec.json.decode
+else:
+    _json_loads = json.loads
+
+
+def encode_payload(obj) -> bytes:
+    return SERIALIZERS[SERIALIZER](obj)
+
+
+class DataFormatError(ValueError):
+    """Plik danych nie daje się odczytać (uszkodzony, pusty albo nieobsługiwany format)."""
+
+
+def decode_payload(payload: bytes):
+    """Format rozpoznawany po nagłówku: JSON zaczyna się od '{', MessagePack od znacznika mapy.
+       Pliki zapisane dowolnym serializatorem wczytują się niezależnie od SERIALIZER."""
+    head = payload.lstrip()[:1]
+    if not head:
+        raise DataFormatError("Pusty plik danych")
+    if head not in (b"{", b"[") and msgpack is None and msgspec is None:
+        raise DataFormatError("Plik w formacie MessagePack – wymaga pakietu msgpack albo msgspec")
+    try:
+        if head in (b"{", b"["):
+            return _json_loads(payload)
+        if msgpack is not None:
+            return msgpack.unpackb(payload, raw=False)
+        return msgspec.msgpack.decode(payload)
+    except Exception as e:  # każdy dekoder ma własne wyjątki – load_data obsługuje jeden typ
+        raise DataFormatError(f"Uszkodzony plik danych: {e}") from e
+
+
+def read_payload(path: str):
+    with open(path, "rb") as f:
+        payload = f.read()
+    metrics.observe("storage_read_bytes", len(payload))
+    return decode_payload(payload)
+
+
+# ---------------------------------------------
+# ATOMOWY ZAPIS PLIKU: plik tymczasowy + fsync + rename
+# ---------------------------------------------
+def atomic_write(path: str, payload: bytes) -> None:
+    """Awaria w trakcie zapisu nigdy nie zostawia uciętego pliku docelowego."""
+    tmp_path = f"{path}.tmp"
+    metrics.observe("storage_write_bytes", len(payload))
+    with open(tmp_path, "wb") as f:
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    if hasattr(os, "O_DIRECTORY"):
+        dir_fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+
+# ---------------------------------------------
+# SILNIKI ZAPISU: JSON (cały plik) i SQLite (tylko zmienione wiersze)
+# ---------------------------------------------
+class JsonStorage:
+    """Cały stan w jednym pliku JSON – każdy zapis przepisuje plik w całości."""
+
+    lazy = False
+
+    def __init__(self, path: str = DATA_FILE):
+        self.path = path
+        self._copies = {}  # gid -> kopia rekordu gildii z ostatniego snapshotu
+
+    def load(self) -> dict:
+        return records_from_json(read_payload(self.path))
+
+    def snapshot(self, data: dict, dirty: dict, deleted: set = frozenset()) -> dict:
+        """Kopia stanu bezpieczna do serializacji poza pętlą zdarzeń.
+           Kopiowane są tylko zmienione gildie, pozostałe pochodzą z poprzednich snapshotów."""
+        result = {}
+        for gid, guild in data.items():
+            if gid in dirty or gid not in self._copies:
+                self._copies[gid] = guild.to_dict() if isinstance(guild, GuildRecord) else copy.deepcopy(guild)
+            result[gid] = self._copies[gid]
+        for gid in set(self._copies) - set(result):
+            del self._copies[gid]
+        return result
+
+    def save(self, data: dict, dirty: dict = None, deleted: set = frozenset()) -> None:
+        atomic_write(self.path, encode_payload(data))
+
+    def close(self) -> None:
+        pass
+
+
+class SqliteStorage:
+    """Stan w bazie SQLite – osobne tabele dla gildii, użytkowników, zdarzeń
+       i liczników miesięcznych. Zapis dotyczy tylko zmienionych wierszy."""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS guilds (
+            guild_id TEXT PRIMARY KEY,
+            settings TEXT NOT NULL DEFAULT '{}'
+        );
+        CREATE TABLE IF NOT EXISTS users (
+            guild_id TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            original_nick TEXT,
+            weight REAL NOT NULL DEFAULT 80.0,
+            display_mode TEXT NOT NULL DEFAULT 'promile',
+            PRIMARY KEY (guild_id, user_id)
+        );
+        CREATE TABLE IF NOT EXISTS events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            guild_id TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            substance TEXT NOT NULL,
+            dose NUMERIC NOT NULL,
+            epoch REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_events_user ON events (guild_id, user_id);
+        CREATE TABLE IF NOT EXISTS monthly_usage (
+            guild_id TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            month TEXT NOT NULL,
+            substance TEXT NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (guild_id, user_id, month, substance)
+        );
+        CREATE TABLE IF NOT EXISTS yearly_usage (
+            guild_id TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            year TEXT NOT NULL,
+            substance TEXT NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (guild_id, user_id, year, substance)
+        );
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        );
+    """
+
+    lazy = True
+
+    def __init__(self, path: str = DB_FILE):
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=SQLITE_BUSY_TIMEOUT, check_same_thread=False)
+        # WAL: odczyty nie blokują zapisu, a kilka procesów (shardów) może dzielić jedną bazę
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(self.SCHEMA)
+        self._migrate_event_timestamps()
+        # Leniwe odczyty z pętli zdarzeń nie dzielą połączenia z zapisem w executorze
+        self.reader = sqlite3.connect(path, timeout=SQLITE_BUSY_TIMEOUT, check_same_thread=False)
+
+    def _migrate_event_timestamps(self) -> None:
+        """Starsze bazy trzymają czas zdarzenia jako tekst ISO (kolumna timestamp) –
+           jednorazowo przepisujemy go na sekundy epoki."""
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(events)")}
+        if "timestamp" not in columns:
+            return
+        self.conn.create_function("iso_to_epoch", 1, parse_timestamp, deterministic=True)
+        self.conn.executescript("""
+            BEGIN;
+            ALTER TABLE events RENAME TO events_legacy;
+            DROP INDEX IF EXISTS idx_events_user;
+            CREATE TABLE events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                guild_id TEXT NOT NULL,
+                user_id TEXT NOT NULL,
+                substance TEXT NOT NULL,
+                dose NUMERIC NOT NULL,
+                epoch REAL NOT NULL
+            );
+            INSERT INTO events (id, guild_id, user_id, substance, dose, epoch)
+                SELECT id, guild_id, user_id, substance, dose, iso_to_epoch(timestamp)
+                FROM events_legacy WHERE iso_to_epoch(timestamp) IS NOT NULL;
+            DROP TABLE events_legacy;
+            CREATE INDEX idx_events_user ON events (guild_id, user_id);
+            COMMIT;
+        """)
+        logging.info(f"Przepisano czasy zdarzeń w {self.path} na sekundy epoki")
+
+    def load(self) -> dict:
+        data, settings = self.load_index()
+        for gid, guild_settings in settings.items():
+            data[gid] = GuildRecord(guild_settings)
+        for (gid, uid), user in self._load_users(self.conn, "", ()).items():
+            data.setdefault(gid, GuildRecord()).users[uid] = user
+        return data
+
+    def load_index(self) -> tuple:
+        """(wpisy globalne, {guild_id: ustawienia}) – bez użytkowników."""
+        cur = self.reader.cursor()
+        meta = {key: json.loads(value) for key, value in cur.execute("SELECT key, value FROM meta")}
+        settings = {gid: json.loads(value) for gid, value in cur.execute("SELECT guild_id, settings FROM guilds")
+                    if owns_guild(gid)}
+        return meta, settings
+
+    def load_users(self, gid: str) -> dict:
+        return {uid: user for (_, uid), user in self._load_users(self.reader, " WHERE guild_id = ?", (gid,)).items()}
+
+    @staticmethod
+    def _load_users(conn, where: str, params: tuple) -> dict:
+        users = {}
+        cur = conn.cursor()
+        for gid, uid, nick, weight, mode in cur.execute(
+                f"SELECT guild_id, user_id, original_nick, weight, display_mode FROM users{where}", params):
+            users[(gid, uid)] = UserRecord(nick, weight, mode)
+        for gid, uid, typ, dose, epoch in cur.execute(
+                f"SELECT guild_id, user_id, substance, dose, epoch FROM events{where} ORDER BY id", params):
+            user = users.get((gid, uid))
+            if user is not None and typ in SUBSTANCE_INDEX and as_number(dose) is not None and as_number(epoch) is not None:
+                user.add_event(SUBSTANCE_INDEX[typ], dose, epoch)
+        for table, column in (("monthly_usage", "month"), ("yearly_usage", "year")):
+            for gid, uid, period, typ, count in cur.execute(
+                    f"SELECT guild_id, user_id, {column}, substance, count FROM {table}{where}", params):
+                user = users.get((gid, uid))
+                if user is not None and typ in SUBSTANCE_INDEX and isinstance(as_number(count), int):
+                    target = user.monthly if table == "monthly_usage" else user.yearly
+                    UserRecord._counters(target, period)[SUBSTANCE_INDEX[typ]] += count
+        return users
+
+    def save(self, data: dict, dirty: dict = None, deleted: set = frozenset()) -> None:
+        """Zapisuje wiersze wskazane w `dirty`; dirty=None oznacza pełny zapis.
+           Wiersze gildii są usuwane tylko dla kluczy z `deleted` (mark_deleted())."""
+        full = dirty is None
+        if full:
+            dirty = {gid: {None, *g.users} if isinstance(g, GuildRecord) else {None} for gid, g in data.items()}
+        with self.conn:
+            if full:
+                for table in ("guilds", "users", "events", "monthly_usage", "yearly_usage", "meta"):
+                    self.conn.execute(f"DELETE FROM {table}")
+            for gid, keys in dirty.items():
+                guild = data.get(gid)
+                if guild is None:
+                    if gid in deleted:
+                        self._delete_guild(gid)
+                        self.conn.execute("DELETE FROM meta WHERE key = ?", (gid,))
+                    else:
+                        logging.warning(f"Pominięto zapis gildii {gid} spoza pamięci")
+                    continue
+                if not is_guild_record(guild):
+                    # Wpisy globalne (np. "_meta") trzymamy w tabeli meta
+                    self.conn.execute(
+                        "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                        (gid, json.dumps(guild, ensure_ascii=False))
+                    )
+                    continue
+                if not full and not owns_guild(gid):
+                    # Wiersze gildii należą do procesu, który obsługuje jej shard
+                    logging.warning(f"Pominięto zapis gildii {gid} należącej do innego sharda")
+                    continue
+                for key in keys:
+                    if key is None:
+                        self.conn.execute(
+                            "INSERT OR REPLACE INTO guilds (guild_id, settings) VALUES (?, ?)",
+                            (gid, json.dumps(guild.settings, ensure_ascii=False))
+                        )
+                    else:
+                        self._write_user(gid, key, guild.users.get(key))
+
+    def snapshot(self, data: dict, dirty: dict, deleted: set = frozenset()) -> dict:
+        """Kopia tylko tych wierszy, które zostaną zapisane."""
+        result = {}
+        for gid, keys in dirty.items():
+            guild = data.get(gid)
+            if guild is None:
+                continue
+            if not is_guild_record(guild):
+                result[gid] = copy.deepcopy(guild)
+                continue
+            result[gid] = GuildRecord(
+                copy.deepcopy(guild.settings),
+                {uid: guild.users[uid].copy() for uid in keys if uid is not None and uid in guild.users},
+            )
+        return result
+
+    def _delete_guild(self, gid: str) -> None:
+        for table in ("guilds", "users", "events", "monthly_usage", "yearly_usage"):
+            self.conn.execute(f"DELETE FROM {table} WHERE guild_id = ?", (gid,))
+
+    def _write_user(self, gid: str, uid: str, user: UserRecord) -> None:
+        for table in ("events", "monthly_usage", "yearly_usage"):
+            self.conn.execute(f"DELETE FROM {table} WHERE guild_id = ? AND user_id = ?", (gid, uid))
+        if user is None:
+            self.conn.execute("DELETE FROM users WHERE guild_id = ? AND user_id = ?", (gid, uid))
+            return
+        self.conn.execute(
+            "INSERT OR REPLACE INTO users (guild_id, user_id, original_nick, weight, display_mode) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (gid, uid, user.original_nick, user.weight, user.display_mode)
+        )
+        self.conn.executemany(
+            "INSERT INTO events (guild_id, user_id, substance, dose, epoch) VALUES (?, ?, ?, ?, ?)",
+            [(gid, uid, SUBSTANCE_KEYS[sub], format_dose(dose), epoch)
+             for sub, dose, epoch in user.events()]
+        )
+        for table, column, periods in (("monthly_usage", "month", user.monthly), ("yearly_usage", "year", user.yearly)):
+            self.conn.executemany(
+                f"INSERT INTO {table} (guild_id, user_id, {column}, substance, count) VALUES (?, ?, ?, ?, ?)",
+                [(gid, uid, period, SUBSTANCE_KEYS[i], count)
+                 for period, counters in periods.items() for i, count in enumerate(counters) if count]
+            )
+
+    def close(self) -> None:
+        self.reader.close()
+        self.conn.close()
+
+
+class ShardedJsonStorage:
+    """Katalog z małym indeksem (ustawienia gildii i wpisy globalne) oraz osobnym
+       plikiem JSON z użytkownikami każdej gildii. Zapis dotyczy tylko zmienionych
+       gildii, a indeks jest przepisywany tylko po zmianie ustawień."""
+
+    lazy = True
+
+    def __init__(self, path: str = GUILDS_DIR):
+        self.path = path
+        self.index_path = os.path.join(path, "index.json")
+        self.journal_seqs = {}  # guild_id -> numer ostatniej zmiany zawartej w pliku gildii
+        os.makedirs(path, exist_ok=True)
+
+    def shard_path(self, gid: str) -> str:
+        return os.path.join(self.path, f"{gid}.json")
+
+    def load_index(self) -> tuple:
+        if not os.path.exists(self.index_path):
+            return {}, {}
+        index = read_payload(self.index_path)
+        return index.get("meta", {}), index.get("guilds", {})
+
+    def load_users(self, gid: str) -> dict:
+        try:
+            raw = read_payload(self.shard_path(gid))
+        except FileNotFoundError:
+            return {}
+        self.journal_seqs[gid] = raw.get("journal_seq", 0)
+        return {uid: UserRecord.from_dict(user) for uid, user in raw.get("users", {}).items()}
+
+    def journal_seq(self, gid: str) -> int:
+        """Pliki gildii są zapisywane przed indeksem – po awarii pomiędzy nimi plik
+           gildii zawiera zmiany nowsze niż journal_seq z indeksu."""
+        return self.journal_seqs.get(gid, 0)
+
+    def snapshot(self, data: dict, dirty: dict = None, deleted: set = frozenset()) -> tuple:
+        """(indeks albo None, {guild_id: zawartość pliku gildii albo None = usunięta gildia})."""
+        full = dirty is None
+        journal_seq = (data.get(META_KEY) or {}).get("journal_seq", 0)
+        if full:
+            dirty = {gid: {None, *g.users} if isinstance(g, GuildRecord) else {None} for gid, g in data.items()}
+        index_changed = full
+        shards = {}
+        for gid, keys in dirty.items():
+            guild = data.get(gid)
+            if not isinstance(guild, GuildRecord):
+                index_changed = True
+                if guild is None and gid in deleted:
+                    shards[gid] = None
+                continue
+            if None in keys:
+                index_changed = True
+            if full or len(keys) > (None in keys):
+                shards[gid] = {"users": {uid: user.to_dict() for uid, user in guild.users.items()},
+                               "journal_seq": journal_seq}
+        index = None
+        if index_changed:
+            if isinstance(data, GuildCache):
+                settings = data.settings
+            else:
+                settings = {gid: g.settings for gid, g in data.items() if isinstance(g, GuildRecord)}
+            index = {
+                "meta": {key: copy.deepcopy(value) for key, value in data.items() if not is_guild_record(value)},
+                "guilds": copy.deepcopy(settings),
+            }
+        return index, shards
+
+    def save(self, data, dirty: dict = None, deleted: set = frozenset()) -> None:
+        """Przyjmuje wynik snapshot() albo stan w pamięci (zapis synchroniczny)."""
+        index, shards = data if isinstance(data, tuple) else self.snapshot(data, dirty, deleted)
+        for gid, shard in shards.items():
+            if shard is None:
+                if os.path.exists(self.shard_path(gid)):
+                    os.remove(self.shard_path(gid))
+                continue
+            atomic_write(self.shard_path(gid), encode_payload(shard))
+        if index is not None:
+            atomic_write(self.index_path, encode_payload(index))
+
+    def close(self) -> None:
+        pass
+
+
+STORAGE_ENGINES = {
+    "json": lambda: JsonStorage(DATA_FILE),
+    "sqlite": lambda: SqliteStorage(DB_FILE),
+    "sharded": lambda: ShardedJsonStorage(GUILDS_DIR),
+}
+storage = None
+
+
+def get_storage():
+    global storage
+    if storage is None:
+        if STORAGE_ENGINE not in STORAGE_ENGINES:
+            raise ValueError(f"Nieznany silnik zapisu: {STORAGE_ENGINE}")
+        if SERIALIZER not in SERIALIZERS:
+            raise ValueError(f"Serializator {SERIALIZER} jest nieznany albo brak jego pakietu")
+        if SHARD_IDS and STORAGE_ENGINE != "sqlite":
+            raise ValueError("Kilka procesów (SHARD_IDS) wymaga wspólnej bazy: STORAGE_ENGINE=sqlite")
+        storage = STORAGE_ENGINES[STORAGE_ENGINE]()
+        logging.info(f"Silnik zapisu: {STORAGE_ENGINE} (serializator: {SERIALIZER})")
+    return storage
+
+
+# ---------------------------------------------
+# SCHEMAT DANYCH: wersje, migracje i walidacja przy wczytaniu
+# ---------------------------------------------
+DISPLAY_MODES = ("promile", "emoji")
+WEIGHT_LIMITS = (0.0, 1000.0)  # kg, przedział otwarty
+
+
+def valid_weight(weight) -> bool:
+    """Waga, na której można liczyć promile (odrzuca też nan i inf)."""
+    if isinstance(weight, bool) or not isinstance(weight, (int, float)):
+        return False
+    return WEIGHT_LIMITS[0] < weight < WEIGHT_LIMITS[1]
+
+
+def _drop_dead_guilds_key(data: GuildCache) -> None:
+    """v1: dawny load_data zakładał pusty wpis "guilds" – gildie zawsze leżały na najwyższym poziomie."""
+    if dict.__contains__(data, "guilds") and not isinstance(data.get("guilds"), GuildRecord):
+        del data["guilds"]
+        mark_deleted("guilds")
+
+
+def _clean_id_settings(data: GuildCache) -> None:
+    """v2: identyfikatory kanałów/wiadomości jako int; None po nieudanym wysłaniu wiadomości znika."""
+    for gid, settings in list(data.settings.items()):
+        fixed = {}
+        for key, value in settings.items():
+            if not key.endswith("_id") or (isinstance(value, int) and not isinstance(value, bool)):
+                continue
+            fixed[key] = int(value) if isinstance(value, str) and value.isdigit() else None
+        if not fixed:
+            continue
+        if data.loader is not None:
+            data[gid]  # gildia musi być w pamięci, zanim trafi do dirty_rows
+        for key, value in fixed.items():
+            if value is None:
+                del settings[key]
+            else:
+                settings[key] = value
+        mark_dirty(gid)
+
+
+MIGRATIONS = {  # wersja docelowa -> funkcja(guild_data)
+    1: _drop_dead_guilds_key,
+    2: _clean_id_settings,
+}
+
+
+def migrate_schema(data: GuildCache) -> int:
+    """Podnosi wczytane dane do SCHEMA_VERSION. Zwraca liczbę wykonanych migracji."""
+    meta = data.setdefault(META_KEY, {})
+    version = meta.get("schema", 0)
+    if version > SCHEMA_VERSION:
+        raise RuntimeError(f"Dane mają schemat v{version}, a ta wersja bota obsługuje najwyżej v{SCHEMA_VERSION}")
+    for target in range(version + 1, SCHEMA_VERSION + 1):
+        logging.info(f"Migracja danych do schematu v{target}")
+        MIGRATIONS[target](data)
+    if version != SCHEMA_VERSION:
+        meta["schema"] = SCHEMA_VERSION
+        mark_dirty(META_KEY)
+    return SCHEMA_VERSION - version
+
+
+def validate_guild(gid: str, guild: GuildRecord) -> int:
+    """Jednorazowa kontrola rekordów po wczytaniu – dalszy kod zakłada poprawne typy.
+       Błędne wartości są zastępowane domyślnymi. Zwraca liczbę poprawek."""
+    fixes = 0
+    for uid, user in guild.users.items():
+        changed = False
+        if not valid_weight(user.weight):
+            user.weight, changed = 80.0, True
+        if user.display_mode not in DISPLAY_MODES:
+            user.display_mode, changed = "promile", True
+        if user.original_nick is not None and not isinstance(user.original_nick, str):
+            user.original_nick, changed = str(user.original_nick), True
+        if changed:
+            fixes += 1
+            mark_dirty(gid, uid)
+    if fixes:
+        logging.warning(f"Gildia {gid}: poprawiono {fixes} rekordów użytkowników")
+    return fixes
 
 
 # ---------------------------------------------
 # FUNKCJE ZAPISU I ODCZYTU DANYCH
 # ---------------------------------------------
+data_loaded = False  # dopiero po udanym load_data() stan w pamięci może trafić na dysk
+
+
 def load_data():
-    global guild_data
-    if not os.path.exists(DATA_FILE):
-        guild_data = {"guilds": {}}
-        save_data()
+    """Wczytuje, migruje i sprawdza dane. Błąd (np. nowszy schemat) zostawia
+       data_loaded = False – wtedy żaden zapis nie nadpisze magazynu."""
+    global guild_data, data_loaded
+    data_loaded = False
+    engine = get_storage()
+    start = time.perf_counter()
+    if isinstance(engine, JsonStorage) and not os.path.exists(engine.path):
+        # Bez save_data() – dziennik z poprzedniego uruchomienia musi przetrwać do odtworzenia
+        engine.save({META_KEY: {"schema": SCHEMA_VERSION}})
     try:
-        with open(DATA_FILE, "r", encoding="utf-8") as f:
-            guild_data = json.load(f)
-    except (json.JSONDecodeError, OSError):
-        logging.error("Błąd odczytu pliku JSON – tworzenie nowego pliku...")
-        guild_data = {"guilds": {}}
-        save_data()
+        if engine.lazy:
+            # Przy starcie tylko indeks – użytkownicy gildii wczytują się przy pierwszym dostępie
+            meta, settings = engine.load_index()
+            guild_data = GuildCache(meta, settings, loader=engine.load_users)
+        else:
+            guild_data = GuildCache(engine.load())
+    except (DataFormatError, json.JSONDecodeError, OSError, sqlite3.Error):
+        logging.error("Błąd odczytu danych – tworzenie nowego magazynu...")
+        guild_data = GuildCache({META_KEY: {"schema": SCHEMA_VERSION}}, loader=engine.load_users if engine.lazy else None)
+        # Bez pełnego przepisania – baza może być współdzielona z innymi shardami
+        engine.save(guild_data, {})
+    dirty_rows.clear()
+    metrics.observe("load_seconds", time.perf_counter() - start, (("scope", "index" if engine.lazy else "full"),))
+    migrated = migrate_schema(guild_data)
+    for gid, guild in guild_data.items():
+        if isinstance(guild, GuildRecord):
+            migrated += validate_guild(gid, guild)
+    expiry_scheduler.rebuild(guild_data)
+    if journal.enabled:
+        replayed = journal.replay(guild_data[META_KEY].get("journal_seq", 0), getattr(engine, "journal_seq", None))
+        if replayed:
+            logging.info(f"Odtworzono {replayed} zmian z dziennika {journal.path}")
+    data_loaded = True
+    if migrated:
+        save_data()  # poprawiony układ od razu na dysk (dziennik jest już odtworzony)
+    status_messages.rebuild(guild_data.settings)
+    logging.info(f"Wczytano indeks gildii: {guild_data.stats()}")
 
 
 def save_data():
+    """Synchroniczny zapis – tylko przy starcie i po zatrzymaniu pętli zdarzeń."""
+    if not data_loaded:
+        logging.error("Dane nie zostały wczytane – pomijam zapis, żeby nie nadpisać magazynu")
+        return
     try:
-        with open(DATA_FILE, "w", encoding="utf-8") as f:
-            json.dump(guild_data, f, ensure_ascii=False, indent=2)
-        logging.info("Dane zapisano do pliku.")
-    except OSError as e:
-        logging.error(f"Błąd zapisu pliku JSON: {e}")
+        start = time.perf_counter()
+        if journal.enabled:
+            stamp_journal_seq()
+        dirty = dict(dirty_rows)
+        deleted = deleted_keys & dirty.keys()
+        get_storage().save(guild_data, dirty, deleted)
+        dirty_rows.clear()
+        deleted_keys.difference_update(deleted)
+        if journal.enabled:
+            # Snapshot zawiera już wszystkie zmiany, łącznie z niezapisanymi w dzienniku
+            journal.discard_pending()
+            journal.truncate()
+        metrics.observe("save_seconds", time.perf_counter() - start, (("kind", "sync"),))
+        logging.debug("Dane zapisano.")
+    except (OSError, sqlite3.Error) as e:
+        logging.error(f"Błąd zapisu danych: {e}")
+
+
+# ---------------------------------------------
+# DZIENNIK ZMIAN: append-only, jedna zmiana na linię (JSON)
+# ---------------------------------------------
+class MutationJournal:
+    """Dopisuje rekordy zmian do pliku i synchronizuje je partiami.
+       Przy starcie rekordy nowsze niż snapshot są odtwarzane na guild_data."""
+
+    def __init__(self, path: str = JOURNAL_FILE, compact_bytes: int = JOURNAL_COMPACT_BYTES,
+                 enabled: bool = JOURNAL_ENABLED):
+        self.path = path
+        self.compact_bytes = compact_bytes
+        self.enabled = enabled
+        self.seq = 0
+        self.size = os.path.getsize(path) if os.path.exists(path) else 0
+        self._pending = []
+
+    def append(self, record: dict) -> int:
+        self.seq += 1
+        record["seq"] = self.seq
+        line = json.dumps(record, ensure_ascii=False)
+        self._pending.append(line)
+        return len(line) + 1
+
+    def take_pending(self) -> list:
+        lines, self._pending = self._pending, []
+        return lines
+
+    def requeue(self, lines: list) -> None:
+        self._pending[:0] = lines
+
+    def discard_pending(self) -> None:
+        self._pending = []
+
+    def write(self, lines: list) -> None:
+        """Dopisuje partię rekordów i wykonuje jeden fsync (wołane w executorze)."""
+        payload = "".join(f"{line}\n" for line in lines).encode("utf-8")
+        with open(self.path, "ab") as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        self.size += len(payload)
+        metrics.observe("storage_write_bytes", len(payload))
+
+    def truncate(self) -> None:
+        with open(self.path, "wb") as f:
+            os.fsync(f.fileno())
+        self.size = 0
+
+    def needs_compaction(self) -> bool:
+        return self.size >= self.compact_bytes
+
+    def replay(self, since_seq: int, guild_seq=None) -> int:
+        """`guild_seq(guild_id)` – numer zmiany zawartej już w danych gildii (silnik
+           z osobnymi plikami gildii); takie rekordy użytkowników są pomijane."""
+        self.seq = since_seq
+        if not os.path.exists(self.path):
+            return 0
+        replayed = 0
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # Ucięta ostatnia linia po awarii w trakcie dopisywania
+                    logging.warning(f"Uszkodzony rekord w dzienniku {self.path} – pomijam resztę pliku")
+                    break
+                if record.get("seq", 0) <= since_seq:
+                    continue
+                gid = record.get("g")
+                if guild_seq is not None and record["op"] != "settings" and gid in guild_data:
+                    guild_data[gid]  # wczytanie gildii ustala jej guild_seq
+                    if record["seq"] <= guild_seq(gid):
+                        self.seq = record["seq"]
+                        continue
+                apply_mutation(record)
+                self.seq = record["seq"]
+                replayed += 1
+        return replayed
+
+
+journal = MutationJournal()
+
+
+def stamp_journal_seq() -> None:
+    """Zapisuje w snapshotcie numer ostatniej zmiany, którą snapshot obejmuje."""
+    guild_data.setdefault(META_KEY, {})["journal_seq"] = journal.seq
+    mark_dirty(META_KEY)
+
+
+# ---------------------------------------------
+# ZMIANY STANU: jedno miejsce dla obsługi na żywo i odtwarzania dziennika
+# ---------------------------------------------
+def apply_mutation(record: dict) -> None:
+    """Rekordy: consume, clear, setweight, setmode, settings."""
+    op = record["op"]
+    gid = record["g"]
+    if gid not in guild_data:
+        guild_data[gid] = GuildRecord()
+        mark_dirty(gid)
+    guild = guild_data[gid]
+    guild_data.touch(gid)
+    if op == "settings":
+        guild.settings[record["key"]] = record["value"]
+        mark_dirty(gid)
+        if record["key"] == "status_message_id":
+            status_messages.update(gid, guild.settings)
+        return
+    users = guild.users
+    uid = record["u"]
+    if op == "clear":
+        users.pop(uid, None)
+        mark_dirty(gid, uid)
+        update_bac_state(record)
+        update_monthly_ranking(gid, uid, None)
+        return
+    if uid not in users:
+        users[uid] = create_new_user(record.get("nick"))
+    data = users[uid]
+    if op == "consume":
+        sub = SUBSTANCE_INDEX[record["typ"]]
+        epoch = parse_timestamp(record["ts"])
+        if epoch is not None:
+            data.add_event(sub, record["dose"], epoch)
+            expiry_scheduler.push(gid, uid, sub, epoch, record["dose"], data.weight)
+        data.bump_month(record["month"], sub)
+        update_monthly_ranking(gid, uid, data, record["month"])
+    elif op == "setweight":
+        data.weight = record["weight"]
+    elif op == "setmode":
+        data.display_mode = record["mode"]
+    else:
+        logging.warning(f"Nieznany typ zmiany: {op}")
+        return
+    mark_dirty(gid, uid)
+    update_bac_state(dict(record, weight=data.weight) if op == "consume" else record)
+
+
+def commit_mutation(record: dict) -> None:
+    """Stosuje zmianę, dopisuje ją do dziennika i zgłasza zapis w tle."""
+    apply_mutation(record)
+    nbytes = journal.append(record) if journal.enabled else MUTATION_BYTES
+    schedule_save(nbytes)
+
+
+def commit_settings(guild_id, **values) -> None:
+    for key, value in values.items():
+        commit_mutation({"op": "settings", "g": str(guild_id), "key": key, "value": value})
+
+
+# ---------------------------------------------
+# ZAPIS W TLE (WRITE-BEHIND): łączenie zmian i zapis poza pętlą zdarzeń
+# ---------------------------------------------
+class WriteBehindPersister:
+    """Zbiera zmiany oznaczone przez mark_dirty() i zapisuje je jednym flushem
+       co `interval` sekund albo po przekroczeniu `byte_budget` bajtów zmian.
+       Serializacja i zapis odbywają się w jednowątkowym executorze."""
+
+    def __init__(self, interval: float = SAVE_INTERVAL_SECONDS, byte_budget: int = SAVE_BYTE_BUDGET):
+        self.interval = interval
+        self.byte_budget = byte_budget
+        self.pending_bytes = 0
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="persister")
+        self.saving = set()  # gildie z zapisu w toku – nie mogą zostać wyrzucone z pamięci
+        self.flush_count = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+        self._wakeup = None
+        self._lock = None
+        self._task = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self._wakeup = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def notify(self, nbytes: int = MUTATION_BYTES) -> None:
+        self.pending_bytes += nbytes
+        if self.pending_bytes >= self.byte_budget and self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self, compact: bool = False) -> None:
+        """Z dziennikiem: dopisuje oczekujące rekordy, a snapshot zapisuje dopiero
+           po przekroczeniu progu kompakcji (albo gdy compact=True)."""
+        if self._lock is None:
+            save_data()
+            return
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            self.pending_bytes = 0
+            if not journal.enabled:
+                await self._write_snapshot(loop)
+                return
+            lines = journal.take_pending()
+            start = time.perf_counter()
+            if lines:
+                try:
+                    await loop.run_in_executor(self.executor, journal.write, lines)
+                except OSError as e:
+                    journal.requeue(lines)
+                    logging.error(f"Błąd zapisu dziennika: {e}")
+                    return
+                self._record_timing(time.perf_counter() - start, "journal")
+            if compact or journal.needs_compaction():
+                stamp_journal_seq()
+                if await self._write_snapshot(loop):
+                    await loop.run_in_executor(self.executor, journal.truncate)
+                    logging.info("Dziennik zmian skompaktowany do snapshotu.")
+
+    async def _write_snapshot(self, loop) -> bool:
+        if not dirty_rows:
+            return True
+        dirty = dict(dirty_rows)
+        dirty_rows.clear()
+        deleted = deleted_keys & dirty.keys()
+        engine = get_storage()
+        snapshot = engine.snapshot(guild_data, dirty, deleted)
+        start = time.perf_counter()
+        self.saving.update(dirty)
+        try:
+            await loop.run_in_executor(self.executor, engine.save, snapshot, dirty, deleted)
+        except (OSError, sqlite3.Error) as e:
+            for gid, keys in dirty.items():
+                dirty_rows.setdefault(gid, set()).update(keys)
+            logging.error(f"Błąd zapisu danych: {e}")
+            return False
+        finally:
+            self.saving.difference_update(dirty)
+        deleted_keys.difference_update(deleted)
+        self._record_timing(time.perf_counter() - start, "snapshot")
+        logging.debug(f"Zapisano {len(dirty)} gildii w {self.last_flush_ms:.1f} ms")
+        return True
+
+    def _record_timing(self, elapsed: float, kind: str) -> None:
+        metrics.observe("save_seconds", elapsed, (("kind", kind),))
+        elapsed_ms = elapsed * 1000
+        self.flush_count += 1
+        self.last_flush_ms = elapsed_ms
+        self.total_flush_ms += elapsed_ms
+        self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+
+    async def stop(self) -> None:
+        """Zatrzymuje pętlę zapisu i wykonuje ostatni flush z kompakcją dziennika."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush(compact=True)
+
+    def stats(self) -> dict:
+        return {
+            "flush_count": self.flush_count,
+            "last_flush_ms": self.last_flush_ms,
+            "max_flush_ms": self.max_flush_ms,
+            "avg_flush_ms": self.total_flush_ms / self.flush_count if self.flush_count else 0.0,
+            "pending_bytes": self.pending_bytes,
+        }
+
+
+persister = WriteBehindPersister()
+
+
+def schedule_save(nbytes: int = MUTATION_BYTES) -> None:
+    """Zgłasza zmiany do zapisu w tle; bez działającej pętli zapisuje od razu."""
+    if persister.running:
+        persister.notify(nbytes)
+    elif data_loaded:
+        save_data()
+
+
+# ---------------------------------------------
+# MIGRACJA I EKSPORT: data.json -> SQLite/katalog, stan -> czytelny JSON
+# ---------------------------------------------
+def migrate_json_storage(json_path: str = DATA_FILE, target_path: str = DB_FILE) -> int:
+    """Przenosi dotychczasowy plik data.json do bazy SQLite (ścieżka *.db) albo do
+       katalogu z plikiem na gildię (każda inna ścieżka). Zwraca liczbę gildii."""
+    data = read_payload(json_path)
+    guilds = {gid: GuildRecord.from_dict(g) for gid, g in data.items() if is_guild_record(g)}
+    if META_KEY in data:
+        guilds[META_KEY] = data[META_KEY]
+    target = SqliteStorage(target_path) if target_path.endswith(".db") else ShardedJsonStorage(target_path)
+    try:
+        target.save(guilds)
+    finally:
+        target.close()
+    logging.info(f"Zmigrowano {len(guilds)} gildii z {json_path} do {target_path}")
+    return len(guilds)
+
+
+def export_data(target_path: str = EXPORT_FILE) -> int:
+    """Zapisuje cały stan (ze wszystkimi gildiami i odtworzonym dziennikiem) jako
+       sformatowany JSON do czytania przez ludzi. Zwraca liczbę gildii."""
+    load_data()
+    for gid in list(guild_data.settings):
+        guild_data[gid]  # silnik leniwy – wczytanie użytkowników gildii
+    atomic_write(target_path, json.dumps(dict(guild_data), ensure_ascii=False, indent=2,
+                                         default=record_to_json).encode("utf-8"))
+    count = sum(1 for value in guild_data.values() if isinstance(value, GuildRecord))
+    logging.info(f"Wyeksportowano {count} gildii do {target_path}")
+    return count
 
 
 # ---------------------------------------------
 # FUNKCJE POMOCNICZE: Ustawienia i użytkownicy dla gildii
 # ---------------------------------------------
-def get_guild_settings(guild: discord.Guild):
+def get_guild_record(guild: discord.Guild) -> GuildRecord:
     gid = str(guild.id)
     if gid not in guild_data:
-        guild_data[gid] = {"settings": {}, "users": {}}
-    return guild_data[gid]["settings"]
+        guild_data[gid] = GuildRecord()
+        mark_dirty(gid)
+    guild_data.touch(gid)
+    return guild_data[gid]
+
+
+def get_guild_settings(guild: discord.Guild):
+    # Ustawienia są w indeksie – odczyt nie wymaga wczytania użytkowników gildii
+    settings = guild_data.settings.get(str(guild.id))
+    return settings if settings is not None else get_guild_record(guild).settings
 
 
 def get_guild_users(guild: discord.Guild):
-    gid = str(guild.id)
-    if gid not in guild_data:
-        guild_data[gid] = {"settings": {}, "users": {}}
-    return guild_data[gid]["users"]
+    return get_guild_record(guild).users
 
 
 def get_current_month():
     return datetime.datetime.now(timezone.utc).strftime("%Y-%m")
 
 
-def create_new_user(nick: str):
-    return {
-        "original_nick": nick,
-        "consumptions": {typ: [] for typ in VALID_TYPES},
-        "monthly_usage": {},  # Format: {"YYYY-MM": {typ: aggregated_count}}
-        "weight": 80.0,
-        "display_mode": "promile"
-    }
+def create_new_user(nick: str) -> UserRecord:
+    # W JSON: "monthly_usage": {"YYYY-MM": {typ: count}} bez zer, starsze miesiące
+    # w "yearly_usage": {"YYYY": {typ: count}} (roll_up_history)
+    return UserRecord(nick, 80.0, "promile")
 
 
 # ---------------------------------------------
@@ -125,74 +1606,870 @@ def create_new_user(nick: str):
 #     return nick
 
 
+# ---------------------------------------------
+# INDEKS NAZW CZŁONKÓW: id -> nazwa wyświetlana, name/nick -> id
+# ---------------------------------------------
+class MemberDirectory:
+    """Indeks nazw członków gildii budowany przy pierwszym użyciu z guild.members
+       i aktualizowany zdarzeniami on_member_*. Brakujący użytkownicy są pobierani
+       partiami, a nieudane wyszukania zapamiętywane na `miss_ttl` sekund."""
+
+    QUERY_BATCH = 100  # limit identyfikatorów w jednym zapytaniu o członków
+
+    def __init__(self, miss_ttl: float = MEMBER_MISS_TTL):
+        self.miss_ttl = miss_ttl
+        self.guilds = {}  # guild_id -> (id -> nazwa, name -> id, nick -> id)
+        self.misses = {}  # (guild_id, user_id) -> chwila wygaśnięcia
+        self.queried = 0
+        self.negative_hits = 0
+
+    def _index(self, guild: discord.Guild) -> tuple:
+        entry = self.guilds.get(guild.id)
+        if entry is None:
+            entry = self.guilds[guild.id] = ({}, {}, {})
+            for member in guild.members:
+                self._put(entry, member)
+        return entry
+
+    @staticmethod
+    def _put(entry: tuple, member: discord.Member) -> None:
+        display, by_name, by_nick = entry
+        display[member.id] = member.display_name
+        by_name[member.name] = member.id
+        if member.nick:
+            by_nick[member.nick] = member.id
+
+    @staticmethod
+    def _drop(entry: tuple, member: discord.Member) -> None:
+        display, by_name, by_nick = entry
+        display.pop(member.id, None)
+        if by_name.get(member.name) == member.id:
+            del by_name[member.name]
+        if member.nick and by_nick.get(member.nick) == member.id:
+            del by_nick[member.nick]
+
+    def add(self, member: discord.Member) -> None:
+        self.misses.pop((member.guild.id, member.id), None)
+        entry = self.guilds.get(member.guild.id)
+        if entry is not None:
+            self._put(entry, member)
+
+    def remove(self, member: discord.Member) -> None:
+        entry = self.guilds.get(member.guild.id)
+        if entry is not None:
+            self._drop(entry, member)
+
+    def update(self, before: discord.Member, after: discord.Member) -> None:
+        entry = self.guilds.get(after.guild.id)
+        if entry is not None:
+            self._drop(entry, before)
+            self._put(entry, after)
+
+    def display_name(self, guild: discord.Guild, user_id) -> str:
+        return self._index(guild)[0].get(int(user_id))
+
+    def find(self, guild: discord.Guild, name: str) -> int:
+        """Id członka o podanej nazwie lub nicku (None, gdy brak)."""
+        _, by_name, by_nick = self._index(guild)
+        user_id = by_name.get(name)
+        return user_id if user_id is not None else by_nick.get(name)
+
+    def is_missing(self, guild_id: int, user_id: int) -> bool:
+        expiry = self.misses.get((guild_id, user_id))
+        if expiry is None:
+            return False
+        if expiry <= time.monotonic():
+            del self.misses[(guild_id, user_id)]
+            return False
+        self.negative_hits += 1
+        return True
+
+    def mark_missing(self, guild_id: int, user_id: int) -> None:
+        self.misses[(guild_id, user_id)] = time.monotonic() + self.miss_ttl
+
+    async def resolve(self, guild: discord.Guild, user_ids) -> dict:
+        """{user_id: nazwa} – z indeksu, a brakujących jednym zapytaniem na partię."""
+        entry = self._index(guild)
+        display = entry[0]
+        names = {}
+        missing = []
+        for user_id in map(int, user_ids):
+            name = display.get(user_id)
+            if name is not None:
+                names[user_id] = name
+            elif not self.is_missing(guild.id, user_id):
+                missing.append(user_id)
+        for i in range(0, len(missing), self.QUERY_BATCH):
+            chunk = missing[i:i + self.QUERY_BATCH]
+            self.queried += len(chunk)
+            try:
+                members = await guild.query_members(user_ids=chunk, limit=len(chunk))
+            except (asyncio.TimeoutError, discord.ClientException) as e:
+                logging.warning(f"Nie udało się pobrać członków {guild.name}: {e}")
+                continue
+            for member in members:
+                self._put(entry, member)
+                names[member.id] = member.display_name
+            for user_id in chunk:
+                if user_id not in names:
+                    self.mark_missing(guild.id, user_id)
+        return names
+
+    def stats(self) -> dict:
+        return {"guilds": len(self.guilds), "misses": len(self.misses),
+                "queried": self.queried, "negative_hits": self.negative_hits}
+
+
+member_directory = MemberDirectory()
+
+
 # ---------------------------------------------
 # POMOCNICZA FUNKCJA: Pobranie obiektu Member
 # ---------------------------------------------
 async def get_member(guild: discord.Guild, user_id: int) -> discord.Member:
     member = guild.get_member(user_id)
-    if member is None:
+    if member is None and not member_directory.is_missing(guild.id, user_id):
         try:
+            await rest_budget.acquire("guild", guild.id)
             member = await guild.fetch_member(user_id)
         except discord.NotFound:
+            member_directory.mark_missing(guild.id, user_id)
             member = None
     return member
 
 
 # ---------------------------------------------
-# PRUNING: Usuwanie przeterminowanych zdarzeń spożycia
-# ---------------------------------------------
-def prune_consumptions(data: dict, weight: float):
-    r = 0.68
-    now = datetime.datetime.now(timezone.utc)
-    new_consumptions = {}
-    for typ, events in data.get("consumptions", {}).items():
-        new_events = []
-        for event in events:
-            try:
-                event_time = datetime.datetime.fromisoformat(event["timestamp"])
-            except Exception:
+# PRUNING: kopiec wygasania zdarzeń (bez skanowania wszystkich użytkowników)
+# ---------------------------------------------
+class ExpiryScheduler:
+    """Min-kopiec (chwila wyzerowania, ...) dla każdego zdarzenia spożycia.
+       prune() zdejmuje tylko zdarzenia, których czas już minął. Zmiana wagi
+       przesuwa wygasanie, więc zdjęty wpis jest weryfikowany z aktualną wagą."""
+
+    def __init__(self):
+        self.heap = []
+        self._counter = itertools.count()
+        self.pruned_total = 0
+        self.last_pruned = 0
+        self.last_run_ms = 0.0
+
+    @staticmethod
+    def expiry_of(sub: int, dose: float, epoch: float, weight: float) -> float:
+        if sub == BLUNT_INDEX:
+            return epoch + SUBSTANCES["blunt"]["duration_hours"] * 3600.0
+        return epoch + base_bac_of(sub, dose, weight) / ELIMINATION_RATE * 3600.0
+
+    def push(self, guild_id: str, user_id: str, sub: int, epoch: float, dose: float, weight: float) -> None:
+        expiry = self.expiry_of(sub, dose, epoch, weight)
+        heapq.heappush(self.heap, (expiry, next(self._counter), guild_id, user_id, sub, epoch, dose))
+
+    def rebuild(self, data: dict) -> None:
+        self.heap = []
+        for gid, guild in data.items():
+            if isinstance(guild, GuildRecord):
+                self._collect(gid, guild)
+        heapq.heapify(self.heap)
+
+    def add_guild(self, gid: str, guild: GuildRecord) -> None:
+        """Dokłada zdarzenia gildii wczytanej leniwie. Wpisy pozostałe po jej
+           wcześniejszym usunięciu z pamięci są bezpieczne – prune() je pominie."""
+        self._collect(gid, guild)
+        heapq.heapify(self.heap)
+
+    def _collect(self, gid: str, guild: GuildRecord) -> None:
+        for uid, user in guild.users.items():
+            for sub, dose, epoch in user.events():
+                expiry = self.expiry_of(sub, dose, epoch, user.weight)
+                self.heap.append((expiry, next(self._counter), gid, uid, sub, epoch, dose))
+
+    def prune(self, now: float = None) -> int:
+        if now is None:
+            now = time.time()
+        start = time.perf_counter()
+        pruned = 0
+        while self.heap and self.heap[0][0] <= now:
+            entry = heapq.heappop(self.heap)
+            _, _, gid, uid, sub, epoch, dose = entry
+            guild = guild_data.get(gid)
+            user = guild.users.get(uid) if isinstance(guild, GuildRecord) else None
+            if user is None:
+                continue  # użytkownik wyczyszczony – wpis nieaktualny
+            expiry = self.expiry_of(sub, dose, epoch, user.weight)
+            if expiry > now:
+                # Waga zmalała od czasu wstawienia – zdarzenie jeszcze trwa
+                heapq.heappush(self.heap, (expiry,) + entry[1:])
                 continue
-            hours_elapsed = (now - event_time).total_seconds() / 3600.0
-            if typ == "blunt":
-                if hours_elapsed < SUBSTANCES[typ]["duration_hours"]:
-                    new_events.append(event)
-            else:
-                dose = event.get("dose", 0)
-                base_bac = (dose * SUBSTANCES[typ]["ethanol_grams"]) / (weight * 1000 * r) * 1000
-                current_bac = base_bac - 0.15 * hours_elapsed
-                if current_bac > 0:
-                    new_events.append(event)
-        if new_events:
-            new_consumptions[typ] = new_events
-    data["consumptions"] = new_consumptions
+            if not user.remove_event(sub, epoch):
+                continue
+            event_archive.add(gid, uid, sub, dose, epoch)
+            mark_dirty(gid, uid)
+            pruned += 1
+        self.pruned_total += pruned
+        self.last_pruned = pruned
+        self.last_run_ms = (time.perf_counter() - start) * 1000
+        return pruned
+
+    def next_expiry(self) -> float:
+        return self.heap[0][0] if self.heap else None
+
+    def stats(self) -> dict:
+        return {
+            "heap_size": len(self.heap),
+            "pruned_total": self.pruned_total,
+            "last_pruned": self.last_pruned,
+            "last_run_ms": self.last_run_ms,
+        }
+
+
+expiry_scheduler = ExpiryScheduler()
+
+
+# ---------------------------------------------
+# RETENCJA HISTORII: archiwum zdarzeń i zwijanie starych miesięcy
+# ---------------------------------------------
+class EventArchive:
+    """Wygasłe zdarzenia wychodzą z pamięci do pliku JSONL (jedno zdarzenie na linię)."""
+
+    def __init__(self, path: str = ARCHIVE_FILE):
+        self.path = path
+        self._pending = []
+
+    def add(self, guild_id: str, user_id: str, sub: int, dose: float, epoch: float) -> None:
+        self._pending.append(json.dumps({"g": guild_id, "u": user_id, "typ": SUBSTANCE_KEYS[sub],
+                                         "dose": format_dose(dose), "timestamp": epoch}))
+
+    def take_pending(self) -> list:
+        lines, self._pending = self._pending, []
+        return lines
+
+    def write(self, lines: list) -> None:
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write("".join(f"{line}\n" for line in lines))
+
+
+event_archive = EventArchive()
+
+
+def shift_month(month: str, delta: int) -> str:
+    year, mon = map(int, month.split("-"))
+    index = year * 12 + (mon - 1) + delta
+    return f"{index // 12:04d}-{index % 12 + 1:02d}"
+
+
+def roll_up_user(data: UserRecord, oldest_kept: str) -> bool:
+    """Zwija miesiące starsze niż `oldest_kept` do sum rocznych (zera i tak nie są zapisywane)."""
+    old_months = [month for month in data.monthly if month < oldest_kept]
+    for month in old_months:
+        data.add_year(month[:4], data.monthly.pop(month))
+    return bool(old_months)
+
+
+def roll_up_history(current_month: str = None, retention_months: int = RETENTION_MONTHS) -> int:
+    """Zwija historię wszystkich użytkowników; zwraca liczbę zmienionych rekordów."""
+    oldest_kept = shift_month(current_month or get_current_month(), -(retention_months - 1))
+    changed = 0
+    for gid, guild in guild_data.items():
+        if isinstance(guild, GuildRecord):
+            changed += roll_up_guild(gid, guild, oldest_kept)
+    return changed
+
+
+def roll_up_guild(gid: str, guild: GuildRecord, oldest_kept: str) -> int:
+    changed = 0
+    for uid, data in guild.users.items():
+        if roll_up_user(data, oldest_kept):
+            mark_dirty(gid, uid)
+            changed += 1
+    return changed
 
 
 # ---------------------------------------------
 # OBLICZANIE PROMILI (BAC) Z METABOLIZMEM
 # ---------------------------------------------
-def compute_bac(data: dict, weight: float) -> float:
+@metrics.timed("bac_seconds", (("fn", "compute_bac"),))
+def compute_bac(data: UserRecord, weight: float, now: datetime.datetime = None) -> float:
     elimination_rate = 0.15  # promile na godzinę
     total_bac = 0.0
-    now = datetime.datetime.now(timezone.utc)
+    if now is None:
+        now = datetime.datetime.now(timezone.utc)
+    now_epoch = now.timestamp()
     r = 0.68  # stała dystrybucji
-    for typ in VALID_TYPES:
-        if typ == "blunt":
+    for sub, dose, epoch in data.events():
+        if sub == BLUNT_INDEX:
             continue
-        events = data.get("consumptions", {}).get(typ, [])
-        for event in events:
-            try:
-                event_time = datetime.datetime.fromisoformat(event["timestamp"])
-            except Exception:
-                continue
-            hours_elapsed = (now - event_time).total_seconds() / 3600.0
-            base_bac = (event["dose"] * SUBSTANCES[typ]["ethanol_grams"]) / (weight * 1000 * r) * 1000
-            current_bac = base_bac - elimination_rate * hours_elapsed
-            if current_bac < 0:
-                current_bac = 0
-            total_bac += current_bac
+        hours_elapsed = (now_epoch - epoch) / 3600.0
+        base_bac = (dose * SUBSTANCE_GRAMS[sub]) / (weight * 1000 * r) * 1000
+        current_bac = base_bac - elimination_rate * hours_elapsed
+        if current_bac < 0:
+            current_bac = 0
+        total_bac += current_bac
     return total_bac
 
 
+# ---------------------------------------------
+# PRZYROSTOWY STAN PROMILI UŻYTKOWNIKA
+# ---------------------------------------------
+ELIMINATION_RATE = 0.15  # promile na godzinę
+DISTRIBUTION_R = 0.68  # stała dystrybucji
+
+
+def base_bac_of(sub: int, dose: float, weight: float) -> float:
+    return (dose * SUBSTANCE_GRAMS[sub]) / (weight * 1000 * DISTRIBUTION_R) * 1000
+
+
+class BacState:
+    """Zdarzenia alkoholowe użytkownika posortowane wg chwili wyzerowania (expiry).
+       Dla aktywnych zdarzeń BAC = Σbase - rate * (k * now - Σt) / 3600, więc zapytanie
+       to bisect po expiry plus sumy sufiksowe – bez parsowania napisów."""
+
+    __slots__ = ("weight", "expiries", "entries", "_suffix", "_stale")
+
+    def __init__(self, weight: float):
+        self.weight = weight
+        self.expiries = []  # posortowane chwile wyzerowania (epoch)
+        self.entries = []  # (epoch, base_bac) w tej samej kolejności
+        self._suffix = [(0.0, 0.0)]  # sumy (base, epoch) od indeksu i do końca
+        self._stale = False
+
+    @classmethod
+    def from_user(cls, data: UserRecord, weight: float) -> "BacState":
+        state = cls(weight)
+        for sub, dose, epoch in data.events():
+            state.add(sub, dose, epoch)
+        return state
+
+    def add(self, sub: int, dose: float, epoch: float) -> None:
+        if sub == BLUNT_INDEX:
+            return
+        base_bac = base_bac_of(sub, dose, self.weight)
+        expiry = epoch + base_bac / ELIMINATION_RATE * 3600.0
+        idx = bisect.bisect_right(self.expiries, expiry)
+        self.expiries.insert(idx, expiry)
+        self.entries.insert(idx, (epoch, base_bac))
+        self._stale = True
+
+    def _rebuild_suffix(self) -> None:
+        suffix = [(0.0, 0.0)] * (len(self.entries) + 1)
+        base_sum = epoch_sum = 0.0
+        for i in range(len(self.entries) - 1, -1, -1):
+            epoch, base_bac = self.entries[i]
+            base_sum += base_bac
+            epoch_sum += epoch
+            suffix[i] = (base_sum, epoch_sum)
+        self._suffix = suffix
+        self._stale = False
+
+    def value(self, now: float) -> float:
+        first = bisect.bisect_right(self.expiries, now)
+        if first:
+            # Zdarzenia wyzerowane nie wrócą – czas płynie tylko do przodu
+            del self.expiries[:first]
+            del self.entries[:first]
+            self._stale = True
+        if not self.entries:
+            return 0.0
+        if self._stale:
+            self._rebuild_suffix()
+        base_sum, epoch_sum = self._suffix[0]
+        bac = base_sum - ELIMINATION_RATE * (len(self.entries) * now - epoch_sum) / 3600.0
+        return bac if bac > 0 else 0.0
+
+    def next_expiry(self) -> float:
+        return self.expiries[0] if self.expiries else None
+
+
+bac_states = {}  # (guild_id, user_id) -> BacState
+
+
+def get_bac_state(guild_id: str, user_id: str, data: UserRecord) -> BacState:
+    key = (guild_id, user_id)
+    weight = data.weight
+    state = bac_states.get(key)
+    if state is None or state.weight != weight:
+        state = bac_states[key] = BacState.from_user(data, weight)
+    return state
+
+
+@metrics.timed("bac_seconds", (("fn", "user_bac"),))
+def user_bac(guild_id, user_id, data: UserRecord, now: float = None) -> float:
+    """Aktualne promile użytkownika – odpowiednik compute_bac() korzystający z cache."""
+    if now is None:
+        now = time.time()
+    return get_bac_state(str(guild_id), str(user_id), data).value(now)
+
+
+def update_bac_state(record: dict) -> None:
+    """Utrzymuje cache BacState i kolumny gildii w zgodzie ze zmianą z apply_mutation()."""
+    key = (record["g"], record.get("u"))
+    columns = bac_columns.get(record["g"])
+    if record["op"] in ("clear", "setweight"):
+        bac_states.pop(key, None)
+        # Kolumny mogły już wyrzucić zdarzenia wyzerowane przy starej wadze – budujemy je od nowa z rekordów
+        bac_columns.pop(record["g"], None)
+    elif record["op"] == "consume":
+        epoch = parse_timestamp(record["ts"])
+        if epoch is None:
+            return
+        sub = SUBSTANCE_INDEX[record["typ"]]
+        if key in bac_states:
+            bac_states[key].add(sub, record["dose"], epoch)
+        if columns is not None:
+            columns.add_event(record["u"], sub, record["dose"], epoch, record.get("weight"))
+
+
+# ---------------------------------------------
+# WSADOWE LICZENIE PROMILI DLA CAŁEJ GILDII (NumPy)
+# ---------------------------------------------
+
+class GuildBacColumns:
+    """Kolumnowy widok zdarzeń alkoholowych gildii: równoległe tablice indeksu
+       użytkownika, epoki, dawki i gramów etanolu. evaluate() liczy promile
+       wszystkich użytkowników w jednym przebiegu (obcięcie do zera + suma per użytkownik)."""
+
+    def __init__(self):
+        self.user_ids = []
+        self.user_index = {}
+        self.weights = []
+        self._pending = ([], [], [], [])  # user_idx, epoch, dose, grams – jeszcze nie w tablicach
+        self._arrays = None
+
+    @classmethod
+    def from_users(cls, users: dict) -> "GuildBacColumns":
+        columns = cls()
+        for user_id, data in users.items():
+            columns._user(user_id, data.weight)
+            for sub, dose, epoch in data.events():
+                columns.add_event(user_id, sub, dose, epoch)
+        return columns
+
+    def _user(self, user_id: str, weight: float = None) -> int:
+        idx = self.user_index.get(user_id)
+        if idx is None:
+            idx = self.user_index[user_id] = len(self.user_ids)
+            self.user_ids.append(user_id)
+            self.weights.append(80.0 if weight is None else weight)
+        return idx
+
+    def add_event(self, user_id: str, sub: int, dose: float, epoch: float, weight: float = None) -> None:
+        if sub == BLUNT_INDEX:
+            return
+        idx = self._user(user_id, weight)
+        for column, value in zip(self._pending, (idx, epoch, dose, SUBSTANCE_GRAMS[sub])):
+            column.append(value)
+
+    def _materialize(self):
+        pending = self._pending
+        if self._arrays is None or pending[0]:
+            new = (np.array(pending[0], dtype=np.int64), np.array(pending[1], dtype=np.float64),
+                   np.array(pending[2], dtype=np.float64), np.array(pending[3], dtype=np.float64))
+            if self._arrays is None:
+                self._arrays = new
+            else:
+                self._arrays = tuple(np.concatenate((old, add)) for old, add in zip(self._arrays, new))
+            self._pending = ([], [], [], [])
+        return self._arrays
+
+    def evaluate(self, now: float) -> dict:
+        user_idx, epoch, dose, grams = self._materialize()
+        if not len(user_idx):
+            return {}
+        weights = np.asarray(self.weights, dtype=np.float64)
+        base_bac = dose * grams / (weights[user_idx] * 1000 * DISTRIBUTION_R) * 1000
+        current = base_bac - ELIMINATION_RATE * (now - epoch) / 3600.0
+        np.maximum(current, 0.0, out=current)
+        active = current > 0
+        if active.sum() * 2 < len(active):
+            # Wyzerowane zdarzenia już nie wrócą – wyrzucamy je z kolumn
+            self._arrays = tuple(column[active] for column in self._arrays)
+        totals = np.bincount(user_idx, weights=current, minlength=len(self.user_ids))
+        return {self.user_ids[i]: float(totals[i]) for i in np.flatnonzero(totals > 0)}
+
+
+bac_columns = {}  # guild_id -> GuildBacColumns
+
+
+# ---------------------------------------------
+# RANKING MIESIĘCZNY: posortowany ranking aktualizowany przy każdym spożyciu
+# ---------------------------------------------
+class BisectList:
+    """Minimalny zamiennik SortedList (add/remove/index/wycinki) na liście i bisect."""
+
+    def __init__(self, iterable=()):
+        self._items = sorted(iterable)
+
+    def add(self, item) -> None:
+        bisect.insort(self._items, item)
+
+    def index(self, item) -> int:
+        i = bisect.bisect_left(self._items, item)
+        if i == len(self._items) or self._items[i] != item:
+            raise ValueError(f"{item!r} nie ma na liście")
+        return i
+
+    def remove(self, item) -> None:
+        del self._items[self.index(item)]
+
+    def __getitem__(self, index):
+        return self._items[index]
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __iter__(self):
+        return iter(self._items)
+
+
+RankList = SortedList or BisectList
+
+
+class MonthlyRanking:
+    """Ranking gildii w jednym miesiącu w dwóch porządkach: "grams" (suma etanolu,
+       miesięczny leaderboard) i "count" (liczba spożyć, komenda -leaderboard).
+       Klucze (-wartość, user_id) dają kolejność malejącą i stabilną przy remisach.
+       Aktualizacja jednego użytkownika to O(log n), odczyt top k – O(k)."""
+
+    ORDERS = ("grams", "count")
+
+    def __init__(self, month: str):
+        self.month = month
+        self.keys = {}  # user_id -> (klucz grams, klucz count)
+        self.lists = {order: RankList() for order in self.ORDERS}
+
+    @classmethod
+    def from_users(cls, users: dict, month: str) -> "MonthlyRanking":
+        ranking = cls(month)
+        for user_id, data in users.items():
+            ranking.update(user_id, data)
+        return ranking
+
+    @classmethod
+    def from_counts(cls, counts: dict, month: str) -> "MonthlyRanking":
+        """Z kopii liczników {user_id: array} – bez dostępu do rekordów (wątek puli obliczeń)."""
+        ranking = cls(month)
+        for user_id, monthly in counts.items():
+            ranking._insert(user_id, monthly)
+        return ranking
+
+    def update(self, user_id: str, data: UserRecord = None) -> None:
+        old = self.keys.pop(user_id, None)
+        if old is not None:
+            for order, key in zip(self.ORDERS, old):
+                self.lists[order].remove(key)
+        self._insert(user_id, data.month_counts(self.month) if data is not None else None)
+
+    def _insert(self, user_id: str, monthly) -> None:
+        count = sum(monthly) if monthly is not None else 0
+        if count == 0:
+            return
+        grams = sum(c * g for c, g in zip(monthly, SUBSTANCE_GRAMS))
+        keys = self.keys[user_id] = ((-grams, user_id), (-count, user_id))
+        for order, key in zip(self.ORDERS, keys):
+            self.lists[order].add(key)
+
+    def page(self, order: str = "grams", offset: int = 0, limit: int = None) -> list:
+        """[(user_id, wartość)] od pozycji `offset` (0 = pierwsze miejsce)."""
+        end = None if limit is None else offset + limit
+        return [(user_id, -value) for value, user_id in self.lists[order][offset:end]]
+
+    def rank_of(self, user_id: str, order: str = "grams") -> int:
+        """Miejsce użytkownika (od 1) albo None, gdy nie ma go w rankingu."""
+        keys = self.keys.get(user_id)
+        if keys is None:
+            return None
+        return self.lists[order].index(keys[self.ORDERS.index(order)]) + 1
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+
+monthly_rankings = {}  # guild_id -> MonthlyRanking (bieżący miesiąc)
+
+
+def get_monthly_ranking(guild_id, users: dict, month: str = None) -> MonthlyRanking:
+    """Ranking bieżącego miesiąca; po zmianie miesiąca przebudowywany przy pierwszym odczycie."""
+    month = month or get_current_month()
+    gid = str(guild_id)
+    ranking = monthly_rankings.get(gid)
+    if ranking is None or ranking.month != month:
+        ranking = monthly_rankings[gid] = MonthlyRanking.from_users(users, month)
+    return ranking
+
+
+def update_monthly_ranking(gid: str, uid: str, data: UserRecord = None, month: str = None) -> None:
+    if data is None:
+        leaderboard_rows.forget(gid, uid)
+    ranking = monthly_rankings.get(gid)
+    if ranking is not None and (month is None or month == ranking.month):
+        ranking.update(uid, data)
+
+
+# ---------------------------------------------
+# LENIWE GILDIE: wczytanie i usunięcie z pamięci
+# ---------------------------------------------
+def on_guild_loaded(gid: str, guild: GuildRecord) -> None:
+    """Gildia wczytana z dysku: zdarzenia trafiają do kopca, stare miesiące są zwijane."""
+    expiry_scheduler.add_guild(gid, guild)
+    roll_up_guild(gid, guild, shift_month(get_current_month(), -(RETENTION_MONTHS - 1)))
+
+
+def on_guild_evicted(gid: str) -> None:
+    """Pamięć podręczna BAC trzyma referencje do rekordów – gildia musi z niej zniknąć."""
+    bac_columns.pop(gid, None)
+    monthly_rankings.pop(gid, None)
+    leaderboard_rows.forget(gid)
+    for key in [key for key in bac_states if key[0] == gid]:
+        del bac_states[key]
+
+
+def next_bac_change(guild_id, users: dict, now: float) -> float:
+    """Najwcześniejsza chwila, w której leaderboard promilowy może wyglądać inaczej:
+       zaokrąglona wartość (0.01‰) spada o krok, zdarzenie wygasa (zmienia się nachylenie)
+       albo dwóch sąsiadów w rankingu zamienia się miejscami. None – nic się nie zmieni."""
+    gid = str(guild_id)
+    lines = []  # (bac, spadek na sekundę)
+    earliest = math.inf
+    for user_id, data in users.items():
+        state = get_bac_state(gid, user_id, data)
+        bac = state.value(now)
+        if bac <= 0:
+            continue
+        slope = len(state.entries) * ELIMINATION_RATE / 3600.0
+        lines.append((bac, slope))
+        earliest = min(earliest, state.next_expiry(), display_change_at(bac, slope, now))
+    earliest = min(earliest, first_crossing(lines, now))
+    return None if earliest == math.inf else earliest
+
+
+def next_user_bac_change(guild_id, user_id, data: UserRecord, now: float) -> float:
+    """Najwcześniejsza chwila, w której wyświetlane promile użytkownika mogą się zmienić."""
+    state = get_bac_state(str(guild_id), str(user_id), data)
+    bac = state.value(now)
+    if bac <= 0:
+        return None
+    return min(state.next_expiry(), display_change_at(bac, len(state.entries) * ELIMINATION_RATE / 3600.0, now))
+
+
+def display_change_at(bac: float, slope: float, now: float) -> float:
+    """Wyświetlamy f"{bac:.2f}" – zmiana następuje przy przejściu przez k * 0.01 + 0.005."""
+    boundary = math.floor((bac - 0.005) / 0.01) * 0.01 + 0.005
+    if boundary < 0:
+        boundary = 0.0
+    return now + (bac - boundary) / slope
+
+
+def first_crossing(lines: list, now: float) -> float:
+    """Najwcześniejsza zamiana miejsc sąsiadów w rankingu; `lines` – [(bac, spadek na sekundę)]."""
+    earliest = math.inf
+    lines.sort(reverse=True)
+    for (bac_hi, slope_hi), (bac_lo, slope_lo) in zip(lines, lines[1:]):
+        if slope_hi > slope_lo:
+            earliest = min(earliest, now + (bac_hi - bac_lo) / (slope_hi - slope_lo))
+    return earliest
+
+
+@metrics.timed("bac_seconds", (("fn", "guild_bac_values"),))
+def guild_bac_values(guild_id, users: dict, now: float = None) -> dict:
+    """Promile wszystkich użytkowników gildii o jednej chwili `now` ({user_id: bac > 0})."""
+    if now is None:
+        now = time.time()
+    gid = str(guild_id)
+    if np is None:
+        values = {user_id: user_bac(gid, user_id, data, now) for user_id, data in users.items()}
+        return {user_id: bac for user_id, bac in values.items() if bac > 0}
+    columns = bac_columns.get(gid)
+    if columns is None:
+        columns = bac_columns[gid] = GuildBacColumns.from_users(users)
+    return columns.evaluate(now)
+
+
+# ---------------------------------------------
+# PULA OBLICZEŃ: rankingi dużych gildii liczone poza pętlą zdarzeń
+# ---------------------------------------------
+class ComputeTier:
+    """Gildie od `threshold` użytkowników liczone są w puli wątków na kopii danych
+       zrobionej w pętli zdarzeń (wątek nie dotyka żywych rekordów). Mniejsze – od
+       razu, z cache. Nowe zlecenie dla tego samego klucza (gildia, rodzaj) anuluje
+       poprzednie: jeśli czekało w kolejce, w ogóle się nie wykona, a wszyscy
+       oczekujący dostają wynik nowszego, liczonego na świeższych danych."""
+
+    def __init__(self, threshold: int = COMPUTE_OFFLOAD_USERS, workers: int = COMPUTE_WORKERS):
+        self.threshold = threshold
+        self.executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="compute")
+        self.pending = {}  # klucz -> future bieżącego obliczenia
+        self._replaced = weakref.WeakKeyDictionary()  # future anulowanego -> future nowszego
+        self.inline = 0
+        self.offloaded = 0
+        self.superseded = 0
+
+    def should_offload(self, size: int) -> bool:
+        if size < self.threshold:
+            self.inline += 1
+            return False
+        return True
+
+    async def submit(self, key, fn, *args):
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self.executor, fn, *args)
+        previous = self.pending.get(key)
+        self.pending[key] = future
+        if previous is not None and not previous.done():
+            self._replaced[previous] = future
+            previous.cancel()
+            self.superseded += 1
+        self.offloaded += 1
+        start = time.perf_counter()
+        try:
+            while True:
+                try:
+                    # shield – anulowanie jednego oczekującego nie przerywa obliczenia pozostałym
+                    return await asyncio.shield(future)
+                except asyncio.CancelledError:
+                    newer = self._replaced.get(future)
+                    if newer is None:
+                        raise
+                    future = newer
+        finally:
+            if self.pending.get(key) is future and future.done():
+                del self.pending[key]
+            metrics.observe("compute_seconds", time.perf_counter() - start, (("kind", key[1]),))
+
+    def stats(self) -> dict:
+        return {"inline": self.inline, "offloaded": self.offloaded, "superseded": self.superseded,
+                "pending": len(self.pending)}
+
+
+compute_tier = ComputeTier()
+
+
+def bac_snapshot(users: dict) -> list:
+    """Kopia zdarzeń użytkowników (tablice array kopiowane w C)."""
+    return [(user_id, data.weight, array("B", data.ev_sub), array("d", data.ev_dose), array("d", data.ev_time))
+            for user_id, data in users.items() if data.ev_time]
+
+
+def rank_bac_snapshot(snapshot: list, now: float) -> tuple:
+    """(ranking [(user_id, bac)] malejąco, chwila następnej zmiany albo None) z kopii
+       zdarzeń – te same wzory co BacState i next_bac_change(), bez cache."""
+    ranking = []
+    lines = []
+    earliest = math.inf
+    for user_id, weight, subs, doses, epochs in snapshot:
+        bac = 0.0
+        active = 0
+        for sub, dose, epoch in zip(subs, doses, epochs):
+            if sub == BLUNT_INDEX:
+                continue
+            base_bac = base_bac_of(sub, dose, weight)
+            expiry = epoch + base_bac / ELIMINATION_RATE * 3600.0
+            if expiry <= now:
+                continue
+            bac += base_bac - ELIMINATION_RATE * (now - epoch) / 3600.0
+            active += 1
+            earliest = min(earliest, expiry)
+        if bac <= 0:
+            continue
+        ranking.append((user_id, bac))
+        slope = active * ELIMINATION_RATE / 3600.0
+        lines.append((bac, slope))
+        earliest = min(earliest, display_change_at(bac, slope, now))
+    ranking.sort(key=lambda x: x[1], reverse=True)
+    earliest = min(earliest, first_crossing(lines, now))
+    return ranking, None if earliest == math.inf else earliest
+
+
+async def bac_ranking(guild: discord.Guild, now: float = None, with_next_change: bool = False) -> tuple:
+    """(ranking promili malejąco, chwila następnej zmiany – tylko z with_next_change)."""
+    if now is None:
+        now = time.time()
+    users = get_guild_users(guild)
+    gid = str(guild.id)
+    if compute_tier.should_offload(len(users)):
+        ranking, next_change = await compute_tier.submit((gid, "bac"), rank_bac_snapshot, bac_snapshot(users), now)
+        return ranking, next_change if with_next_change else None
+    ranking = sorted(guild_bac_values(gid, users, now).items(), key=lambda x: x[1], reverse=True)
+    return ranking, next_bac_change(gid, users, now) if with_next_change else None
+
+
+async def monthly_ranking(guild: discord.Guild, month: str = None) -> MonthlyRanking:
+    """Jak get_monthly_ranking(), ale pełna przebudowa dużej gildii idzie do puli obliczeń.
+       Gdy gildia zmieniła się w trakcie, wynik z puli jest odrzucany (przebudowa w miejscu)."""
+    month = month or get_current_month()
+    gid = str(guild.id)
+    users = get_guild_users(guild)
+    ranking = monthly_rankings.get(gid)
+    if (ranking is not None and ranking.month == month) or not compute_tier.should_offload(len(users)):
+        return get_monthly_ranking(gid, users, month)
+    version = guild_versions.get(gid, 0)
+    counts = {user_id: array("q", monthly) for user_id, data in users.items()
+              if (monthly := data.month_counts(month)) is not None}
+    built = await compute_tier.submit((gid, "monthly"), MonthlyRanking.from_counts, counts, month)
+    current = monthly_rankings.get(gid)
+    if guild_versions.get(gid, 0) == version and gid in guild_data.recent and (current is None or current.month != month):
+        monthly_rankings[gid] = built
+    return get_monthly_ranking(gid, get_guild_users(guild), month)
+
+
+# ---------------------------------------------
+# CACHE ODPOWIEDZI KOMEND TYLKO DO ODCZYTU
+# ---------------------------------------------
+class ResponseCache:
+    """Gotowe odpowiedzi per (gildia, komenda, argumenty). Wpis jest ważny, dopóki nie
+       zmieni się wersja gildii (każda mutacja przechodzi przez mark_dirty()) ani miesiąc.
+       Odpowiedzi z promilami wygasają dodatkowo w chwili, w której zaokrąglona wartość
+       albo kolejność mogłaby się zmienić – wyliczonej ze stałej eliminacji."""
+
+    def __init__(self, capacity: int = RESPONSE_CACHE_SIZE, max_age: float = RESPONSE_CACHE_MAX_AGE):
+        self.capacity = capacity
+        self.max_age = max_age
+        self.entries = OrderedDict()  # klucz -> (wersja, miesiąc, ważny do, odpowiedź)
+        self.hits = {}
+        self.misses = {}
+
+    @staticmethod
+    def token(guild_id) -> tuple:
+        """Stan gildii pobierany PRZED liczeniem odpowiedzi – zmiana w trakcie unieważni wpis."""
+        return guild_versions.get(str(guild_id), 0), get_current_month()
+
+    def get(self, key: tuple):
+        if self.capacity <= 0:
+            return None
+        command = key[1]
+        entry = self.entries.get(key)
+        if entry is not None:
+            version, month, expires, value = entry
+            if (version, month) == self.token(key[0]) and time.time() < expires:
+                self.entries.move_to_end(key)
+                self.hits[command] = self.hits.get(command, 0) + 1
+                return value
+            del self.entries[key]
+        self.misses[command] = self.misses.get(command, 0) + 1
+        return None
+
+    def put(self, key: tuple, token: tuple, value, expires: float = None) -> None:
+        if self.capacity <= 0:
+            return
+        deadline = time.time() + self.max_age
+        self.entries[key] = (*token, deadline if expires is None else min(expires, deadline), value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, guild_id) -> None:
+        """Zmiana poza mutacjami (np. nazwa członka) – wszystkie wpisy gildii."""
+        gid = str(guild_id)
+        for key in [key for key in self.entries if key[0] == gid]:
+            del self.entries[key]
+
+    def stats(self) -> dict:
+        hits = sum(self.hits.values())
+        lookups = hits + sum(self.misses.values())
+        return {"entries": len(self.entries), "hits": hits, "misses": lookups - hits,
+                "hit_rate": round(hits / lookups, 3) if lookups else 0.0}
+
+
+response_cache = ResponseCache()
+
+
 # ---------------------------------------------
 # BUDOWANIE CIĄGU STATUSU (do nicku)
 # ---------------------------------------------
@@ -255,11 +2532,9 @@ def compute_bac(data: dict, weight: float) -> float:
 # INICJALIZACJA WIADOMOŚCI STATUSOWEJ (HELPER)
 # ---------------------------------------------
 async def init_status_message_helper(guild: discord.Guild, channel: discord.TextChannel) -> None:
-    settings = get_guild_settings(guild)
     try:
         msg_id = await send_status_message(guild, channel)
-        settings["status_message_id"] = msg_id
-        save_data()
+        commit_settings(guild.id, status_message_id=msg_id)
         logging.info(f"Wiadomość statusowa wysłana na {guild.name}")
     except (discord.Forbidden, discord.HTTPException) as e:
         logging.error(f"Nie udało się zainicjować wiadomości statusowej na {guild.name}: {e}")
@@ -269,13 +2544,12 @@ async def init_status_message_helper(guild: discord.Guild, channel: discord.Text
 # INICJALIZACJA LEADERBOARDU MIESIĘCZNEGO (HELPER)
 # ---------------------------------------------
 async def init_leaderboard_helper(guild: discord.Guild, channel: discord.TextChannel) -> None:
-    settings = get_guild_settings(guild)
     try:
         embed = build_leaderboard_embed(guild)
+        await rest_budget.acquire("messages", channel.id)
         msg = await channel.send(embed=embed)
-        settings["live_leaderboard_message_id"] = msg.id
-        settings["live_leaderboard_channel_id"] = channel.id
-        save_data()
+        commit_settings(guild.id, live_leaderboard_message_id=msg.id, live_leaderboard_channel_id=channel.id)
+        leaderboard_refresher.remember(guild.id, "monthly", msg, embed)
         logging.info(f"Leaderboard miesięczny wysłany na {guild.name}")
     except (discord.Forbidden, discord.HTTPException) as e:
         logging.error(f"Nie udało się zainicjować leaderboardu na {guild.name}: {e}")
@@ -285,13 +2559,12 @@ async def init_leaderboard_helper(guild: discord.Guild, channel: discord.TextCha
 # INICJALIZACJA LEADERBOARDU PROMILOWEGO (HELPER)
 # ---------------------------------------------
 async def init_bac_leaderboard_helper(guild: discord.Guild, channel: discord.TextChannel) -> None:
-    settings = get_guild_settings(guild)
     try:
         embed = build_bac_leaderboard_embed(guild)
+        await rest_budget.acquire("messages", channel.id)
         msg = await channel.send(embed=embed)
-        settings["bac_leaderboard_message_id"] = msg.id
-        settings["bac_leaderboard_channel_id"] = channel.id
-        save_data()
+        commit_settings(guild.id, bac_leaderboard_message_id=msg.id, bac_leaderboard_channel_id=channel.id)
+        leaderboard_refresher.remember(guild.id, "bac", msg, embed)
         logging.info(f"Leaderboard promilowy wysłany na {guild.name}")
     except (discord.Forbidden, discord.HTTPException) as e:
         logging.error(f"Nie udało się zainicjować leaderboardu promilowego na {guild.name}: {e}")
@@ -300,7 +2573,10 @@ async def init_bac_leaderboard_helper(guild: discord.Guild, channel: discord.Tex
 # ---------------------------------------------
 # WYSYŁANIE WIADOMOŚCI STATUSOWEJ
 # ---------------------------------------------
-async def send_status_message(guild: discord.Guild, channel: discord.TextChannel) -> int:
+STATUS_REACTIONS = (*EMOJI_TO_TYPE, "❌")
+
+
+def build_status_text(guild: discord.Guild) -> str:
     status_text = "**Kliknij w reakcję, aby dodać spożycie**:\n"
     for typ, data in SUBSTANCES.items():
         line = f"{data['emoji']} — {typ.capitalize()} - ({data['duration_hours']}h, ~{data['ethanol_grams']:.1f}g etanolu)\n"
@@ -309,91 +2585,191 @@ async def send_status_message(guild: discord.Guild, channel: discord.TextChannel
             break
         status_text += line
     status_text += "❌ — Wyczyść status"
+    return status_text
+
+
+async def add_status_reactions(msg, channel: discord.TextChannel, present=frozenset()) -> int:
+    """Dodaje brakujące reakcje wiadomości statusowej; zwraca liczbę dodanych."""
+    added = 0
+    for emoji in STATUS_REACTIONS:
+        if emoji in present:
+            continue
+        await rest_budget.acquire("reactions", channel.id)
+        await msg.add_reaction(emoji)
+        added += 1
+    return added
+
+
+async def send_status_message(guild: discord.Guild, channel: discord.TextChannel) -> int:
+    status_text = build_status_text(guild)
     try:
+        await rest_budget.acquire("messages", channel.id)
         msg = await channel.send(status_text)
-        for emoji in EMOJI_TO_TYPE:
-            await msg.add_reaction(emoji)
-        await msg.add_reaction("❌")
+        await add_status_reactions(msg, channel)
         return msg.id
     except (discord.Forbidden, discord.HTTPException) as e:
         logging.error(f"Błąd podczas wysyłania wiadomości na {guild.name}: {e}")
     return 0
 
 
+# ---------------------------------------------
+# RENDEROWANIE LEADERBOARDÓW: limity Discorda, strony i pamięć wierszy
+# ---------------------------------------------
+EMBED_MAX_FIELDS = 25
+EMBED_MAX_CHARS = 6000
+EMBED_FOOTER_RESERVE = 120  # miejsce na stopkę ze stronicowaniem
+MESSAGE_MAX_CHARS = 2000
+
+
+def format_monthly_row(monthly, total_grams: float) -> str:
+    details = []
+    for sub, typ in enumerate(SUBSTANCE_KEYS):
+        count = monthly[sub]
+        if count == 0:
+            continue  # pomijamy puste pozycje
+        if sub == BLUNT_INDEX:
+            details.append(f"{TYPE_TO_EMOJI[typ]}{count}")
+        else:
+            grams = count * SUBSTANCE_GRAMS[sub]
+            details.append(f"{TYPE_TO_EMOJI[typ]}{count} ({grams:.1f}g)")
+    return f"{' '.join(details)}\nSuma etanolu: {total_grams:.1f}"
+
+
+class RowCache:
+    """Sformatowane wiersze miesięcznego leaderboardu, kluczowane licznikami
+       użytkownika – zmiana jednej osoby formatuje na nowo tylko jej wiersz."""
+
+    def __init__(self):
+        self.rows = {}  # guild_id -> {user_id: ((miesiąc, liczniki), tekst)}
+        self.hits = 0
+        self.misses = 0
+
+    def monthly_value(self, gid: str, uid: str, month: str, monthly, total_grams: float) -> str:
+        rows = self.rows.setdefault(gid, {})
+        key = (month, monthly.tobytes())
+        cached = rows.get(uid)
+        if cached is not None and cached[0] == key:
+            self.hits += 1
+            return cached[1]
+        self.misses += 1
+        text = format_monthly_row(monthly, total_grams)
+        rows[uid] = (key, text)
+        return text
+
+    def forget(self, gid: str, uid: str = None) -> None:
+        if uid is None:
+            self.rows.pop(gid, None)
+        elif gid in self.rows:
+            self.rows[gid].pop(uid, None)
+
+
+leaderboard_rows = RowCache()
+
+
+def page_bounds(total: int, page: int, per_page: int) -> tuple:
+    """(strona, liczba stron, offset) – strona przycięta do zakresu 1..liczba stron."""
+    pages = max(1, -(-total // per_page))
+    page = min(max(1, page), pages)
+    return page, pages, (page - 1) * per_page
+
+
+def add_ranked_fields(embed: discord.Embed, rows) -> int:
+    """Dodaje pola (nazwa, wartość) w granicach limitów embedu; zwraca liczbę dodanych."""
+    added = 0
+    for name, value in rows:
+        name, value = name[:256], value[:1024]
+        if added == EMBED_MAX_FIELDS or len(embed) + len(name) + len(value) > EMBED_MAX_CHARS - EMBED_FOOTER_RESERVE:
+            break
+        embed.add_field(name=name, value=value, inline=False)
+        added += 1
+    return added
+
+
+def set_page_footer(embed: discord.Embed, first: int, shown: int, total: int, page: int, command: str,
+                    page_rows: int) -> None:
+    """`page_rows` – rozmiar strony komendy `command` (może być inny niż embedu)."""
+    if total <= shown and page == 1:
+        return
+    footer = f"Miejsca {first}–{first + shown - 1} z {total}"
+    if first + shown - 1 < total:
+        # Strona komendy z pierwszym niepokazanym miejscem
+        footer += f" • więcej: {BOT_PREFIX}{command} {(first + shown - 1) // page_rows + 1}"
+    embed.set_footer(text=footer)
+
+
+def render_text_page(lines: list, page: int, pages: int) -> str:
+    """Łączy wiersze strony, nie przekraczając limitu długości wiadomości."""
+    footer = f"\nStrona {page}/{pages}" if pages > 1 else ""
+    text = ""
+    for line in lines:
+        if len(text) + len(line) + 1 + len(footer) > MESSAGE_MAX_CHARS:
+            break
+        text += line + "\n"
+    return text.rstrip("\n") + footer
+
+
+def display_name_of(guild: discord.Guild, user_id: str, data: UserRecord, names: dict = None) -> str:
+    # Używamy oryginalnego nicku, zapisanego w bazie, aby leaderboard był "czysty"
+    name = data.original_nick
+    if not name:
+        name = names.get(int(user_id)) if names is not None else member_directory.display_name(guild, user_id)
+    return (name or f"<@{user_id}>")[:64]
+
+
 # ---------------------------------------------
 # BUDOWANIE EMBEDU LEADERBOARDU MIESIĘCZNEGO
 # ---------------------------------------------
-def build_leaderboard_embed(guild: discord.Guild) -> discord.Embed:
+def build_leaderboard_embed(guild: discord.Guild, page: int = 1) -> discord.Embed:
+    """Strona rankingu wg gramatury; strona 1 to stały widok top N na żywo."""
     current_month = get_current_month()
     users = get_guild_users(guild)
-    usage_list = []
-    # Zbieramy dane użytkowników, którzy mają przynajmniej jedną używkę (czyli count > 0) w bieżącym miesiącu
-    for user_id, data in users.items():
-        monthly = data.get("monthly_usage", {}).get(current_month, {})
-        # Obliczamy łączną gramaturę etanolu – iterujemy po wszystkich używkach z SUBSTANCES
-        total_grams = sum(monthly.get(typ, 0) * SUBSTANCES[typ]["ethanol_grams"] for typ in SUBSTANCES)
-        if any(monthly.get(typ, 0) > 0 for typ in SUBSTANCES):
-            usage_list.append((user_id, data, monthly, total_grams))
-    # Sortujemy malejąco wg łącznej gramatury etanolu (użytkownicy z samymi bluntami będą mieli 0)
-    usage_list.sort(key=lambda x: x[3], reverse=True)
+    gid = str(guild.id)
+    # Ranking malejąco wg łącznej gramatury etanolu (użytkownicy z samymi bluntami mają 0)
+    ranking = get_monthly_ranking(guild.id, users, current_month)
+    page, pages, offset = page_bounds(len(ranking), page, LIVE_LEADERBOARD_ROWS)
 
     embed = discord.Embed(
         title=f"Tabela wyników (miesięczna) – {current_month}",
         color=discord.Color.green()
     )
-    if not usage_list:
+    if not len(ranking):
         embed.description = "Brak aktywności w tym miesiącu."
-    else:
-        for pos, (user_id, data, monthly, total_grams) in enumerate(usage_list, start=1):
-            # Używamy oryginalnego nicku, zapisanego w bazie, aby leaderboard był "czysty"
-            name = data.get("original_nick")
-            if not name:
-                member_obj = discord.utils.get(guild.members, id=int(user_id))
-                name = member_obj.display_name if member_obj else f"<@{user_id}>"
-            details = []
-            for typ in SUBSTANCES:
-                count = monthly.get(typ, 0)
-                if count == 0:
-                    continue  # pomijamy puste pozycje
-                if typ == "blunt":
-                    details.append(f"{TYPE_TO_EMOJI[typ]}{count}")
-                else:
-                    grams = count * SUBSTANCES[typ]["ethanol_grams"]
-                    details.append(f"{TYPE_TO_EMOJI[typ]}{count} ({grams:.1f}g)")
-            details_str = " ".join(details)
-            drink_count = monthly.get("drink", 0)
-            embed.add_field(
-                name=f"{pos}. {name}",
-                value=f"{details_str}\nSuma etanolu: {total_grams:.1f}",
-                inline=False
-            )
+        return embed
+    rows = (
+        (f"{pos}. {display_name_of(guild, user_id, users[user_id])}",
+         leaderboard_rows.monthly_value(gid, user_id, current_month, users[user_id].month_counts(current_month),
+                                        total_grams))
+        for pos, (user_id, total_grams) in enumerate(ranking.page("grams", offset, LIVE_LEADERBOARD_ROWS),
+                                                     start=offset + 1)
+    )
+    shown = add_ranked_fields(embed, rows)
+    set_page_footer(embed, offset + 1, shown, len(ranking), page, "ranking", LIVE_LEADERBOARD_ROWS)
     return embed
 
 
 # ---------------------------------------------
 # BUDOWANIE EMBEDU LEADERBOARDU PROMILOWEGO
 # ---------------------------------------------
-def build_bac_leaderboard_embed(guild: discord.Guild) -> discord.Embed:
+def build_bac_leaderboard_embed(guild: discord.Guild, page: int = 1, bac_list: list = None) -> discord.Embed:
+    """`bac_list` – gotowy ranking z bac_ranking(); bez niego liczony od razu."""
     users = get_guild_users(guild)
-    bac_list = []
-    for user_id, data in users.items():
-        bac = compute_bac(data, data.get("weight", 80.0))
-        if bac > 0:
-            bac_list.append((user_id, bac, data))
-    bac_list.sort(key=lambda x: x[1], reverse=True)
+    if bac_list is None:
+        bac_list = sorted(guild_bac_values(guild.id, users).items(), key=lambda x: x[1], reverse=True)
+    else:
+        # Ranking powstał przed await – użytkownik mógł w tym czasie zostać usunięty (-clear)
+        bac_list = [(user_id, bac) for user_id, bac in bac_list if user_id in users]
+    page, pages, offset = page_bounds(len(bac_list), page, LIVE_LEADERBOARD_ROWS)
     embed = discord.Embed(
         title="Leaderboard (promile) – aktualnie",
         color=discord.Color.blue()
     )
     if not bac_list:
         embed.description = "Brak aktywności."
-    else:
-        for pos, (user_id, bac, data) in enumerate(bac_list, start=1):
-            name = data.get("original_nick")
-            if not name:
-                member_obj = discord.utils.get(guild.members, id=int(user_id))
-                name = member_obj.display_name if member_obj else f"<@{user_id}>"
-            embed.add_field(name=f"{pos}. {name}", value=f"{bac:.2f}‰", inline=False)
+        return embed
+    rows = ((f"{pos}. {display_name_of(guild, user_id, users[user_id])}", f"{bac:.2f}‰")
+            for pos, (user_id, bac) in enumerate(bac_list[offset:offset + LIVE_LEADERBOARD_ROWS], start=offset + 1))
+    shown = add_ranked_fields(embed, rows)
+    set_page_footer(embed, offset + 1, shown, len(bac_list), page, "leaderboard_promile", TEXT_PAGE_ROWS)
     return embed
 
 
@@ -409,41 +2785,297 @@ async def init_bac_leaderboard(guild: discord.Guild, channel: discord.TextChanne
 
 
 # ---------------------------------------------
-# ZAPLANOWANE ZADANIE: AKTUALIZACJA LEADERBOARDÓW CO MINUTĘ
-# ---------------------------------------------
-@tasks.loop(minutes=1)
-async def update_tasks():
-    for guild in bot.guilds:
+# BUDŻET ZAPYTAŃ REST I RÓWNOLEGŁE PRZEBIEGI PO GILDIACH
+# ---------------------------------------------
+class TokenBucket:
+    """Kubełek tokenów: `capacity` zapytań na `period` sekund. Oczekujący są
+       obsługiwani w kolejności przybycia (FIFO na blokadzie)."""
+
+    __slots__ = ("capacity", "rate", "tokens", "updated", "_lock")
+
+    def __init__(self, capacity: float, period: float):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> float:
+        """Pobiera token, czekając w razie potrzeby; zwraca czas oczekiwania."""
+        waited = 0.0
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                delay = (1 - self.tokens) / self.rate
+                waited += delay
+                await asyncio.sleep(delay)
+
+
+# Limity tras Discorda (zapytania, okno w sekundach) kluczowane typem trasy i jej
+# głównym identyfikatorem (kanał lub gildia)
+ROUTE_LIMITS = {
+    "messages": (5, 5.0),   # wysyłanie/edycja/usuwanie wiadomości w kanale
+    "reactions": (1, 0.25),  # dodawanie/usuwanie reakcji w kanale
+    "guild": (5, 5.0),       # role, członkowie
+}
+
+
+class RestBudget:
+    """Budżet zapytań REST: kubełek na trasę (np. edycje w danym kanale) plus
+       jeden globalny. discord.py i tak obsługuje 429, ale przy wielu gildiach
+       naraz lepiej nie wpadać w limit niż ponawiać."""
+
+    def __init__(self, global_per_second: float = REST_GLOBAL_PER_SECOND):
+        self.global_bucket = TokenBucket(global_per_second, 1.0)
+        self.routes = {}  # (trasa, id) -> TokenBucket
+        self.calls = {}  # trasa -> liczba zapytań
+        self.waited = 0.0
+
+    async def acquire(self, route: str, major_id) -> None:
+        key = (route, major_id)
+        bucket = self.routes.get(key)
+        if bucket is None:
+            bucket = self.routes[key] = TokenBucket(*ROUTE_LIMITS[route])
+        self.waited += await bucket.acquire()
+        self.waited += await self.global_bucket.acquire()
+        self.calls[route] = self.calls.get(route, 0) + 1
+
+    def stats(self) -> dict:
+        return {"calls": dict(self.calls), "waited_seconds": round(self.waited, 3), "routes": len(self.routes)}
+
+
+rest_budget = RestBudget()
+
+
+class GuildFanout:
+    """Przebieg po gildiach z ograniczoną równoległością: `concurrency` robotników
+       pobiera gildie ze wspólnej kolejki, więc wolna gildia zajmuje jednego
+       robotnika, a nie cały przebieg. Przebieg, który jeszcze trwa, nie jest
+       uruchamiany ponownie."""
+
+    def __init__(self, name: str, concurrency: int = FANOUT_CONCURRENCY, timeout: float = GUILD_TASK_TIMEOUT):
+        self.name = name
+        self.concurrency = max(1, concurrency)
+        self.timeout = timeout
+        self.running = False
+        self.passes = 0
+        self.overlaps = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.last_pass = 0.0
+        self.max_pass = 0.0
+        self.slowest = None  # (czas, nazwa gildii) z ostatniego przebiegu
+
+    async def _guild(self, guild, job, timings: list) -> None:
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(job(guild), self.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            logging.warning(f"[{self.name}] Przekroczono limit czasu ({self.timeout:.0f}s) dla {guild.name}")
+        except Exception as e:
+            self.errors += 1
+            logging.error(f"[{self.name}] Błąd dla serwera {guild.name}: {e}")
+        timings.append((time.perf_counter() - started, guild.name))
+
+    async def run(self, guilds, job) -> bool:
+        """Wykonuje `job(guild)` dla każdej gildii; False, gdy poprzedni przebieg trwa."""
+        if self.running:
+            self.overlaps += 1
+            logging.warning(f"[{self.name}] Poprzedni przebieg wciąż trwa, pomijam")
+            return False
+        self.running = True
+        started = time.perf_counter()
+        queue = list(guilds)
+        queue.reverse()
+        timings = []
+
+        async def worker():
+            while queue:
+                await self._guild(queue.pop(), job, timings)
+
+        try:
+            await asyncio.gather(*(worker() for _ in range(min(self.concurrency, len(queue)))))
+        finally:
+            self.running = False
+            self.passes += 1
+            self.last_pass = time.perf_counter() - started
+            self.max_pass = max(self.max_pass, self.last_pass)
+            self.slowest = max(timings) if timings else None
+            metrics.observe("fanout_pass_seconds", self.last_pass, (("task", self.name),))
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "passes": self.passes,
+            "overlaps": self.overlaps,
+            "timeouts": self.timeouts,
+            "errors": self.errors,
+            "last_pass_ms": round(self.last_pass * 1000, 1),
+            "max_pass_ms": round(self.max_pass * 1000, 1),
+            "slowest_guild": self.slowest[1] if self.slowest else None,
+        }
+
+
+fanouts = {name: GuildFanout(name) for name in ("leaderboards", "bootstrap", "owner_status")}
+
+
+# ---------------------------------------------
+# ODŚWIEŻANIE LEADERBOARDÓW: edycja tylko przy zmianie treści
+# ---------------------------------------------
+class LeaderboardRefresher:
+    """Pamięta wiadomości leaderboardów (bez fetch_message) i odcisk ostatnio
+       wysłanego embedu. Miesięczny leaderboard jest przebudowywany tylko po zmianie
+       danych gildii lub miesiąca, promilowy także w chwili wyznaczonej przez next_bac_change().
+       Każdy leaderboard jest przebudowywany najwyżej raz na `min_interval` sekund – zmiany
+       z tego okna trafiają do najbliższej przebudowy po nim."""
+
+    def __init__(self, min_interval: float = LEADERBOARD_MIN_INTERVAL):
+        self.min_interval = min_interval
+        self.last_refresh = {}  # (guild_id, kind) -> chwila ostatniej przebudowy
+        self.messages = {}  # (guild_id, kind) -> discord.Message | discord.PartialMessage
+        self.fingerprints = {}  # (guild_id, kind) -> odcisk embedu
+        self.seen = {}  # (guild_id, kind) -> (wersja gildii, miesiąc) z ostatniego sprawdzenia
+        self.next_bac_refresh = {}  # guild_id -> epoka następnej możliwej zmiany
+        self.edits = 0
+        self.skipped = 0
+
+    @staticmethod
+    def fingerprint(embed: discord.Embed) -> str:
+        return hashlib.sha1(json.dumps(embed.to_dict(), sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+    def remember(self, guild_id, kind: str, message, embed: discord.Embed) -> None:
+        key = (str(guild_id), kind)
+        self.messages[key] = message
+        self.fingerprints[key] = self.fingerprint(embed)
+        self.seen[key] = (guild_versions.get(key[0], 0), get_current_month())
+        self.last_refresh[key] = time.time()
+        if kind == "bac":
+            self.next_bac_refresh[key[0]] = 0.0
+
+    def _message(self, key, channel, message_id: int):
+        msg = self.messages.get(key)
+        if msg is None or msg.id != message_id:
+            msg = self.messages[key] = channel.get_partial_message(message_id)
+            self.fingerprints.pop(key, None)
+        return msg
+
+    def _due(self, key, now: float) -> bool:
+        if now - self.last_refresh.get(key, -math.inf) < self.min_interval:
+            return False
+        state = (guild_versions.get(key[0], 0), get_current_month())
+        if self.seen.get(key) != state:
+            self.seen[key] = state
+            return True
+        if key[1] == "bac":
+            next_refresh = self.next_bac_refresh.get(key[0], 0.0)
+            return next_refresh is not None and now >= next_refresh
+        return False
+
+    async def refresh(self, guild: discord.Guild, kind: str, now: float) -> None:
         settings = get_guild_settings(guild)
-        lb_channel_id = settings.get("live_leaderboard_channel_id")
-        lb_message_id = settings.get("live_leaderboard_message_id")
-        if lb_channel_id is None or lb_message_id is None:
-            continue
-        channel = guild.get_channel(lb_channel_id)
-        if channel:
-            try:
-                msg = await channel.fetch_message(lb_message_id)
-                embed = build_leaderboard_embed(guild)
-                await msg.edit(embed=embed)
-            except discord.NotFound:
-                logging.warning(f"Miesięczny leaderboard nie znaleziono na {guild.name}, regeneruję...")
+        prefix = "live_leaderboard" if kind == "monthly" else "bac_leaderboard"
+        channel_id = settings.get(f"{prefix}_channel_id")
+        message_id = settings.get(f"{prefix}_message_id")
+        if not channel_id or not message_id:
+            return
+        channel = guild.get_channel(channel_id)
+        if not channel:
+            return
+        key = (str(guild.id), kind)
+        if not self._due(key, now):
+            self.skipped += 1
+            return
+        self.last_refresh[key] = now
+        if kind == "monthly":
+            await monthly_ranking(guild)
+            embed = build_leaderboard_embed(guild)
+        else:
+            bac_list, self.next_bac_refresh[key[0]] = await bac_ranking(guild, now, with_next_change=True)
+            embed = build_bac_leaderboard_embed(guild, bac_list=bac_list)
+        fingerprint = self.fingerprint(embed)
+        if self.fingerprints.get(key) == fingerprint:
+            self.skipped += 1
+            return
+        label = "Miesięczny" if kind == "monthly" else "Promilowy"
+        try:
+            await rest_budget.acquire("messages", channel.id)
+            await self._message(key, channel, message_id).edit(embed=embed)
+            self.fingerprints[key] = fingerprint
+            self.edits += 1
+        except discord.NotFound:
+            logging.warning(f"{label} leaderboard nie znaleziono na {guild.name}, regeneruję...")
+            self.messages.pop(key, None)
+            if kind == "monthly":
                 await init_leaderboard(guild, channel)
-            except (discord.Forbidden, discord.HTTPException) as e:
-                logging.error(f"Błąd przy aktualizacji miesięcznego leaderboardu: {e}")
-        bac_lb_channel_id = settings.get("bac_leaderboard_channel_id")
-        bac_lb_message_id = settings.get("bac_leaderboard_message_id")
-        if bac_lb_channel_id and bac_lb_message_id:
-            channel_bac = guild.get_channel(bac_lb_channel_id)
-            if channel_bac:
-                try:
-                    msg = await channel_bac.fetch_message(bac_lb_message_id)
-                    embed = build_bac_leaderboard_embed(guild)
-                    await msg.edit(embed=embed)
-                except discord.NotFound:
-                    logging.warning(f"Promilowy leaderboard nie znaleziono na {guild.name}, regeneruję...")
-                    await init_bac_leaderboard(guild, channel_bac)
-                except (discord.Forbidden, discord.HTTPException) as e:
-                    logging.error(f"Błąd przy aktualizacji promilowego leaderboardu: {e}")
+            else:
+                await init_bac_leaderboard(guild, channel)
+        except (discord.Forbidden, discord.HTTPException) as e:
+            self.seen.pop(key, None)  # ponowna próba przy następnym przebiegu
+            logging.error(f"Błąd przy aktualizacji leaderboardu ({label.lower()}): {e}")
+
+
+leaderboard_refresher = LeaderboardRefresher()
+
+
+# ---------------------------------------------
+# ZAPLANOWANE ZADANIE: AKTUALIZACJA LEADERBOARDÓW (co LEADERBOARD_TICK_SECONDS)
+# ---------------------------------------------
+@tasks.loop(seconds=LEADERBOARD_TICK_SECONDS)
+async def update_tasks():
+    now = time.time()
+
+    async def refresh_guild(guild):
+        await leaderboard_refresher.refresh(guild, "monthly", now)
+        await leaderboard_refresher.refresh(guild, "bac", now)
+
+    fanout = fanouts["leaderboards"]
+    if await fanout.run(owned_guilds(), refresh_guild) and fanout.last_pass > LEADERBOARD_TICK_SECONDS:
+        logging.warning(f"Przebieg leaderboardów trwał {fanout.last_pass:.1f}s (dłużej niż interwał): {fanout.stats()}")
+
+
+# ---------------------------------------------
+# ZAPLANOWANE ZADANIE: USUWANIE WYGASŁYCH ZDARZEŃ CO MINUTĘ
+# ---------------------------------------------
+@tasks.loop(minutes=1)
+async def prune_expired_task():
+    pruned = expiry_scheduler.prune()
+    if pruned:
+        lines = event_archive.take_pending()
+        try:
+            await asyncio.get_running_loop().run_in_executor(persister.executor, event_archive.write, lines)
+        except OSError as e:
+            logging.error(f"Błąd zapisu archiwum zdarzeń: {e}")
+        schedule_save(pruned * MUTATION_BYTES)
+        stats = expiry_scheduler.stats()
+        logging.info(f"Usunięto {pruned} wygasłych zdarzeń (kopiec: {stats['heap_size']}, "
+                     f"łącznie: {stats['pruned_total']})")
+    evicted = guild_data.evict_idle()
+    if evicted:
+        logging.info(f"Zwolniono z pamięci {evicted} bezczynnych gildii: {guild_data.stats()}")
+
+
+# ---------------------------------------------
+# ZAPLANOWANE ZADANIE: ZWIJANIE STAREJ HISTORII RAZ NA DOBĘ
+# ---------------------------------------------
+@tasks.loop(hours=24)
+async def roll_up_history_task():
+    # Rekordy są zmieniane w miejscu, więc bez puli wątków – za to z oddaniem pętli po każdej gildii
+    oldest_kept = shift_month(get_current_month(), -(RETENTION_MONTHS - 1))
+    changed = 0
+    for gid in list(dict.keys(guild_data)):
+        guild = dict.get(guild_data, gid)  # ponownie – gildia mogła zostać wyrzucona z pamięci w międzyczasie
+        if isinstance(guild, GuildRecord):
+            changed += roll_up_guild(gid, guild, oldest_kept)
+            await asyncio.sleep(0)
+    if changed:
+        schedule_save(changed * MUTATION_BYTES)
+        logging.info(f"Zwinięto historię {changed} użytkowników (retencja: {RETENTION_MONTHS} mies.)")
 
 
 # ---------------------------------------------
@@ -473,14 +3105,16 @@ async def helpme_cmd(ctx):
         f"{BOT_PREFIX}add <nick> <typ> <ilość> – Dodaje spożycie do cudzego statusu (Admin)\n"
         f"{BOT_PREFIX}status – Wyświetla Twój status wraz z aktualnymi promilami\n"
         f"{BOT_PREFIX}clear [<nick>] – Czyści status (Admin opcjonalnie)\n"
-        f"{BOT_PREFIX}leaderboard – Wyświetla tabelę wyników miesięcznych\n"
-        f"{BOT_PREFIX}leaderboard_promile – Wyświetla ranking aktualnych promili\n"
+        f"{BOT_PREFIX}leaderboard [strona] [hide] – Wyświetla tabelę wyników miesięcznych\n"
+        f"{BOT_PREFIX}ranking [strona] – Ranking miesięczny wg gramatury etanolu\n"
+        f"{BOT_PREFIX}leaderboard_promile [strona] – Wyświetla ranking aktualnych promili\n"
         f"{BOT_PREFIX}init_status_message – Tworzy wiadomość z reakcjami\n"
         f"{BOT_PREFIX}setchannel <kanał> – Ustawia kanał nasłuchu (Admin)\n"
         f"{BOT_PREFIX}live_leaderboard – Wysyła embed leaderboard miesięczny (Admin)\n"
         f"{BOT_PREFIX}setdedicatedchannel <kanał> – Ustawia dedykowany kanał (Admin)\n"
         f"{BOT_PREFIX}setweight <kg> – Zmienia Twoją wagę (domyślnie 80kg)\n"
         f"{BOT_PREFIX}setmode <promile|emoji> – Wybiera tryb wyświetlania w nicku\n"
+        f"{BOT_PREFIX}metrics – Czasy i liczniki wewnętrzne bota (Admin)\n"
         f"{BOT_PREFIX}shutdown – Bezpieczne wyłączenie bota (Admin)\n"
         f"{BOT_PREFIX}ping – Odpowiada 'Pong!'\n"
     )
@@ -495,8 +3129,7 @@ async def init_status_message(ctx):
     settings = get_guild_settings(ctx.guild)
     channel = ctx.guild.get_channel(settings.get("dedicated_channel_id")) or ctx.channel
     msg_id = await send_status_message(ctx.guild, channel)
-    settings["status_message_id"] = msg_id
-    save_data()
+    commit_settings(ctx.guild.id, status_message_id=msg_id)
     await ctx.send("Wiadomość z reakcjami została utworzona.")
 
 
@@ -505,9 +3138,7 @@ async def init_status_message(ctx):
 # ---------------------------------------------
 @bot.command()
 async def setdedicatedchannel(ctx, channel: discord.TextChannel):
-    settings = get_guild_settings(ctx.guild)
-    settings["dedicated_channel_id"] = channel.id
-    save_data()
+    commit_settings(ctx.guild.id, dedicated_channel_id=channel.id)
     await ctx.send(f"Dedykowany kanał ustawiony na {channel.mention}.")
 
 
@@ -516,9 +3147,7 @@ async def setdedicatedchannel(ctx, channel: discord.TextChannel):
 # ---------------------------------------------
 @bot.command()
 async def setchannel(ctx, channel: discord.TextChannel):
-    settings = get_guild_settings(ctx.guild)
-    settings["listening_channel_id"] = channel.id
-    save_data()
+    commit_settings(ctx.guild.id, listening_channel_id=channel.id)
     await ctx.send(f"Kanał nasłuchu ustawiony na {channel.mention}.")
 
 
@@ -538,12 +3167,11 @@ async def live_leaderboard_cmd(ctx):
 # ---------------------------------------------
 @bot.command()
 async def setweight(ctx, weight: float):
-    users = get_guild_users(ctx.guild)
-    user_id = str(ctx.author.id)
-    if user_id not in users:
-        users[user_id] = create_new_user(ctx.author.name)
-    users[user_id]["weight"] = weight
-    save_data()
+    if not valid_weight(weight):
+        await ctx.send(f"Waga musi być liczbą większą od {WEIGHT_LIMITS[0]:g} i mniejszą od {WEIGHT_LIMITS[1]:g} kg.")
+        return
+    commit_mutation({"op": "setweight", "g": str(ctx.guild.id), "u": str(ctx.author.id),
+                     "weight": weight, "nick": ctx.author.name})
     try:
         await ctx.message.delete()
     except Exception as e:
@@ -560,15 +3188,11 @@ async def setweight(ctx, weight: float):
 @bot.command()
 async def setmode(ctx, mode: str):
     mode = mode.lower()
-    if mode not in ("promile", "emoji"):
+    if mode not in DISPLAY_MODES:
         await ctx.send("Tryb musi być 'promile' lub 'emoji'.")
         return
-    users = get_guild_users(ctx.guild)
-    user_id = str(ctx.author.id)
-    if user_id not in users:
-        users[user_id] = create_new_user(ctx.author.name)
-    users[user_id]["display_mode"] = mode
-    save_data()
+    commit_mutation({"op": "setmode", "g": str(ctx.guild.id), "u": str(ctx.author.id),
+                     "mode": mode, "nick": ctx.author.name})
     try:
         await ctx.author.send(f"Tryb wyświetlania został ustawiony na {mode}.")
     except Exception:
@@ -580,17 +3204,28 @@ async def setmode(ctx, mode: str):
 # ---------------------------------------------
 @bot.command()
 async def status(ctx):
-    users = get_guild_users(ctx.guild)
-    data = users.get(str(ctx.author.id))
-    if not data:
-        await ctx.send("Nie masz żadnego statusu.")
-        return
-    month = get_current_month()
-    monthly = data.get("monthly_usage", {}).get(month, {})
-    lines = [f"• {typ.capitalize()}: {monthly.get(typ, 0)}" for typ in VALID_TYPES if monthly.get(typ, 0) > 0]
-    current_bac = compute_bac(data, data.get("weight", 80.0))
-    lines.append(f"• Aktualne promile: {current_bac:.2f}‰")
-    await ctx.send("**Twój status**:\n" + "\n".join(lines))
+    key = (str(ctx.guild.id), "status", str(ctx.author.id))
+    text = response_cache.get(key)
+    if text is None:
+        token = response_cache.token(ctx.guild.id)
+        users = get_guild_users(ctx.guild)
+        data = users.get(str(ctx.author.id))
+        if not data:
+            await ctx.send("Nie masz żadnego statusu.")
+            return
+        now = time.time()
+        month = token[1]
+        monthly = data.month_counts(month) or ()
+        lines = [f"• {SUBSTANCE_KEYS[sub].capitalize()}: {count}" for sub, count in enumerate(monthly) if count > 0]
+        current_bac = user_bac(ctx.guild.id, ctx.author.id, data, now)
+        lines.append(f"• Aktualne promile: {current_bac:.2f}‰")
+        ranking = get_monthly_ranking(ctx.guild.id, users, month)
+        rank = ranking.rank_of(str(ctx.author.id))
+        if rank is not None:
+            lines.append(f"• Miejsce w rankingu miesiąca: {rank}/{len(ranking)}")
+        text = "**Twój status**:\n" + "\n".join(lines)
+        response_cache.put(key, token, text, next_user_bac_change(ctx.guild.id, ctx.author.id, data, now))
+    await ctx.send(text)
 
 
 # ---------------------------------------------
@@ -604,7 +3239,7 @@ async def clear(ctx, user_arg: str = None):
         if user_id not in users:
             await ctx.send("Nie masz statusu do wyczyszczenia.")
             return
-        del users[user_id]
+        commit_mutation({"op": "clear", "g": str(ctx.guild.id), "u": user_id})
         # try:
         #     member = ctx.author
         #     original = remove_bot_suffix(member.nick) if member.nick else member.name
@@ -612,54 +3247,56 @@ async def clear(ctx, user_arg: str = None):
         # except Exception as e:
         #     logging.warning(f"Nie udało się przywrócić nicku: {e}")
         await ctx.send("Twój status został wyczyszczony.")
-        save_data()
     else:
         if not ctx.author.guild_permissions.manage_nicknames:
             return
-        member = discord.utils.find(lambda m: m.name == user_arg or (m.nick and m.nick == user_arg), ctx.guild.members)
-        if not member:
+        member_id = member_directory.find(ctx.guild, user_arg)
+        if member_id is None:
             await ctx.send(f"Nie znaleziono użytkownika: {user_arg}")
             return
-        user_id = str(member.id)
+        user_id = str(member_id)
+        mention = f"<@{member_id}>"
         if user_id not in users:
-            await ctx.send(f"Użytkownik {member.mention} nie ma statusu.")
+            await ctx.send(f"Użytkownik {mention} nie ma statusu.")
             return
-        del users[user_id]
+        commit_mutation({"op": "clear", "g": str(ctx.guild.id), "u": user_id})
         # try:
         #     original = remove_bot_suffix(member.nick) if member.nick else member.name
         #     await member.edit(nick=original)
         # except Exception as e:
         #     logging.warning(f"Nie udało się przywrócić nicku dla {member.name}: {e}")
-        await ctx.send(f"Status użytkownika {member.mention} wyczyszczony.")
-        save_data()
+        await ctx.send(f"Status użytkownika {mention} wyczyszczony.")
 
 
 # ---------------------------------------------
 # KOMENDA: LEADERBOARD (miesięczny)
 # ---------------------------------------------
 @bot.command(name="leaderboard")
-async def leaderboard_cmd(ctx, hide_arg: str = None):
-    users = get_guild_users(ctx.guild)
-    current_month = get_current_month()
-    usage_list = []
-    for user_id, data in users.items():
-        monthly = data.get("monthly_usage", {}).get(current_month, {})
-        total = sum(monthly.get(typ, 0) for typ in VALID_TYPES)
-        if total > 0:
-            usage_list.append((user_id, data, total))
-    usage_list.sort(key=lambda x: x[2], reverse=True)
-    if not usage_list:
-        text = f"Nikt nie ma punktów w miesiącu {current_month}."
-    else:
-        lines = []
-        for pos, (user_id, data, total) in enumerate(usage_list, start=1):
-            name = data.get("original_nick")
-            if not name:
-                member_obj = await get_member(ctx.guild, int(user_id))
-                name = member_obj.display_name if member_obj else f"<@{user_id}>"
-            lines.append(f"**{pos}. {name}** – Suma: {total}")
-        text = "\n".join(lines)
-    if hide_arg == "hide":
+async def leaderboard_cmd(ctx, *args):
+    # -leaderboard [strona] [hide]
+    hide = "hide" in args
+    page = next((int(arg) for arg in args if arg.isdigit()), 1)
+    key = (str(ctx.guild.id), "leaderboard", page)
+    text = response_cache.get(key)
+    if text is None:
+        token = response_cache.token(ctx.guild.id)
+        current_month = token[1]
+        ranking = await monthly_ranking(ctx.guild, current_month)
+        users = get_guild_users(ctx.guild)
+        if not len(ranking):
+            text = f"Nikt nie ma punktów w miesiącu {current_month}."
+        else:
+            page, pages, offset = page_bounds(len(ranking), page, TEXT_PAGE_ROWS)
+            usage_list = ranking.page("count", offset, TEXT_PAGE_ROWS)
+            # Rekordy strony pobrane przed await – równoległy -clear nie usunie ich spod nas
+            records = {user_id: users[user_id] for user_id, _ in usage_list}
+            names = await member_directory.resolve(ctx.guild, [user_id for user_id, data in records.items()
+                                                               if not data.original_nick])
+            lines = [f"**{pos}. {display_name_of(ctx.guild, user_id, records[user_id], names)}** – Suma: {total}"
+                     for pos, (user_id, total) in enumerate(usage_list, start=offset + 1)]
+            text = render_text_page(lines, page, pages)
+        response_cache.put(key, token, text)
+    if hide:
         try:
             await ctx.author.send(text)
             await ctx.send("Sprawdź DM.")
@@ -669,32 +3306,74 @@ async def leaderboard_cmd(ctx, hide_arg: str = None):
         await ctx.send(text)
 
 
+# ---------------------------------------------
+# KOMENDA: RANKING (miesięczny wg gramatury, strony embedu)
+# ---------------------------------------------
+@bot.command(name="ranking")
+async def ranking_cmd(ctx, page: int = 1):
+    await ctx.send(embed=build_leaderboard_embed(ctx.guild, page))
+
+
 # ---------------------------------------------
 # KOMENDA: LEADERBOARD_PROMILE
 # ---------------------------------------------
 @bot.command(name="leaderboard_promile")
-async def leaderboard_promile_cmd(ctx):
-    users = get_guild_users(ctx.guild)
-    bac_list = []
-    for user_id, data in users.items():
-        bac = compute_bac(data, data.get("weight", 80.0))
-        if bac > 0:
-            bac_list.append((user_id, bac, data))
-    bac_list.sort(key=lambda x: x[1], reverse=True)
-    if not bac_list:
-        text = "Nikt nie ma aktualnie promili."
-    else:
-        lines = []
-        for pos, (user_id, bac, data) in enumerate(bac_list, start=1):
-            name = data.get("original_nick")
-            if not name:
-                member_obj = await get_member(ctx.guild, int(user_id))
-                name = member_obj.display_name if member_obj else f"<@{user_id}>"
-            lines.append(f"**{pos}. {name}** – {bac:.2f}‰")
-        text = "\n".join(lines)
+async def leaderboard_promile_cmd(ctx, page: int = 1):
+    key = (str(ctx.guild.id), "leaderboard_promile", page)
+    text = response_cache.get(key)
+    if text is None:
+        token = response_cache.token(ctx.guild.id)
+        bac_list, next_change = await bac_ranking(ctx.guild, with_next_change=True)
+        users = get_guild_users(ctx.guild)
+        bac_list = [(user_id, bac) for user_id, bac in bac_list if user_id in users]
+        if not bac_list:
+            text = "Nikt nie ma aktualnie promili."
+        else:
+            page, pages, offset = page_bounds(len(bac_list), page, TEXT_PAGE_ROWS)
+            page_rows = bac_list[offset:offset + TEXT_PAGE_ROWS]
+            # Rekordy strony pobrane przed await – równoległy -clear nie usunie ich spod nas
+            records = {user_id: users[user_id] for user_id, _ in page_rows}
+            names = await member_directory.resolve(ctx.guild, [user_id for user_id, data in records.items()
+                                                               if not data.original_nick])
+            lines = [f"**{pos}. {display_name_of(ctx.guild, user_id, records[user_id], names)}** – {bac:.2f}‰"
+                     for pos, (user_id, bac) in enumerate(page_rows, start=offset + 1)]
+            text = render_text_page(lines, page, pages)
+        response_cache.put(key, token, text, next_change)
     await ctx.send(text)
 
 
+# ---------------------------------------------
+# KOMENDA: SHUTDOWN (bezpieczne wyłączenie)
+# ---------------------------------------------
+@bot.command(name="shutdown")
+async def shutdown_cmd(ctx):
+    if not ctx.author.guild_permissions.administrator:
+        return
+    await ctx.send("Zapisuję dane i wyłączam bota...")
+    await reaction_ingest.drain()
+    await persister.stop()
+    stats = persister.stats()
+    logging.info(f"Zapis końcowy wykonany; flushy: {stats['flush_count']}, średnio {stats['avg_flush_ms']:.1f} ms")
+    await bot.close()
+
+
+# ---------------------------------------------
+# KOMENDA: METRICS (podgląd metryk)
+# ---------------------------------------------
+@bot.command(name="metrics")
+async def metrics_cmd(ctx):
+    if not ctx.author.guild_permissions.administrator:
+        return
+    if not metrics.enabled:
+        await ctx.send("Metryki są wyłączone (METRICS_ENABLED=0).")
+        return
+    text = "\n".join(metrics.summary())
+    limit = MESSAGE_MAX_CHARS - 8  # miejsce na znaczniki bloku kodu
+    if len(text) > limit:
+        text = text[:text.rfind("\n", 0, limit - 2)] + "\n…"
+    await ctx.send(f"```\n{text}\n```")
+
+
 # ---------------------------------------------
 # KOMENDA: PING
 # ---------------------------------------------
@@ -704,62 +3383,205 @@ async def ping_cmd(ctx):
 
 
 # ---------------------------------------------
-# EVENT: on_reaction_add – OBSŁUGA REAKCJI W WIADOMOŚCI STATUSOWEJ
+# INDEKS WIADOMOŚCI STATUSOWYCH: message_id -> (guild_id, akcja)
+# ---------------------------------------------
+class StatusMessageIndex:
+    """Pozwala obsłużyć surowe zdarzenie reakcji jednym lookupem po message_id,
+       bez przeglądania ustawień gildii i bez pobierania wiadomości."""
+
+    def __init__(self):
+        self.by_message = {}  # message_id -> (guild_id, akcja)
+        self.by_guild = {}  # guild_id (str) -> message_id
+
+    def update(self, gid: str, settings: dict) -> None:
+        old = self.by_guild.pop(gid, None)
+        if old is not None:
+            self.by_message.pop(old, None)
+        message_id = settings.get("status_message_id")
+        if message_id:
+            self.by_message[message_id] = (int(gid), "status")
+            self.by_guild[gid] = message_id
+
+    def rebuild(self, settings_by_guild: dict) -> None:
+        self.by_message.clear()
+        self.by_guild.clear()
+        for gid, settings in settings_by_guild.items():
+            self.update(gid, settings)
+
+    def get(self, message_id: int):
+        return self.by_message.get(message_id)
+
+
+status_messages = StatusMessageIndex()
+
+
+# ---------------------------------------------
+# KOLEJKA REAKCJI: szybkie przyjęcie, zmiany stanu i usuwanie reakcji partiami
+# ---------------------------------------------
+class ReactionIngest:
+    """Przyjmuje kliknięcia w wiadomości statusowej bez czekania na REST.
+       Co `batch_window` sekund stosuje zebrane zmiany stanu, a reakcje usuwa
+       zbiorczo: przy wielu kliknięciach tej samej emotki jednym clear_reaction
+       (i ponownym dodaniem reakcji bota) zamiast osobnego remove_reaction na osobę.
+       Ponowne kliknięcie tej samej emotki w ciągu `debounce` sekund nie jest liczone."""
+
+    def __init__(self, batch_window: float = REACTION_BATCH_SECONDS, debounce: float = REACTION_DEBOUNCE_SECONDS,
+                 clear_threshold: int = REACTION_CLEAR_THRESHOLD):
+        self.batch_window = batch_window
+        self.debounce = debounce
+        self.clear_threshold = clear_threshold
+        self.queue = deque()
+        self.last_tap = {}  # (guild_id, user_id, emoji) -> chwila ostatniego zaliczonego kliknięcia
+        self.max_depth = 0
+        self.batches = 0
+        self.committed = 0
+        self.debounced = 0
+        self.failed = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self.rest_calls = 0
+        self.rest_saved = 0
+        self._wakeup = None
+        self._task = None
+        self._removals = set()  # trwające zadania usuwania reakcji
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def submit(self, guild: discord.Guild, message, emoji: str, user_id: int, user_name: str) -> None:
+        now = time.monotonic()
+        key = (guild.id, user_id, emoji)
+        last = self.last_tap.get(key)
+        counted = last is None or now - last >= self.debounce
+        if counted:
+            self.last_tap[key] = now
+        else:
+            self.debounced += 1
+        self.queue.append((now, time.time(), guild, message, emoji, user_id, user_name, counted))
+        self.max_depth = max(self.max_depth, len(self.queue))
+        self.start()
+        self._wakeup.set()
+
+    async def _run(self) -> None:
+        while True:
+            await self._wakeup.wait()
+            await asyncio.sleep(self.batch_window)
+            self._wakeup.clear()
+            self._process()
+
+    def _process(self) -> None:
+        batch, self.queue = self.queue, deque()
+        if not batch:
+            return
+        removals = {}  # message.id -> (message, {emoji: [user_id]})
+        for queued_at, tapped_at, guild, message, emoji, user_id, user_name, counted in batch:
+            # Reakcja jest zdejmowana także po błędzie – jedno kliknięcie nie blokuje reszty partii
+            removals.setdefault(message.id, (message, {}))[1].setdefault(emoji, []).append(user_id)
+            if not counted:
+                continue
+            try:
+                self._apply(guild, emoji, user_id, user_name, tapped_at)
+            except Exception as e:
+                self.failed += 1
+                logging.error(f"Błąd przy obsłudze reakcji {emoji} użytkownika {user_id} na {guild.id}: {e}")
+                continue
+            latency = time.monotonic() - queued_at
+            metrics.observe("reaction_latency_seconds", latency)
+            self.committed += 1
+            self.latency_total += latency
+            self.latency_max = max(self.latency_max, latency)
+        self.batches += 1
+        horizon = time.monotonic() - self.debounce
+        for key in [key for key, tapped in self.last_tap.items() if tapped < horizon]:
+            del self.last_tap[key]
+        task = asyncio.get_running_loop().create_task(self._remove(removals))
+        self._removals.add(task)
+        task.add_done_callback(self._removals.discard)
+        logging.debug(f"Partia reakcji: {len(batch)} ({self.stats()})")
+
+    @staticmethod
+    def _apply(guild: discord.Guild, emoji: str, user_id: int, user_name: str, tapped_at: float) -> None:
+        gid, uid = str(guild.id), str(user_id)
+        if emoji == "❌":
+            if uid in get_guild_users(guild):
+                commit_mutation({"op": "clear", "g": gid, "u": uid})
+            return
+        month = datetime.datetime.fromtimestamp(tapped_at, timezone.utc).strftime("%Y-%m")
+        commit_mutation({"op": "consume", "g": gid, "u": uid, "typ": EMOJI_TO_TYPE[emoji], "dose": 1,
+                         "ts": tapped_at, "month": month, "nick": user_name})
+
+    async def _remove(self, removals: dict) -> None:
+        for message, by_emoji in removals.values():
+            channel_id = message.channel.id
+            for emoji, user_ids in by_emoji.items():
+                try:
+                    if len(user_ids) >= self.clear_threshold:
+                        # clear_reaction zdejmuje też reakcję bota, więc dodajemy ją z powrotem
+                        await rest_budget.acquire("reactions", channel_id)
+                        await message.clear_reaction(emoji)
+                        await rest_budget.acquire("reactions", channel_id)
+                        await message.add_reaction(emoji)
+                        self.rest_calls += 2
+                        self.rest_saved += len(user_ids) - 2
+                        continue
+                    for user_id in user_ids:
+                        await rest_budget.acquire("reactions", channel_id)
+                        await message.remove_reaction(emoji, discord.Object(id=user_id))
+                        self.rest_calls += 1
+                except Exception as e:
+                    logging.warning(f"Nie udało się usunąć reakcji: {e}")
+
+    async def drain(self) -> None:
+        """Stosuje oczekujące kliknięcia od razu (przed zapisem końcowym)."""
+        self._process()
+        if self._removals:
+            await asyncio.gather(*self._removals, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": len(self.queue),
+            "max_depth": self.max_depth,
+            "batches": self.batches,
+            "committed": self.committed,
+            "debounced": self.debounced,
+            "failed": self.failed,
+            "avg_latency_ms": round(self.latency_total / self.committed * 1000, 1) if self.committed else 0.0,
+            "max_latency_ms": round(self.latency_max * 1000, 1),
+            "rest_calls": self.rest_calls,
+            "rest_saved": self.rest_saved,
+        }
+
+
+reaction_ingest = ReactionIngest()
+
+
+# ---------------------------------------------
+# EVENT: on_raw_reaction_add – OBSŁUGA REAKCJI W WIADOMOŚCI STATUSOWEJ
 # ---------------------------------------------
 @bot.event
-async def on_reaction_add(reaction, user):
-    if user.bot:
+async def on_raw_reaction_add(payload: discord.RawReactionActionEvent):
+    # Zdarzenie raw przychodzi niezależnie od cache wiadomości – wystarczy sam payload
+    target = status_messages.get(payload.message_id)
+    if target is None or payload.user_id == bot.user.id:
         return
-    message = reaction.message
-    if not message.guild:
+    if payload.member is not None and payload.member.bot:
         return
-    settings = get_guild_settings(message.guild)
-    if message.id != settings.get("status_message_id"):
+    emoji = str(payload.emoji)
+    if emoji not in EMOJI_TO_TYPE and emoji != "❌":
         return
-    emoji = str(reaction.emoji)
-    if emoji in EMOJI_TO_TYPE:
-        typ = EMOJI_TO_TYPE[emoji]
-        users = get_guild_users(message.guild)
-        user_id = str(user.id)
-        if user_id not in users:
-            users[user_id] = create_new_user(user.name)
-        data = users[user_id]
-        now = datetime.datetime.now(timezone.utc)
-        event = {"dose": 1, "timestamp": now.isoformat()}
-        data.setdefault("consumptions", {}).setdefault(typ, []).append(event)
-        month = get_current_month()
-        if month not in data.get("monthly_usage", {}):
-            data["monthly_usage"][month] = {t: 0 for t in VALID_TYPES}
-        data["monthly_usage"][month][typ] += 1
-        member_obj = await get_member(message.guild, user.id)
-        # if member_obj:
-        #     await update_nickname(member_obj)
-        #     if member_obj.guild_permissions.manage_nicknames:
-        #         try:
-        #             await member_obj.send(f"Twój nowy nick to: {member_obj.nick}")
-        #         except discord.Forbidden:
-        #             logging.warning(f"Nie udało się wysłać wiadomości do admina {member_obj.name}")
-        # save_data()
-        try:
-            await message.remove_reaction(emoji, user)
-        except Exception as e:
-            logging.warning(f"Nie udało się usunąć reakcji: {e}")
-    elif emoji == "❌":
-        users = get_guild_users(message.guild)
-        user_id = str(user.id)
-        if user_id in users:
-            del users[user_id]
-        member_obj = await get_member(message.guild, user.id)
-        # if member_obj:
-        #     try:
-        #         await member_obj.edit(nick=remove_bot_suffix(member_obj.nick) if member_obj.nick else member_obj.name)
-        #     except Exception as e:
-        #         logging.warning(f"Nie udało się przywrócić nicku: {e}")
-        save_data()
-        try:
-            await message.remove_reaction(emoji, user)
-        except Exception as e:
-            logging.warning(f"Nie udało się usunąć reakcji: {e}")
+    guild = bot.get_guild(target[0])
+    channel = guild.get_channel(payload.channel_id) if guild else None
+    if channel is None:
+        return
+    user_name = payload.member.name if payload.member is not None else None
+    reaction_ingest.submit(guild, channel.get_partial_message(payload.message_id), emoji, payload.user_id, user_name)
 
 
 # ---------------------------------------------
@@ -772,6 +3594,110 @@ async def on_message(message):
     await bot.process_commands(message)
 
 
+# ---------------------------------------------
+# BOOTSTRAP: uzgadnianie istniejących wiadomości zamiast usuwania i wysyłania od nowa
+# ---------------------------------------------
+class Bootstrap:
+    """Jednorazowa (na proces) inicjalizacja serwerów. Istniejące wiadomości są
+       edytowane, brakujące wysyłane, a reakcje dodawane tylko te, których brak.
+       Ponowne on_ready po wznowieniu połączenia niczego nie powtarza."""
+
+    def __init__(self):
+        self.process_started = time.monotonic()
+        self.done = False
+        self.ready_seconds = None  # od startu procesu do końca bootstrapu
+        self.reused = 0
+        self.created = 0
+        self.reactions_added = 0
+        self.reactions_skipped = 0
+
+    async def reconcile_status(self, guild: discord.Guild, channel: discord.TextChannel) -> None:
+        message_id = get_guild_settings(guild).get("status_message_id")
+        if message_id:
+            try:
+                await rest_budget.acquire("messages", channel.id)
+                msg = await channel.fetch_message(message_id)
+                text = build_status_text(guild)
+                if msg.content != text:
+                    await rest_budget.acquire("messages", channel.id)
+                    await msg.edit(content=text)
+                present = {str(reaction.emoji) for reaction in msg.reactions if reaction.me}
+                added = await add_status_reactions(msg, channel, present)
+                self.reactions_added += added
+                self.reactions_skipped += len(STATUS_REACTIONS) - added
+                self.reused += 1
+                return
+            except discord.NotFound:
+                pass
+            except (discord.Forbidden, discord.HTTPException) as e:
+                logging.error(f"Nie udało się uzgodnić wiadomości statusowej na {guild.name}: {e}")
+                return
+        await init_status_message_helper(guild, channel)
+        self.created += 1
+
+    async def reconcile_leaderboard(self, guild: discord.Guild, channel: discord.TextChannel, kind: str) -> None:
+        settings = get_guild_settings(guild)
+        prefix = "live_leaderboard" if kind == "monthly" else "bac_leaderboard"
+        message_id = settings.get(f"{prefix}_message_id")
+        if message_id and settings.get(f"{prefix}_channel_id") in (None, channel.id):
+            embed = build_leaderboard_embed(guild) if kind == "monthly" else build_bac_leaderboard_embed(guild)
+            msg = channel.get_partial_message(message_id)
+            try:
+                await rest_budget.acquire("messages", channel.id)
+                await msg.edit(embed=embed)
+                leaderboard_refresher.remember(guild.id, kind, msg, embed)
+                self.reused += 1
+                return
+            except discord.NotFound:
+                pass
+            except (discord.Forbidden, discord.HTTPException) as e:
+                logging.error(f"Nie udało się uzgodnić leaderboardu na {guild.name}: {e}")
+                return
+        if kind == "monthly":
+            await init_leaderboard_helper(guild, channel)
+        else:
+            await init_bac_leaderboard_helper(guild, channel)
+        self.created += 1
+
+    async def reconcile_guild(self, guild: discord.Guild) -> None:
+        try:
+            await ensure_bot_role(guild)
+            logging.info(f"Rola bota zaktualizowana dla serwera: {guild.name}")
+        except Exception as e:
+            logging.error(f"Błąd przy aktualizacji roli na serwerze {guild.name}: {e}")
+        channel = guild.get_channel(get_guild_settings(guild).get("dedicated_channel_id"))
+        if not channel:
+            logging.warning(f"Dedykowany kanał nie ustawiony dla {guild.name}")
+            return
+        await self.reconcile_status(guild, channel)
+        await self.reconcile_leaderboard(guild, channel, "monthly")
+        await self.reconcile_leaderboard(guild, channel, "bac")
+
+    async def run(self, guilds) -> bool:
+        """Uzgadnia wszystkie serwery; False, jeśli bootstrap już się odbył."""
+        if self.done:
+            return False
+        self.done = True
+        fanout = fanouts["bootstrap"]
+        await fanout.run(guilds, self.reconcile_guild)
+        self.ready_seconds = time.monotonic() - self.process_started
+        logging.info(f"Gotowy po {self.ready_seconds:.1f}s: {len(guilds)} serwerów, {self.stats()}, "
+                     f"przebieg: {fanout.stats()}")
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "ready_seconds": round(self.ready_seconds, 2) if self.ready_seconds is not None else None,
+            "reused": self.reused,
+            "created": self.created,
+            "reactions_added": self.reactions_added,
+            "reactions_skipped": self.reactions_skipped,
+        }
+
+
+bootstrap = Bootstrap()
+
+
 # ---------------------------------------------
 # DODATKOWA FUNKCJA: Zapewnienie dedykowanej roli bota
 # ---------------------------------------------
@@ -784,6 +3710,7 @@ async def ensure_bot_role(guild: discord.Guild):
     bot_role = discord.utils.get(guild.roles, name=role_name)
 
     if bot_role is None:
+        await rest_budget.acquire("guild", guild.id)
         bot_role = await guild.create_role(
             name=role_name,
             hoist=False,
@@ -795,9 +3722,11 @@ async def ensure_bot_role(guild: discord.Guild):
 
     max_position = len(guild.roles) - 1
     if bot_role.position != max_position:
+        await rest_budget.acquire("guild", guild.id)
         await bot_role.edit(position=max_position, reason="Przeniesienie roli bota na szczyt hierarchii")
 
     if bot_role not in bot_member.roles:
+        await rest_budget.acquire("guild", guild.id)
         await bot_member.add_roles(bot_role, reason="Przypisanie dedykowanej roli do bota")
 
 
@@ -806,49 +3735,29 @@ async def ensure_bot_role(guild: discord.Guild):
 # ---------------------------------------------
 @bot.event
 async def on_ready():
+    if not data_loaded:
+        # Zwykle dane są już wczytane przed bot.run(); bez nich bot nie może działać ani zapisywać
+        try:
+            load_data()
+        except Exception as e:
+            logging.critical(f"Nie udało się wczytać danych – zamykam bota bez zapisu: {e}")
+            await bot.close()
+            raise
     try:
         await bot.change_presence(status=discord.Status.invisible)
         logging.info(f"Bot {bot.user} jest teraz niewidoczny.")
         logging.info(f"Zalogowano jako {bot.user}")
-        load_data()
-        for guild in bot.guilds:
-            try:
-                await ensure_bot_role(guild)
-                logging.info(f"Rola bota zaktualizowana dla serwera: {guild.name}")
-            except Exception as e:
-                logging.error(f"Błąd przy aktualizacji roli na serwerze {guild.name}: {e}")
-        for guild in bot.guilds:
-            settings = get_guild_settings(guild)
-            channel = guild.get_channel(settings.get("dedicated_channel_id"))
-            if channel:
-                try:
-                    if settings.get("status_message_id"):
-                        try:
-                            old_msg = await channel.fetch_message(settings["status_message_id"])
-                            await old_msg.delete()
-                        except discord.NotFound:
-                            pass
-                    if settings.get("live_leaderboard_message_id"):
-                        try:
-                            old_lb = await channel.fetch_message(settings["live_leaderboard_message_id"])
-                            await old_lb.delete()
-                        except discord.NotFound:
-                            pass
-                    if settings.get("bac_leaderboard_message_id"):
-                        try:
-                            old_bac = await channel.fetch_message(settings["bac_leaderboard_message_id"])
-                            await old_bac.delete()
-                        except discord.NotFound:
-                            pass
-                except discord.Forbidden:
-                    logging.warning(f"Brak uprawnień do usunięcia starych wiadomości na {guild.name}")
-                await init_status_message_helper(guild, channel)
-                await init_leaderboard_helper(guild, channel)
-                await init_bac_leaderboard_helper(guild, channel)
-            else:
-                logging.warning(f"Dedykowany kanał nie ustawiony dla {guild.name}")
+        if not persister.running:
+            # Ponowne on_ready (reconnect) nie wczytuje danych ponownie – nie nadpisze niezapisanych zmian
+            persister.start()
+            await metrics.start()
+        if not await bootstrap.run(owned_guilds()):
+            logging.info("Wznowiono połączenie, pomijam ponowną inicjalizację serwerów")
+            return
         update_tasks.start()
         update_owner_status_task.start()
+        prune_expired_task.start()
+        roll_up_history_task.start()
         # update_all_nicknames.start()
     except Exception as e:
         logging.error(f"Exception in on_ready: {e}")
@@ -859,41 +3768,75 @@ async def on_ready():
 # ---------------------------------------------
 @bot.event
 async def on_guild_join(guild: discord.Guild):
+    if not owns_guild(guild.id):
+        return
     try:
-        await ensure_bot_role(guild)
-        logging.info(f"Rola bota ustawiona dla nowego serwera: {guild.name}")
-        settings = get_guild_settings(guild)
-        channel = guild.get_channel(settings.get("dedicated_channel_id"))
-        if channel:
-            await init_status_message_helper(guild, channel)
-            await init_leaderboard_helper(guild, channel)
-            await init_bac_leaderboard_helper(guild, channel)
-        else:
-            logging.warning(f"Dedykowany kanał nie ustawiony dla {guild.name}")
+        await bootstrap.reconcile_guild(guild)
     except Exception as e:
         logging.error(f"Błąd przy konfiguracji nowego serwera {guild.name}: {e}")
 
 
+# ---------------------------------------------
+# EVENTY CZŁONKÓW: aktualizacja indeksu nazw
+# ---------------------------------------------
+@bot.event
+async def on_member_join(member: discord.Member):
+    member_directory.add(member)
+
+
+@bot.event
+async def on_member_remove(member: discord.Member):
+    member_directory.remove(member)
+
+
+@bot.event
+async def on_member_update(before: discord.Member, after: discord.Member):
+    if before.display_name != after.display_name or before.name != after.name or before.nick != after.nick:
+        member_directory.update(before, after)
+        response_cache.invalidate(after.guild.id)
+
+
 # ---------------------------------------------
 # NOWE ZADANIE: AKTUALIZACJA STATUSU WŁAŚCICIELA CO GODZINĘ
 # ---------------------------------------------
 @tasks.loop(hours=1)
 async def update_owner_status_task():
-    for guild in bot.guilds:
+    async def update_owner(guild):
         owner = await get_member(guild, guild.owner_id)
         if owner:
             # await update_nickname(owner)
             logging.info(f"Aktualizacja statusu właściciela {owner.name} na {guild.name}")
-    save_data()
+
+    await fanouts["owner_status"].run(owned_guilds(), update_owner)
+    logging.info(f"Kolejka reakcji: {reaction_ingest.stats()}")
+    logging.info(f"Cache odpowiedzi komend: {response_cache.stats()}")
+    await persister.flush()
 
 
 # ---------------------------------------------
 # START BOTA
 # ---------------------------------------------
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "migrate":
+        # python bot.py migrate [data.json] [data.db | katalog]
+        migrate_json_storage(*sys.argv[2:4])
+        sys.exit(0)
+    if len(sys.argv) > 1 and sys.argv[1] == "export":
+        # python bot.py export [data.export.json]
+        export_data(*sys.argv[2:3])
+        sys.exit(0)
     load_dotenv()
     TOKEN = os.getenv("DISCORD_TOKEN")
     if TOKEN:
+        try:
+            # Przed połączeniem: nieczytelne dane albo nowszy schemat kończą proces, zanim cokolwiek zostanie zapisane
+            load_data()
+        except Exception as e:
+            logging.critical(f"Nie udało się wczytać danych, bot nie zostanie uruchomiony: {e}")
+            sys.exit(1)
         bot.run(TOKEN)
+        # Zmiany, których pętla zapisu nie zdążyła zapisać
+        if dirty_rows:
+            save_data()
     else:
         logging.error("Brak tokena Discord!")
@@ -0,0 +1,24 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import bot  # noqa: E402
+
+MODULE_TABLES = ("dirty_rows", "deleted_keys", "guild_versions", "bac_states", "bac_columns", "monthly_rankings")
+
+
+@pytest.fixture
+def state(tmp_path, monkeypatch):
+    """Czysty stan modułu bot; pliki danych trafiają do tmp_path."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(bot, "guild_data", bot.GuildCache())
+    monkeypatch.setattr(bot, "storage", None)
+    monkeypatch.setattr(bot, "data_loaded", False)
+    monkeypatch.setattr(bot, "journal", bot.MutationJournal(enabled=False))
+    for name in MODULE_TABLES:
+        getattr(bot, name).clear()
+    yield bot
+    for name in MODULE_TABLES:
+        getattr(bot, name).clear()
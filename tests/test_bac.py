@@ -0,0 +1,54 @@
+import random
+import datetime
+from datetime import timezone
+
+import pytest
+
+GID = "1"
+START = 1_700_000_000.0
+
+
+def consume(bot, uid: str, typ: str, epoch: float) -> None:
+    bot.apply_mutation({"op": "consume", "g": GID, "u": uid, "typ": typ, "dose": 1, "ts": epoch,
+                        "month": bot.get_current_month(), "nick": f"user{uid}"})
+
+
+def set_weight(bot, uid: str, weight: float) -> None:
+    bot.apply_mutation({"op": "setweight", "g": GID, "u": uid, "weight": weight})
+
+
+def assert_matches_reference(bot, now: float) -> None:
+    users = bot.guild_data[GID].users
+    now_dt = datetime.datetime.fromtimestamp(now, timezone.utc)
+    batch = bot.guild_bac_values(GID, users, now)
+    for uid, data in users.items():
+        expected = bot.compute_bac(data, data.weight, now_dt)
+        assert batch.get(uid, 0.0) == pytest.approx(expected, abs=1e-9), uid
+        assert bot.user_bac(GID, uid, data, now) == pytest.approx(expected, abs=1e-9), uid
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_batch_and_cache_match_compute_bac(state, seed):
+    rng = random.Random(seed)
+    state.guild_data[GID] = state.GuildRecord()
+    now = START
+    for step in range(300):
+        now += rng.uniform(30, 600)
+        uid = str(rng.randrange(15))
+        if rng.random() < 0.2 and uid in state.guild_data[GID].users:
+            set_weight(state, uid, rng.uniform(40.0, 130.0))
+        else:
+            consume(state, uid, rng.choice(state.SUBSTANCE_KEYS), now - rng.uniform(0, 3600))
+        if step % 5 == 0:
+            assert_matches_reference(state, now)
+
+
+def test_weight_change_restores_events_dropped_under_old_weight(state):
+    consume(state, "1", "piwo", START)
+    # Przy 120 kg piwo wyzerowuje się po ~1,9 h – kolumny wyrzucają zdarzenie
+    set_weight(state, "1", 120.0)
+    assert_matches_reference(state, START + 2.5 * 3600)
+    # Przy 50 kg to samo piwo wciąż działa
+    set_weight(state, "1", 50.0)
+    assert_matches_reference(state, START + 2.5 * 3600)
+    assert state.guild_bac_values(GID, state.guild_data[GID].users, START + 2.5 * 3600)["1"] > 0
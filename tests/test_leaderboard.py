@@ -0,0 +1,74 @@
+import asyncio
+import time
+import types
+
+import pytest
+
+START = 1_700_000_000.0
+
+
+def test_bac_board_is_rebuilt_at_most_once_per_interval(state):
+    refresher = state.LeaderboardRefresher(min_interval=60.0)
+    key = ("1", "bac")
+    assert refresher._due(key, START)
+    refresher.last_refresh[key] = START
+    refresher.next_bac_refresh["1"] = START + 5  # zaokrąglona wartość zmienia się po 5 s
+
+    state.mark_dirty("1", "2")  # nowe spożycie
+    assert not refresher._due(key, START + 15)
+    assert not refresher._due(key, START + 45)
+    assert refresher._due(key, START + 60)
+
+
+def test_bac_board_waits_for_next_change_above_the_floor(state):
+    refresher = state.LeaderboardRefresher(min_interval=60.0)
+    key = ("1", "bac")
+    assert refresher._due(key, START)
+    refresher.last_refresh[key] = START
+    refresher.next_bac_refresh["1"] = START + 300
+    assert not refresher._due(key, START + 60)
+    assert not refresher._due(key, START + 299)
+    assert refresher._due(key, START + 300)
+
+
+def test_footer_points_to_text_page_with_next_place(state):
+    embed = state.discord.Embed()
+    # Embed pokazuje miejsca 1–25, komenda tekstowa ma strony po 10 wierszy
+    state.set_page_footer(embed, 1, 25, 100, 1, "leaderboard_promile", 10)
+    assert embed.footer.text.endswith(f"{state.BOT_PREFIX}leaderboard_promile 3")
+    state.set_page_footer(embed, 26, 25, 100, 2, "leaderboard_promile", 10)
+    assert embed.footer.text.endswith(f"{state.BOT_PREFIX}leaderboard_promile 6")
+    state.set_page_footer(embed, 76, 25, 100, 4, "leaderboard_promile", 10)
+    assert "więcej" not in embed.footer.text
+
+
+def test_bac_embed_skips_users_removed_after_ranking(state):
+    guild = state.discord.Object(id=1)
+    for uid in ("1", "2"):
+        state.apply_mutation({"op": "consume", "g": "1", "u": uid, "typ": "piwo", "dose": 1, "ts": START,
+                              "month": state.get_current_month(), "nick": f"user{uid}"})
+    bac_list = [("1", 0.5), ("2", 0.4)]
+    del state.guild_data["1"].users["2"]  # -clear w trakcie await bac_ranking()
+    embed = state.build_bac_leaderboard_embed(guild, bac_list=bac_list)
+    assert [field.name for field in embed.fields] == ["1. user1"]
+
+
+@pytest.mark.parametrize("command", ["leaderboard", "leaderboard_promile"])
+def test_text_board_survives_clear_during_name_lookup(state, monkeypatch, command):
+    for uid in ("1", "2"):
+        state.apply_mutation({"op": "consume", "g": "1", "u": uid, "typ": "piwo", "dose": 1, "ts": time.time(),
+                              "month": state.get_current_month(), "nick": None})
+
+    async def resolve(guild, user_ids):
+        state.guild_data["1"].users.pop("2")  # -clear w trakcie zapytania o członków
+        return {int(user_id): f"name{user_id}" for user_id in user_ids}
+
+    monkeypatch.setattr(state.member_directory, "resolve", resolve)
+    sent = []
+
+    async def send(text):
+        sent.append(text)
+
+    ctx = types.SimpleNamespace(guild=types.SimpleNamespace(id=1, name="g"), send=send)
+    asyncio.run(state.bot.get_command(command).callback(ctx))
+    assert "name1" in sent[0] and "name2" in sent[0]
@@ -0,0 +1,30 @@
+import asyncio
+import socket
+
+import pytest
+
+
+def test_busy_metrics_port_does_not_stop_startup(state, monkeypatch):
+    if state.web is None:
+        pytest.skip("brak aiohttp")
+    with socket.socket() as busy:
+        busy.bind(("127.0.0.1", 0))
+        busy.listen()
+        monkeypatch.setattr(state, "METRICS_HOST", "127.0.0.1")
+        monkeypatch.setattr(state, "METRICS_PORT", busy.getsockname()[1])
+        metrics = state.Metrics(enabled=True)
+
+        async def run():
+            await metrics.start()
+            metrics._lag_task.cancel()
+
+        asyncio.run(run())
+    assert metrics._runner is None
+
+
+def test_expiry_scheduler_is_exported(state, monkeypatch):
+    monkeypatch.setattr(state, "expiry_scheduler", state.ExpiryScheduler())
+    state.expiry_scheduler.push("1", "2", 0, 1_700_000_000.0, 1, 80.0)
+    counters = {name: value for name, _, value in state.collect_counters()}
+    assert counters["expiry_heap_size"] == 1
+    assert counters["expiry_pruned_total"] == 0
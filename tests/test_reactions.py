@@ -0,0 +1,40 @@
+import asyncio
+import types
+
+
+class FakeMessage:
+    def __init__(self, message_id: int):
+        self.id = message_id
+        self.channel = types.SimpleNamespace(id=10)
+        self.removed = []
+
+    async def remove_reaction(self, emoji, member):
+        self.removed.append((emoji, member.id))
+
+    async def clear_reaction(self, emoji):
+        self.removed.append((emoji, None))
+
+    async def add_reaction(self, emoji):
+        pass
+
+
+def test_failing_tap_does_not_drop_the_batch(state):
+    guild = types.SimpleNamespace(id=1)
+    message = FakeMessage(100)
+    state.apply_mutation({"op": "setweight", "g": "1", "u": "2", "weight": 0.0, "nick": "zero"})
+
+    async def run():
+        ingest = state.ReactionIngest(clear_threshold=10)
+        for user_id in (1, 2, 3):
+            ingest.submit(guild, message, "🍺", user_id, f"user{user_id}")
+        ingest._task.cancel()
+        await ingest.drain()
+        return ingest
+
+    ingest = asyncio.run(run())
+    assert ingest.committed == 2
+    assert ingest.failed == 1
+    users = state.guild_data["1"].users
+    assert sum(users["1"].month_counts(state.get_current_month())) == 1
+    assert sum(users["3"].month_counts(state.get_current_month())) == 1
+    assert sorted(user_id for _, user_id in message.removed) == [1, 2, 3]
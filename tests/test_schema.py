@@ -0,0 +1,164 @@
+import asyncio
+import copy
+import json
+import math
+import types
+
+import pytest
+
+
+class FakeContext:
+    def __init__(self):
+        self.guild = types.SimpleNamespace(id=1)
+        self.sent = []
+        self.dms = []
+        self.author = types.SimpleNamespace(id=2, name="user", send=self._dm)
+        self.message = types.SimpleNamespace(delete=self._delete)
+
+    async def send(self, text):
+        self.sent.append(text)
+
+    async def _dm(self, text):
+        self.dms.append(text)
+
+    async def _delete(self):
+        pass
+
+
+@pytest.mark.parametrize("weight", [0.0, -70.0, 1000.0, math.nan, math.inf])
+def test_setweight_rejects_what_validation_rejects(state, weight):
+    ctx = FakeContext()
+    asyncio.run(state.setweight.callback(ctx, weight))
+    assert ctx.sent and not ctx.dms
+    assert "1" not in state.guild_data
+    assert not state.valid_weight(weight)
+
+
+def test_setweight_accepts_valid_weight(state):
+    ctx = FakeContext()
+    asyncio.run(state.setweight.callback(ctx, 72.5))
+    assert state.guild_data["1"].users["2"].weight == 72.5
+    assert ctx.dms and not ctx.sent
+
+
+LEGACY_V0 = {
+    "guilds": {},
+    "111": {
+        "settings": {
+            "status_message_id": "555",
+            "dedicated_channel_id": 777,
+            "live_leaderboard_channel_id": "888",
+            "live_leaderboard_message_id": None,
+            "bac_leaderboard_message_id": "not-an-id",
+        },
+        "users": {
+            "1": {"original_nick": "ok", "weight": 70.0, "display_mode": "emoji",
+                  "consumptions": {"piwo": [{"dose": 1, "timestamp": "2024-05-01T20:00:00+00:00"}]},
+                  "monthly_usage": {"2024-05": {"piwo": 3}}},
+            "2": {"original_nick": "bad", "weight": "abc", "display_mode": "fancy",
+                  "consumptions": {}, "monthly_usage": {}},
+            "3": {"original_nick": 123, "weight": 0, "display_mode": "promile",
+                  "consumptions": {}, "monthly_usage": {}},
+        },
+    },
+    "222": {"settings": {"status_message_id": 999}, "users": {}},
+}
+
+
+def write_legacy(state) -> None:
+    with open(state.DATA_FILE, "w", encoding="utf-8") as f:
+        json.dump(LEGACY_V0, f)
+
+
+def test_migrations_and_validation_counts(state):
+    data = state.GuildCache(state.records_from_json(copy.deepcopy(LEGACY_V0)))
+    assert state.migrate_schema(data) == state.SCHEMA_VERSION
+    assert "guilds" not in data
+    assert data["_meta"]["schema"] == state.SCHEMA_VERSION
+    assert data["111"].settings == {"status_message_id": 555, "dedicated_channel_id": 777,
+                                    "live_leaderboard_channel_id": 888}
+    assert state.validate_guild("111", data["111"]) == 2
+    assert state.validate_guild("222", data["222"]) == 0
+    users = data["111"].users
+    assert (users["1"].weight, users["1"].display_mode) == (70.0, "emoji")
+    assert (users["2"].weight, users["2"].display_mode) == (80.0, "promile")
+    assert (users["3"].weight, users["3"].original_nick) == (80.0, "123")
+    assert state.dirty_rows["111"] >= {None, "2", "3"}
+
+
+def test_legacy_file_is_upgraded_on_load_and_saved(state):
+    write_legacy(state)
+    state.load_data()
+    assert not state.dirty_rows
+
+    saved = state.read_payload(state.DATA_FILE)
+    assert "guilds" not in saved
+    assert saved["_meta"]["schema"] == state.SCHEMA_VERSION
+    assert saved["111"]["settings"]["status_message_id"] == 555
+    assert "live_leaderboard_message_id" not in saved["111"]["settings"]
+    assert saved["111"]["users"]["2"]["weight"] == 80.0
+    assert saved["111"]["users"]["1"]["consumptions"]["piwo"][0]["timestamp"] == pytest.approx(1714593600.0)
+    assert saved["111"]["users"]["1"]["monthly_usage"] == {"2024-05": {"piwo": 3}}
+
+    # Drugie wczytanie: nic do migracji ani poprawiania
+    state.load_data()
+    assert state.migrate_schema(state.guild_data) == 0
+    assert all(state.validate_guild(gid, state.guild_data[gid]) == 0 for gid in ("111", "222"))
+    assert state.read_payload(state.DATA_FILE) == saved
+
+
+def test_malformed_legacy_entries_are_skipped(state):
+    legacy = copy.deepcopy(LEGACY_V0)
+    user = legacy["111"]["users"]["1"]
+    user["consumptions"]["piwo"] += [{"dose": "jeden", "timestamp": "2024-05-01T21:00:00+00:00"},
+                                     {"dose": 1, "timestamp": "wczoraj"}, "śmieci"]
+    user["consumptions"]["wodka"] = "nie lista"
+    user["monthly_usage"]["2024-05"]["wino"] = "2"
+    user["monthly_usage"]["2024-04"] = None
+    with open(state.DATA_FILE, "w", encoding="utf-8") as f:
+        json.dump(legacy, f)
+    state.load_data()
+
+    users = state.guild_data["111"].users
+    record = users["1"].to_dict()
+    assert [e["dose"] for e in record["consumptions"]["piwo"]] == [1]
+    assert record["consumptions"]["wodka"] == []
+    assert record["monthly_usage"] == {"2024-05": {"piwo": 3}}
+    assert users["2"].weight == 80.0
+    assert state.read_payload(state.DATA_FILE)["111"]["users"]["1"]["monthly_usage"] == {"2024-05": {"piwo": 3}}
+
+
+def test_newer_schema_is_refused_and_never_overwritten(state):
+    with open(state.DATA_FILE, "w", encoding="utf-8") as f:
+        json.dump({"_meta": {"schema": state.SCHEMA_VERSION + 1}, "111": {"settings": {}, "users": {}}}, f)
+    with open(state.DATA_FILE, "rb") as f:
+        before = f.read()
+    with pytest.raises(RuntimeError):
+        state.load_data()
+    assert not state.data_loaded
+
+    # Komenda po nieudanym starcie nie może zapisać pustego stanu w miejsce pliku
+    asyncio.run(state.setweight.callback(FakeContext(), 72.5))
+    state.save_data()
+    with open(state.DATA_FILE, "rb") as f:
+        assert f.read() == before
+
+
+@pytest.mark.parametrize("engine, target", [("sqlite", "data.db"), ("sharded", "guilds")])
+def test_legacy_file_migrated_to_lazy_engine(state, monkeypatch, engine, target):
+    write_legacy(state)
+    state.migrate_json_storage(state.DATA_FILE, target)
+    monkeypatch.setattr(state, "STORAGE_ENGINE", engine)
+    state.load_data()
+    assert state.guild_data.settings["111"] == {"status_message_id": 555, "dedicated_channel_id": 777,
+                                                "live_leaderboard_channel_id": 888}
+    assert state.guild_data["111"].users["2"].weight == 80.0
+    state.save_data()  # poprawki z leniwego wczytania gildii czekają na zapis
+    state.get_storage().close()
+
+    monkeypatch.setattr(state, "storage", None)
+    state.load_data()
+    assert state.migrate_schema(state.guild_data) == 0
+    assert state.validate_guild("111", state.guild_data["111"]) == 0
+    assert state.guild_data.settings["111"]["status_message_id"] == 555
+    state.get_storage().close()